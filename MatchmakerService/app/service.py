@@ -0,0 +1,117 @@
+import asyncio
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Optional
+from botocore.exceptions import ClientError
+from awsClients import get_client
+from leaderLease import LeaderLeaseRepository
+from queueState import QueueState, StreamQueueFeed, StreamFeedExpired
+from websocketNotifier import WebSocketNotifier
+import tryCreateMatch as matcher # tryCreateMatchHandler/app.py, copied by the Dockerfile
+
+control_table_name = os.environ['CONTROL_TABLE_NAME']
+websocket_domain_name = os.environ['WEBSOCKET_DOMAIN_NAME']
+websocket_endpoint_url = os.environ.get('WEBSOCKET_ENDPOINT_URL', f"https://{websocket_domain_name}") # Overridden to test locally
+instance_id = os.environ.get('INSTANCE_ID') or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+lease_seconds = float(os.environ.get('LEASE_SECONDS', '10'))
+match_interval = float(os.environ.get('MATCH_INTERVAL_SECONDS', '0.5'))
+use_leader_lease = os.environ.get('USE_LEADER_LEASE', 'true') == 'true' # Without it every instance matches, players are claimed so none is matched twice
+
+LEASE_RENEWALS = 3 # Renewals attempted per lease duration, so a slow renewal doesn't lose the lease
+
+class MatchmakerService:
+    """
+    Long running matchmaker. Every instance competes for the leader lease, the leader keeps the queue
+    in memory from the connection table stream and matches it continuously, the others wait as standbys.
+    """
+    def __init__(self, owner_id: str):
+        self.owner_id = owner_id
+        self.lease = LeaderLeaseRepository(control_table_name)
+        self.lease_term: Optional[int] = None
+        self.lease_expires_at = 0.0 # Monotonic time when the held lease expires
+        self.stopping = asyncio.Event()
+
+    def lease_deadline(self):
+        """
+        Time until which the leader can safely commit matches, in the past when this instance is not the leader.
+        The last renewal period of the lease is kept as a margin for clock drift and slow requests.
+        """
+        return self.lease_expires_at - lease_seconds / LEASE_RENEWALS
+
+    def is_leader(self):
+        return not use_leader_lease or time.monotonic() < self.lease_deadline()
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self.stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def hold_lease(self):
+        while not self.stopping.is_set():
+            requested_at = time.monotonic()
+            try:
+                term = await asyncio.to_thread(self.lease.try_acquire, self.owner_id, lease_seconds)
+            except ClientError as e:
+                print(f"Error renewing the leader lease: {e}")
+                term = None
+
+            if term is not None:
+                if term != self.lease_term:
+                    print(f"{self.owner_id} is the leader, term {term}")
+                self.lease_term = term
+                self.lease_expires_at = requested_at + lease_seconds # Counted from the request, the write may have been slow
+            elif self.lease_term is not None and not self.is_leader():
+                print(f"{self.owner_id} lost the leader lease")
+                self.lease_term = None
+            await self._sleep(lease_seconds / LEASE_RENEWALS)
+
+        if self.lease_term is not None:
+            await asyncio.to_thread(self.lease.release, self.owner_id)
+
+    async def match_continuously(self):
+        notifier = WebSocketNotifier(get_client('apigatewaymanagementapi', endpoint_url=websocket_endpoint_url))
+        wssRepo, _ = matcher.new_repositories() # Only used by one thread at a time, to load the queue
+
+        queue_state: Optional[QueueState] = None
+        queue_feed: Optional[StreamQueueFeed] = None
+        while not self.stopping.is_set():
+            if not self.is_leader():
+                queue_state = queue_feed = None # Changes are not followed while standing by, the queue is reloaded on takeover
+                await self._sleep(lease_seconds / LEASE_RENEWALS)
+                continue
+
+            tick_started_at = time.monotonic()
+            try:
+                if queue_state is None or queue_feed is None:
+                    queue_state, queue_feed = await asyncio.to_thread(matcher.start_stream_queue, wssRepo)
+                else:
+                    await asyncio.to_thread(queue_feed.poll)
+
+                regions = set(matcher.matchmaking_regions + queue_state.regions())
+                await asyncio.gather(*(
+                    asyncio.to_thread(matcher.match_region_in_thread, region, notifier, self.lease_deadline() if use_leader_lease else time.monotonic() + matcher.region_time_budget, queue_state.region_queue(region), queue_state)
+                    for region in regions
+                ))
+            except StreamFeedExpired:
+                print("Stream position lost, reloading the queue")
+                queue_state = queue_feed = None
+            except ClientError as e:
+                print(f"Error matching the queue: {e}")
+
+            await self._sleep(max(0.0, match_interval - (time.monotonic() - tick_started_at)))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM): # ECS stops tasks with SIGTERM
+            loop.add_signal_handler(signal_number, self.stopping.set)
+        if use_leader_lease:
+            await asyncio.gather(self.hold_lease(), self.match_continuously())
+        else:
+            await self.match_continuously()
+
+if __name__ == '__main__':
+    asyncio.run(MatchmakerService(instance_id).run())
@@ -0,0 +1,142 @@
+"""
+Runs many matchers at once over the same queue in a local DynamoDB and asserts that no player ends up in two matches.
+Every matcher reads the whole queue and tries the same matches, so claims collide as much as possible.
+
+AWS_ENDPOINT_URL_DYNAMODB=http://localhost:8000 python MatchmakerService/createLocalTables.py
+AWS_ENDPOINT_URL_DYNAMODB=http://localhost:8000 python -m pytest MatchmakerService/claimStressTest.py
+AWS_ENDPOINT_URL_DYNAMODB=http://localhost:8000 python MatchmakerService/claimStressTest.py --players 2000 --matchers 8
+"""
+import argparse
+import unittest
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+environment = os.environ.get('ENVIRONMENT', 'DEV')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+os.environ.setdefault('AWS_ENDPOINT_URL_DYNAMODB', 'http://localhost:8000')
+os.environ.setdefault('CONNECTION_TABLE_NAME', f'WebsocketConnections_{environment}')
+os.environ.setdefault('CONNECTION_TABLE_PK', 'ConnectionId')
+os.environ.setdefault('DATA_TABLE_NAME', f'UserMatchMakingData_{environment}')
+os.environ.setdefault('DATA_TABLE_PK', 'UserId')
+os.environ.setdefault('CONNECTION_TABLE_QUEUE_INDEX', 'QueueIndex')
+os.environ.setdefault('MATCHMAKING_REGIONS', 'stress-region')
+
+repository_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repository_root, 'matchmakingApi'))
+sys.path.insert(0, os.path.join(repository_root, 'matchmakingApi', 'WEBSOCKET', 'tryCreateMatchHandler'))
+
+import app as matcher # tryCreateMatch handler
+from matchmakingTableRepository import WebSocketRepository, Match
+from websocketNotifier import NotificationResult
+
+REGION = 'stress-region'
+
+class AlwaysSentNotifier:
+    """
+    Stands in for the websocket API, every message is delivered
+    """
+    def post(self, connection_ids: list[str], message: str):
+        result = NotificationResult()
+        result.sent.extend(connection_ids)
+        return result
+
+def new_repository():
+    return WebSocketRepository(matcher.connection_table_name, matcher.connection_table_pk, matcher.data_table_name, matcher.data_table_pk, matcher.connection_table_queue_index)
+
+def seed_queue(players: int, run_id: str):
+    def seed(index: int):
+        wssRepo = new_repository() # Resources can't be shared between the seeding threads
+        user_id = f"stress-{run_id}-user-{index}"
+        connection_id = f"stress-{run_id}-connection-{index}"
+        wssRepo._matchMakingDataRepo.set_user_data(user_id, REGION, rating=int(random.gauss(1500, 200)), rd=70)
+        wssRepo.connect(connection_id, user_id)
+        wssRepo.join_queue(connection_id)
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(seed, range(players)))
+
+class StressResult:
+    def __init__(self, matches: list[Match], matched_connections: list[str], left_in_queue: list, not_in_match: list[str], runs: list[int], elapsed: float):
+        self.matches = matches
+        self.matched_connections = matched_connections
+        self.duplicates = len(matched_connections) - len(set(matched_connections))
+        self.left_in_queue = left_in_queue
+        self.matched_in_queue = set(matched_connections) & {user.connection_id for user in left_in_queue}
+        self.not_in_match = not_in_match
+        self.runs = runs
+        self.elapsed = elapsed
+
+def run_stress(players: int, matchers: int, seed: int = 0):
+    random.seed(seed)
+    run_id = f"{int(time.time())}-{random.getrandbits(32):08x}"
+
+    wssRepo = new_repository()
+    seed_queue(players, run_id)
+    print(f"Seeded {players} players")
+
+    matches:list[Match] = []
+    matches_lock = threading.Lock()
+    def record_match(match: Match, pool=None):
+        with matches_lock:
+            matches.append(match)
+        return False
+    matcher.create_match = record_match # No game servers locally
+
+    notifier = AlwaysSentNotifier()
+    def run_matcher(_):
+        repository = new_repository()
+        runs = 0
+        while True: # Stops when a whole run doesn't create any match
+            runs += 1
+            created, _ = matcher.match_region(REGION, repository, notifier, time.monotonic() + 60)
+            if created == 0:
+                return runs
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=matchers) as executor:
+        runs = list(executor.map(run_matcher, range(matchers)))
+    elapsed = time.perf_counter() - started_at
+
+    matched_connections = [user.connection_id for match in matches for user in match.team1 + match.team2]
+    left_in_queue = [user for user in wssRepo.get_region_queue_users(REGION) if user.connection_id.startswith(f"stress-{run_id}-")]
+    not_in_match = [
+        user.user_id for match in matches for user in match.team1 + match.team2
+        if not wssRepo._matchMakingDataRepo.get_user_data(user.user_id, user.connection_id)[1]
+    ]
+    return StressResult(matches, matched_connections, left_in_queue, not_in_match, runs, elapsed)
+
+class ClaimStressTest(unittest.TestCase):
+    PLAYERS = 200
+    MATCHERS = 4
+
+    def test_no_player_matched_twice(self):
+        result = run_stress(self.PLAYERS, self.MATCHERS)
+        self.assertTrue(result.matches, "No match was created")
+        self.assertEqual(result.duplicates, 0, "Players matched twice")
+        self.assertFalse(result.matched_in_queue, "Matched players still in queue")
+        self.assertFalse(result.not_in_match, "Matched players not set in match")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--matchers', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    result = run_stress(args.players, args.matchers, args.seed)
+    print(f"{len(result.matches)} matches by {args.matchers} matchers in {result.elapsed:.2f}s ({len(result.matches) / result.elapsed:.1f} matches/s), runs per matcher {result.runs}")
+    print(f"Players matched twice: {result.duplicates}")
+    print(f"Matched players still in queue: {len(result.matched_in_queue)}")
+    print(f"Matched players not set in match: {len(result.not_in_match)}")
+    print(f"Players left in queue: {len(result.left_in_queue)}")
+    assert result.duplicates == 0, "Players matched twice"
+    assert not result.matched_in_queue, "Matched players still in queue"
+    assert not result.not_in_match, "Matched players not set in match"
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Creates the tables used by the matchmaker service in a local DynamoDB (amazon/dynamodb-local),
+with the same keys, queue index and stream as api.yaml.
+
+AWS_ENDPOINT_URL_DYNAMODB=http://localhost:8000 python MatchmakerService/createLocalTables.py
+"""
+import os
+import boto3
+
+def create_table(dynamodb, name: str, key_schema: list, attributes: list, **kwargs):
+    if name in dynamodb.list_tables()['TableNames']:
+        print(f"{name} already exists")
+        return
+    dynamodb.create_table(
+        TableName=name,
+        KeySchema=key_schema,
+        AttributeDefinitions=attributes,
+        BillingMode='PAY_PER_REQUEST',
+        **kwargs
+    )
+    print(f"Created {name}")
+
+def create_tables(dynamodb, environment: str):
+    """
+    Creates every table of the environment that doesn't exist yet, dynamodb is a boto3 client
+    """
+    create_table(
+        dynamodb,
+        f'UserMatchMakingData_{environment}',
+        [{'AttributeName': 'UserId', 'KeyType': 'HASH'}],
+        [{'AttributeName': 'UserId', 'AttributeType': 'S'}]
+    )
+    create_table(
+        dynamodb,
+        f'WebsocketConnections_{environment}',
+        [{'AttributeName': 'ConnectionId', 'KeyType': 'HASH'}],
+        [
+            {'AttributeName': 'ConnectionId', 'AttributeType': 'S'},
+            {'AttributeName': 'Matchmaking_Region', 'AttributeType': 'S'},
+            {'AttributeName': 'JoinedAt', 'AttributeType': 'N'}
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'QueueIndex',
+            'KeySchema': [
+                {'AttributeName': 'Matchmaking_Region', 'KeyType': 'HASH'},
+                {'AttributeName': 'JoinedAt', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'ALL'}
+        }],
+        StreamSpecification={'StreamEnabled': True, 'StreamViewType': 'NEW_AND_OLD_IMAGES'}
+    )
+    create_table(
+        dynamodb,
+        f'CurrentMatches_{environment}',
+        [{'AttributeName': 'MatchId', 'KeyType': 'HASH'}],
+        [{'AttributeName': 'MatchId', 'AttributeType': 'S'}]
+    )
+    create_table(
+        dynamodb,
+        f'GameServerPool_{environment}',
+        [
+            {'AttributeName': 'Matchmaking_Region', 'KeyType': 'HASH'},
+            {'AttributeName': 'ServerId', 'KeyType': 'RANGE'}
+        ],
+        [
+            {'AttributeName': 'Matchmaking_Region', 'AttributeType': 'S'},
+            {'AttributeName': 'ServerId', 'AttributeType': 'S'}
+        ]
+    )
+    create_table(
+        dynamodb,
+        f'MatchmakingControl_{environment}',
+        [{'AttributeName': 'ControlKey', 'KeyType': 'HASH'}],
+        [{'AttributeName': 'ControlKey', 'AttributeType': 'S'}]
+    )
+    create_table(
+        dynamodb,
+        f'MatchResults_{environment}',
+        [
+            {'AttributeName': 'RatingPeriod', 'KeyType': 'HASH'},
+            {'AttributeName': 'ResultId', 'KeyType': 'RANGE'}
+        ],
+        [
+            {'AttributeName': 'RatingPeriod', 'AttributeType': 'N'},
+            {'AttributeName': 'ResultId', 'AttributeType': 'S'}
+        ]
+    )
+
+if __name__ == '__main__':
+    environment = os.environ.get('ENVIRONMENT', 'DEV')
+    endpoint_url = os.environ.get('AWS_ENDPOINT_URL_DYNAMODB', 'http://localhost:8000')
+    create_tables(boto3.client('dynamodb', endpoint_url=endpoint_url, region_name=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')), environment)
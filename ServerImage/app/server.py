@@ -4,8 +4,9 @@ import requests
 from requests.auth import HTTPBasicAuth
 import os
 import json
+import secrets
 
-from flask import Flask, render_template
+from flask import Flask, render_template, request
 from flask_socketio import SocketIO, send
 
 app = Flask(__name__)
@@ -15,14 +16,42 @@ socketio = SocketIO(app, async_mode='gevent')
 user_ids_str = os.environ.get('USER_IDS', '')
 connection_ids_str = os.environ.get('CONNECTION_IDS', '')
 server_ready_url = 'http://<YOUR-DOMAIN>/matchmaking/serverReady'
+server_idle_url = 'http://<YOUR-DOMAIN>/matchmaking/serverIdle'
 match_finished_url = 'http://<YOUR-DOMAIN>/matchmaking/matchFinished'
 
-user_ids = user_ids_str.split(',')
-connection_ids = connection_ids_str.split(',')
+# Servers started without players wait in the server pool until a match is assigned to them
+assign_token = secrets.token_urlsafe(32)
+
+user_ids = user_ids_str.split(',') if user_ids_str else []
+connection_ids = connection_ids_str.split(',') if connection_ids_str else []
 
 home = user_ids[int((len(user_ids))/2):]
 away = user_ids[:int((len(user_ids)/2))]
 
+def set_players(new_user_ids, new_connection_ids):
+    global user_ids, connection_ids, home, away
+    user_ids = new_user_ids
+    connection_ids = new_connection_ids
+    home = user_ids[int((len(user_ids))/2):]
+    away = user_ids[:int((len(user_ids)/2))]
+
+def get_task_arn():
+    metadata_uri = os.environ.get('ECS_CONTAINER_METADATA_URI_V4', '')
+    try:
+        return requests.get(metadata_uri + '/task', timeout=2).json()['TaskARN']
+    except Exception as e:
+        print("Could not read the task metadata:", e)
+        return ''
+
+def send_server_ready():
+    body = json.dumps({
+        "user_ids": user_ids,
+        "connection_ids": connection_ids,
+    })
+
+    # Send a POST request with the USER_IDS in the body
+    send_post_request(server_ready_url, body)
+
 def send_post_request(url, data):
     auth = HTTPBasicAuth('DEV_DEDICATED_CLIENT_ID', 'DEV_DEDICATED_CLIENT_SECRET')
     try:
@@ -45,6 +74,18 @@ def send_post_request(url, data):
 def index():
     return render_template('index.html')
 
+@app.route('/assign', methods=['POST'])
+def assign():
+    body = request.get_json(force=True, silent=True) or {}
+    if not secrets.compare_digest(str(body.get('assign_token', '')), assign_token):
+        return 'invalid token', 403
+    if user_ids:
+        return 'already assigned', 409
+    
+    set_players(body.get('user_ids', []), body.get('connection_ids', []))
+    socketio.start_background_task(send_server_ready)
+    return 'OK', 200
+
 @socketio.on('message')
 def handleMessage(msg):
     print('Message: ' + msg)
@@ -91,12 +132,15 @@ def handleMessage(msg):
 
 if __name__ == '__main__':
     
-    body = json.dumps({
-        "user_ids": user_ids,
-        "connection_ids": connection_ids,
-    })
-
-    # Send a POST request with the USER_IDS in the body
-    send_post_request(server_ready_url, body)
+    if user_ids:
+        send_server_ready()
+    else:
+        body = json.dumps({
+            "task_arn": get_task_arn(),
+            "assign_token": assign_token,
+        })
+        
+        # Join the server pool, players are sent later through /assign
+        socketio.start_background_task(send_post_request, server_idle_url, body)
         
     socketio.run(app, host='0.0.0.0', port=80)
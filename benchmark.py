@@ -0,0 +1,291 @@
+"""
+Headless benchmarks of the production matcher and rating code on seeded synthetic queues.
+Prints one JSON object per line with the time, throughput and memory of each run, a summary goes to stderr.
+
+python benchmark.py --sizes 1000,10000,100000,1000000 --team-sizes 1,2,5 --output results.jsonl
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+os.environ.setdefault('CONNECTION_TABLE_NAME', 'benchmark')
+os.environ.setdefault('CONNECTION_TABLE_PK', 'ConnectionId')
+os.environ.setdefault('DATA_TABLE_NAME', 'benchmark')
+os.environ.setdefault('DATA_TABLE_PK', 'UserId')
+
+repository_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(repository_root, 'matchmakingApi'))
+sys.path.insert(0, os.path.join(repository_root, 'matchmakingApi', 'WEBSOCKET', 'tryCreateMatchHandler'))
+
+import app as matcher # tryCreateMatch handler
+import matchmakingTableRepository
+from matchmakingTableRepository import User
+from glicko_team import Player, TeamRatingCalculator
+from searchWindow import SearchWindowCurve, ReevaluationEngine
+
+BENCHMARKS = ['find_matches_from_queue', 'find_matches_from_queue_vectorized', 'find_matches_from_queue_sharded', 'find_intersecting_players', 'reevaluation_anchors', 'split_teams', 'update_player', 'team_rating']
+DEFAULT_BENCHMARKS = ['find_matches_from_queue', 'find_intersecting_players', 'reevaluation_anchors', 'split_teams', 'update_player', 'team_rating']
+RATING_MEAN = 1500
+RATING_SPREAD = 300
+RDS = [30, 50, 70, 120, 200, 350] # Settled players are the most common, new players have the initial rd
+RD_WEIGHTS = [30, 30, 20, 10, 5, 5]
+QUEUE_SECONDS = 600 # Join times are spread over the last 10 minutes
+CANDIDATE_WINDOW = 50 # Players around each anchor handed to find_intersecting_players
+INTERSECTION_CALLS = 100000 # At most, per size
+ARRIVAL_SHARE = 0.01 # Share of the queue that is new on each run after the first, in reevaluation_anchors
+ANCHORS_CURVE = 'shape=linear,step_seconds=10,step_growth=25,max_delta=500'
+
+def set_team_size(team_size: int):
+    """
+    The matcher and repository read the match size from module constants
+    """
+    matchmakingTableRepository.TEAM_SIZE = team_size
+    matchmakingTableRepository.MATCH_SIZE = team_size * 2
+    matcher.MATCH_SIZE = team_size * 2
+
+def synthetic_queue(players: int, seed: int):
+    """
+    Queue of a single region sorted by join time, the same for a given size and seed
+    """
+    rng = random.Random(seed * 1000003 + players)
+    now = int(time.time())
+    joined_at = sorted(rng.randint(now - QUEUE_SECONDS, now) for _ in range(players))
+    rds = rng.choices(RDS, RD_WEIGHTS, k=players)
+    return [
+        User(
+            user_id=f"user-{i}",
+            rating=max(0, int(rng.gauss(RATING_MEAN, RATING_SPREAD))),
+            rd=rds[i],
+            vol=Decimal('0.06'),
+            region='benchmark',
+            joined_at=joined_at[i],
+            connection_id=f"connection-{i}"
+        )
+        for i in range(players)
+    ]
+
+def measure(setup, run, memory: bool):
+    """
+    Times run(setup()), then runs it again under tracemalloc when memory is set.
+    Returns the seconds, the result and the peak bytes allocated by run, None without memory.
+    """
+    argument = setup()
+    started_at = time.perf_counter()
+    result = run(argument)
+    elapsed = time.perf_counter() - started_at
+    if not memory:
+        return elapsed, result, None
+
+    argument = setup()
+    tracemalloc.start()
+    run(argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, result, peak
+
+def bench_matcher(name: str, players: int, team_size: int, seed: int, memory: bool):
+    find_matches = getattr(matcher, name)
+    def setup():
+        random.seed(seed) # The python matcher breaks ties randomly
+        return synthetic_queue(players, seed)
+    elapsed, matches, peak = measure(setup, lambda queue: find_matches(queue), memory)
+    return {
+        'seconds': elapsed,
+        'operations': len(matches),
+        'matches': len(matches),
+        'matched_players': len(matches) * team_size * 2,
+        'matches_per_second': len(matches) / elapsed if elapsed else None,
+        'peak_memory_bytes': peak
+    }
+
+def bench_intersecting_players(players: int, team_size: int, seed: int, memory: bool):
+    """
+    Calls find_intersecting_players with the rating neighbours of anchors spread over the queue
+    """
+    def setup():
+        random.seed(seed)
+        queue = sorted(synthetic_queue(players, seed), key=lambda user: user.rating)
+        step = max(1, players // INTERSECTION_CALLS)
+        return [queue[max(0, anchor - CANDIDATE_WINDOW // 2):anchor + CANDIDATE_WINDOW // 2] for anchor in range(0, players, step)]
+    def run(windows: list[list[User]]):
+        return sum(1 for window in windows if matcher.find_intersecting_players(window))
+    calls = len(range(0, players, max(1, players // INTERSECTION_CALLS)))
+    elapsed, found, peak = measure(setup, run, memory)
+    return {
+        'seconds': elapsed,
+        'operations': calls,
+        'operations_per_second': calls / elapsed if elapsed else None,
+        'matches': found,
+        'matches_per_second': found / elapsed if elapsed else None,
+        'peak_memory_bytes': peak
+    }
+
+def bench_reevaluation_anchors(players: int, team_size: int, seed: int, memory: bool):
+    """
+    ReevaluationEngine.anchors on a cold start, where every player is new, then on a run where ARRIVAL_SHARE of them are.
+    Both should grow as n log n with the queue size.
+    """
+    def setup():
+        queue = synthetic_queue(players, seed)
+        arrivals = synthetic_queue(max(1, int(players * ARRIVAL_SHARE)), seed + 1)
+        for user in arrivals:
+            user.connection_id = f"arrival-{user.connection_id}"
+        return queue, arrivals
+    def run(queues):
+        queue, arrivals = queues
+        engine = ReevaluationEngine(SearchWindowCurve.from_string(ANCHORS_CURVE))
+        now = time.time()
+        cold = engine.anchors('benchmark', queue, now)
+        warm = engine.anchors('benchmark', queue + arrivals, now + 1)
+        return len(cold) + len(warm)
+    elapsed, anchors, peak = measure(setup, run, memory)
+    return {
+        'seconds': elapsed,
+        'operations': anchors,
+        'operations_per_second': anchors / elapsed if elapsed else None,
+        'peak_memory_bytes': peak
+    }
+
+def bench_split_teams(players: int, team_size: int, seed: int, memory: bool):
+    """
+    split_teams on the players of the queue taken match_size at a time in rating order, as the matcher picks them
+    """
+    match_size = team_size * 2
+    def setup():
+        queue = sorted(synthetic_queue(players, seed), key=lambda user: user.rating)
+        return [queue[start:start + match_size] for start in range(0, players - match_size + 1, match_size)]
+    def run(groups: list[list[User]]):
+        return [matcher.split_teams(group) for group in groups]
+    elapsed, matches, peak = measure(setup, run, memory)
+    differences = [abs(sum(player.rating for player in match.team1) - sum(player.rating for player in match.team2)) for match in matches]
+    return {
+        'seconds': elapsed,
+        'operations': len(matches),
+        'operations_per_second': len(matches) / elapsed if elapsed else None,
+        'mean_rating_difference': sum(differences) / len(differences) if differences else None,
+        'peak_memory_bytes': peak
+    }
+
+def synthetic_matches(players: int, team_size: int, seed: int):
+    """
+    Teams of glicko players with their results, players / (team_size * 2) matches
+    """
+    rng = random.Random(seed * 1000003 + players)
+    matches = []
+    for _ in range(players // (team_size * 2)):
+        teams = [
+            [(Player(rng.gauss(RATING_MEAN, RATING_SPREAD), rng.choices(RDS, RD_WEIGHTS)[0], 0.06), f"user-{len(matches)}-{team}-{i}") for i in range(team_size)]
+            for team in range(2)
+        ]
+        matches.append((teams[0], teams[1], rng.choice([0, 0.5, 1])))
+    return matches
+
+def bench_update_player(players: int, team_size: int, seed: int, memory: bool):
+    """
+    Player.update_player with the single game each player gets from their team's match
+    """
+    def setup():
+        games = []
+        for team1, team2, team1_win in synthetic_matches(players, team_size, seed):
+            calculator = TeamRatingCalculator(team1, team2, team1_win)
+            games.extend((player, calculator.opponent_game(player)) for player, _ in team1 + team2)
+        return games
+    def run(games):
+        for player, (opponent_rating, opponent_rd, outcome) in games:
+            player.update_player([opponent_rating], [opponent_rd], [outcome])
+        return len(games)
+    elapsed, updates, peak = measure(setup, run, memory)
+    return {
+        'seconds': elapsed,
+        'operations': updates,
+        'operations_per_second': updates / elapsed if elapsed else None,
+        'peak_memory_bytes': peak
+    }
+
+def bench_team_rating(players: int, team_size: int, seed: int, memory: bool):
+    """
+    Rating a finished match the way matchFinished does, TeamRatingCalculator then update_rating for every player
+    """
+    def run(matches):
+        for team1, team2, team1_win in matches:
+            calculator = TeamRatingCalculator(team1, team2, team1_win)
+            for player, _ in team1 + team2:
+                calculator.update_rating(player)
+        return len(matches)
+    elapsed, rated, peak = measure(lambda: synthetic_matches(players, team_size, seed), run, memory)
+    return {
+        'seconds': elapsed,
+        'operations': rated,
+        'operations_per_second': rated / elapsed if elapsed else None,
+        'matches': rated,
+        'matches_per_second': rated / elapsed if elapsed else None,
+        'peak_memory_bytes': peak
+    }
+
+def run_benchmark(name: str, players: int, team_size: int, seed: int, memory: bool):
+    if name == 'find_intersecting_players':
+        return bench_intersecting_players(players, team_size, seed, memory)
+    if name == 'reevaluation_anchors':
+        return bench_reevaluation_anchors(players, team_size, seed, memory)
+    if name == 'split_teams':
+        return bench_split_teams(players, team_size, seed, memory)
+    if name == 'update_player':
+        return bench_update_player(players, team_size, seed, memory)
+    if name == 'team_rating':
+        return bench_team_rating(players, team_size, seed, memory)
+    return bench_matcher(name, players, team_size, seed, memory)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000', help="Comma separated queue sizes")
+    parser.add_argument('--team-sizes', default='1,2,5', help="Comma separated TEAM_SIZE values")
+    parser.add_argument('--benchmarks', default=','.join(DEFAULT_BENCHMARKS), help=f"Comma separated, any of {','.join(BENCHMARKS)}")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="Runs of each benchmark, each one is a line of output")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the second run that measures the peak memory")
+    parser.add_argument('--time-limit', type=float, default=60, help="Seconds after which the larger sizes of a benchmark are skipped, 0 for no limit")
+    parser.add_argument('--output', help="File the JSON lines are appended to, stdout when not given")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    team_sizes = [int(team_size) for team_size in args.team_sizes.split(',')]
+    benchmarks = args.benchmarks.split(',')
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"Unknown benchmark {name}")
+        if name in ('find_matches_from_queue_vectorized', 'find_matches_from_queue_sharded') and matcher.np is None:
+            parser.error(f"{name} needs numpy")
+
+    output = open(args.output, 'a') if args.output else sys.stdout
+    environment = {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()}
+    try:
+        for name in benchmarks:
+            for team_size in team_sizes:
+                set_team_size(team_size)
+                too_slow_at = None # Smallest size that went over the time limit
+                for players in sorted(sizes):
+                    for run in range(args.repeat):
+                        record = {'benchmark': name, 'players': players, 'team_size': team_size, 'seed': args.seed, 'run': run}
+                        if too_slow_at is not None:
+                            record.update(skipped=f"{too_slow_at} players took over {args.time_limit}s")
+                            print(f"{name} team_size={team_size} players={players}: skipped", file=sys.stderr)
+                        else:
+                            result = run_benchmark(name, players, team_size, args.seed, not args.no_memory)
+                            record.update(result)
+                            if args.time_limit and result['seconds'] > args.time_limit:
+                                too_slow_at = players
+                            print(f"{name} team_size={team_size} players={players}: {result['seconds']:.3f}s", file=sys.stderr)
+                        output.write(json.dumps({**record, **environment}) + '\n')
+                        output.flush()
+    finally:
+        if args.output:
+            output.close()
+
+if __name__ == '__main__':
+    main()
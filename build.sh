@@ -41,6 +41,115 @@ sourceFile="matchmakingApi/glicko_team.py"
 destinationRoot="matchmakingApi/HTTP"
 Copy-RepoFile $sourceFile $destinationRoot true
 
+#Copy awsClients.py from matchmakingApi folder to all WEBSOCKET folders
+sourceFile="matchmakingApi/awsClients.py"
+destinationRoot="matchmakingApi/WEBSOCKET"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy awsClients.py from matchmakingApi folder to all HTTP folders
+sourceFile="matchmakingApi/awsClients.py"
+destinationRoot="matchmakingApi/HTTP"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy websocketNotifier.py from matchmakingApi folder to all WEBSOCKET folders
+sourceFile="matchmakingApi/websocketNotifier.py"
+destinationRoot="matchmakingApi/WEBSOCKET"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy websocketNotifier.py from matchmakingApi folder to all HTTP folders
+sourceFile="matchmakingApi/websocketNotifier.py"
+destinationRoot="matchmakingApi/HTTP"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy gameServerPool.py from matchmakingApi folder to all WEBSOCKET folders
+sourceFile="matchmakingApi/gameServerPool.py"
+destinationRoot="matchmakingApi/WEBSOCKET"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy gameServerPool.py from matchmakingApi folder to all HTTP folders
+sourceFile="matchmakingApi/gameServerPool.py"
+destinationRoot="matchmakingApi/HTTP"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy queueState.py from matchmakingApi folder to all WEBSOCKET folders
+sourceFile="matchmakingApi/queueState.py"
+destinationRoot="matchmakingApi/WEBSOCKET"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy ratingPeriod.py from matchmakingApi folder to all HTTP folders
+sourceFile="matchmakingApi/ratingPeriod.py"
+destinationRoot="matchmakingApi/HTTP"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy searchWindow.py from matchmakingApi folder to all WEBSOCKET folders
+sourceFile="matchmakingApi/searchWindow.py"
+destinationRoot="matchmakingApi/WEBSOCKET"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy queueColumns.py from matchmakingApi folder to all WEBSOCKET folders
+sourceFile="matchmakingApi/queueColumns.py"
+destinationRoot="matchmakingApi/WEBSOCKET"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy teamSplit.py from matchmakingApi folder to all WEBSOCKET folders
+sourceFile="matchmakingApi/teamSplit.py"
+destinationRoot="matchmakingApi/WEBSOCKET"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy tickMetrics.py from matchmakingApi folder to all WEBSOCKET folders
+sourceFile="matchmakingApi/tickMetrics.py"
+destinationRoot="matchmakingApi/WEBSOCKET"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy queueStats.py from matchmakingApi folder to all WEBSOCKET folders
+sourceFile="matchmakingApi/queueStats.py"
+destinationRoot="matchmakingApi/WEBSOCKET"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy queueStats.py from matchmakingApi folder to all HTTP folders
+sourceFile="matchmakingApi/queueStats.py"
+destinationRoot="matchmakingApi/HTTP"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy matchmakingScheduler.py from matchmakingApi folder to all WEBSOCKET folders
+sourceFile="matchmakingApi/matchmakingScheduler.py"
+destinationRoot="matchmakingApi/WEBSOCKET"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy gameServerPool.py, awsClients.py, matchmakingScheduler.py, matchmakingTableRepository.py, glicko_team.py and ratingPeriod.py from matchmakingApi folder to all SCHEDULED folders
+sourceFile="matchmakingApi/gameServerPool.py"
+destinationRoot="matchmakingApi/SCHEDULED"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+sourceFile="matchmakingApi/awsClients.py"
+destinationRoot="matchmakingApi/SCHEDULED"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+sourceFile="matchmakingApi/matchmakingScheduler.py"
+destinationRoot="matchmakingApi/SCHEDULED"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+sourceFile="matchmakingApi/matchmakingTableRepository.py"
+destinationRoot="matchmakingApi/SCHEDULED"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+sourceFile="matchmakingApi/glicko_team.py"
+destinationRoot="matchmakingApi/SCHEDULED"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+sourceFile="matchmakingApi/ratingPeriod.py"
+destinationRoot="matchmakingApi/SCHEDULED"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+#Copy queueStats.py and awsClients.py from matchmakingApi folder to all STREAM folders
+sourceFile="matchmakingApi/queueStats.py"
+destinationRoot="matchmakingApi/STREAM"
+Copy-RepoFile $sourceFile $destinationRoot true
+
+sourceFile="matchmakingApi/awsClients.py"
+destinationRoot="matchmakingApi/STREAM"
+Copy-RepoFile $sourceFile $destinationRoot true
+
 # -------- UPDATE NPM PACKAGES --------
 echo -e "\n-------- UPDATE NPM PACKAGES --------\n"
 # Update npm packages
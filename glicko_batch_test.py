@@ -0,0 +1,99 @@
+"""
+Checks the numpy batch Glicko-2 engine against the scalar Player implementation.
+Run as a script, it also measures both.
+
+python -m pytest glicko_batch_test.py
+python glicko_batch_test.py --players 100000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'matchmakingApi'))
+
+from glicko_team import Player
+import glicko_batch
+
+TOLERANCE = 1e-9 # Relative
+SEEDS = range(5)
+TEST_PLAYERS = 2000
+
+def random_games(players: int, games: int, rng: np.random.Generator):
+    rating = rng.normal(1500, 300, players)
+    rd = rng.uniform(30, 350, players)
+    vol = rng.uniform(0.04, 0.09, players)
+    opponent_rating = rng.normal(1500, 300, (players, games))
+    opponent_rd = rng.uniform(30, 350, (players, games))
+    outcome = rng.choice([0.0, 0.5, 1.0], (players, games))
+    return rating, rd, vol, opponent_rating, opponent_rd, outcome
+
+def scalar_update(rating, rd, vol, opponent_rating, opponent_rd, outcome):
+    results = np.empty((3, len(rating)))
+    for i in range(len(rating)):
+        player = Player(rating[i], rd[i], vol[i])
+        player.update_player(list(opponent_rating[i]), list(opponent_rd[i]), list(outcome[i]))
+        results[:, i] = player.rating, player.rd, player.vol
+    return results
+
+def scalar_did_not_compete(rd, vol):
+    results = np.empty(len(rd))
+    for i in range(len(rd)):
+        player = Player(rd=rd[i], vol=vol[i])
+        player.did_not_compete()
+        results[i] = player.rd
+    return results
+
+def max_relative_difference(batch, scalar):
+    return np.max(np.abs(np.asarray(batch) - scalar) / np.abs(scalar), axis=-1)
+
+def test_update_players_matches_scalar_update():
+    for games_per_player in (1, 3):
+        for seed in SEEDS:
+            games = random_games(TEST_PLAYERS, games_per_player, np.random.default_rng(seed))
+            error = max_relative_difference(glicko_batch.update_players(*games), scalar_update(*games))
+            assert np.all(error <= TOLERANCE), f"seed {seed}, {games_per_player} games: rating {error[0]:.2e}, rd {error[1]:.2e}, vol {error[2]:.2e}"
+
+def test_single_game_arrays_match_one_game_rows():
+    rating, rd, vol, opponent_rating, opponent_rd, outcome = random_games(TEST_PLAYERS, 1, np.random.default_rng(0))
+    rows = glicko_batch.update_players(rating, rd, vol, opponent_rating, opponent_rd, outcome)
+    flat = glicko_batch.update_players(rating, rd, vol, opponent_rating[:, 0], opponent_rd[:, 0], outcome[:, 0])
+    assert np.all(max_relative_difference(flat, np.asarray(rows)) <= TOLERANCE)
+
+def test_did_not_compete_matches_scalar():
+    for seed in SEEDS:
+        rng = np.random.default_rng(seed)
+        rd = rng.uniform(30, 350, TEST_PLAYERS)
+        vol = rng.uniform(0.04, 0.09, TEST_PLAYERS)
+        error = max_relative_difference(glicko_batch.did_not_compete(rd, vol), scalar_did_not_compete(rd, vol))
+        assert error <= TOLERANCE, f"seed {seed}: rd {error:.2e}"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=100000)
+    parser.add_argument('--games', type=int, default=1, help="Games per player in the rating period")
+    parser.add_argument('--scalar-players', type=int, default=20000, help="Players also rated one by one to compare")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    games = random_games(args.players, args.games, np.random.default_rng(args.seed))
+
+    started_at = time.perf_counter()
+    batch = np.array(glicko_batch.update_players(*games))
+    batch_elapsed = time.perf_counter() - started_at
+
+    compared = min(args.players, args.scalar_players)
+    started_at = time.perf_counter()
+    scalar = scalar_update(*(values[:compared] for values in games))
+    scalar_elapsed = time.perf_counter() - started_at
+
+    error = max_relative_difference(batch[:, :compared], scalar)
+    print(f"Batch: {args.players} players in {batch_elapsed * 1000:.1f}ms ({args.players / batch_elapsed / 1000:.0f} updates/ms)")
+    print(f"Scalar: {compared} players in {scalar_elapsed * 1000:.1f}ms ({compared / scalar_elapsed / 1000:.1f} updates/ms)")
+    print(f"Max relative difference: rating {error[0]:.2e}, rd {error[1]:.2e}, vol {error[2]:.2e}")
+    if np.any(error > TOLERANCE):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+Drives the real lambda handlers in a loop and reports the throughput and latency percentiles of each one.
+DynamoDB is moto's in-process mock, API Gateway management, ECS, EC2 and Lambda are fakes, so it runs offline.
+
+Every round the players not in a match connect and join the queue, tryCreateMatch runs, the servers of the
+new matches report ready and finish their match, then the matched players disconnect and come back next round.
+
+pip install moto
+python load_harness.py --players 1000 --rounds 5 --workers 16 --dynamodb-latency-ms 5 --apigw-latency-ms 20
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ENVIRONMENT = 'LOAD'
+REGION = 'load-region'
+DOMAIN_NAME = 'load.execute-api.local'
+
+for variable in [variable for variable in os.environ if variable.startswith('AWS_ENDPOINT_URL')]:
+    del os.environ[variable] # Requests to a local endpoint would not be intercepted by moto
+os.environ.update({
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'load',
+    'AWS_SECRET_ACCESS_KEY': 'load',
+    'CONNECTION_TABLE_NAME': f'WebsocketConnections_{ENVIRONMENT}',
+    'CONNECTION_TABLE_PK': 'ConnectionId',
+    'DATA_TABLE_NAME': f'UserMatchMakingData_{ENVIRONMENT}',
+    'DATA_TABLE_PK': 'UserId',
+    'CONNECTION_TABLE_QUEUE_INDEX': 'QueueIndex',
+    'MATCHMAKING_REGIONS': REGION,
+    'MATCHMAKING_ENDPOINT': DOMAIN_NAME,
+    'MATCH_RESULTS_TABLE_NAME': f'MatchResults_{ENVIRONMENT}'
+})
+
+repository_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(repository_root, 'matchmakingApi'))
+sys.path.insert(0, os.path.join(repository_root, 'MatchmakerService'))
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+from moto.core.botocore_stubber import BotocoreStubber
+import awsClients
+from createLocalTables import create_tables
+
+HANDLERS = {
+    'connect': 'WEBSOCKET/connectHandler/app.py',
+    'joinQueue': 'WEBSOCKET/joinQueueHandler/app.py',
+    'tryCreateMatch': 'WEBSOCKET/tryCreateMatchHandler/app.py',
+    'serverReady': 'HTTP/serverReady/app.py',
+    'matchFinished': 'HTTP/matchFinished/app.py',
+    'disconnect': 'WEBSOCKET/disconnectHandler/app.py'
+}
+PERCENTILES = [50, 90, 99]
+
+class StandInClock:
+    """
+    Seconds spent in moto by every thread, waiting for it included. Phases call a single handler,
+    so what is added during a phase belongs to that handler, also from the threads it starts.
+    """
+    def __init__(self):
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.seconds += seconds
+
+stand_in_clock = StandInClock()
+
+class Latency:
+    """
+    Sleeps for a fixed delay, spread by up to jitter (a fraction of the delay) on each side
+    """
+    def __init__(self, milliseconds: float, jitter: float, seed: int):
+        self.seconds = milliseconds / 1000
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self, **kwargs):
+        if self.seconds <= 0:
+            return
+        with self._lock:
+            spread = self._rng.uniform(-self.jitter, self.jitter)
+        time.sleep(self.seconds * (1 + spread))
+
+class FakeApiGatewayManagement:
+    """
+    Accepts every message, connections given in gone answer with a GoneException
+    """
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.gone:set[str] = set()
+        self.posted = 0
+        self._lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId: str, Data):
+        self.latency.wait()
+        if ConnectionId in self.gone:
+            raise ClientError({'Error': {'Code': 'GoneException', 'Message': 'Gone'}}, 'PostToConnection')
+        with self._lock:
+            self.posted += 1
+        return {}
+
+class FakeEcs:
+    """
+    Records the players of every server started, they stand for the game servers of the run
+    """
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.started:list[tuple[list[str],list[str]]] = [] # (user ids, connection ids) per server
+        self._lock = threading.Lock()
+
+    def run_task(self, overrides: dict, count: int = 1, **kwargs):
+        self.latency.wait()
+        environment = {variable['name']: variable['value'] for variable in overrides['containerOverrides'][0]['environment']}
+        user_ids = [user_id for user_id in environment['USER_IDS'].split(',') if user_id]
+        connection_ids = [connection_id for connection_id in environment['CONNECTION_IDS'].split(',') if connection_id]
+        with self._lock:
+            self.started.extend((user_ids, connection_ids) for _ in range(count))
+        return {'tasks': [{'taskArn': f'arn:aws:ecs:load:task/{len(self.started)}'}], 'failures': []}
+
+    def take_started(self):
+        with self._lock:
+            started, self.started = self.started, []
+        return started
+
+class FakeEc2:
+    def describe_subnets(self, **kwargs):
+        return {'Subnets': [{'SubnetId': 'subnet-load'}]}
+
+    def describe_security_groups(self, **kwargs):
+        return {'SecurityGroups': [{'GroupId': 'sg-load'}]}
+
+class FakeLambda:
+    def __init__(self):
+        self.invocations = 0
+
+    def invoke(self, **kwargs):
+        self.invocations += 1
+        return {'StatusCode': 202}
+
+def serialize_mock_requests():
+    """
+    moto's backends are not thread safe (a transaction copies tables other threads are writing), so the mocked
+    requests are processed one at a time. Injected latencies are outside the lock and still overlap.
+    """
+    lock = threading.Lock()
+    process = BotocoreStubber.__call__
+    def serialized(self, event_name: str, request, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            with lock:
+                return process(self, event_name, request, **kwargs)
+        finally:
+            stand_in_clock.add(time.perf_counter() - started_at)
+    BotocoreStubber.__call__ = serialized
+
+def install_fakes(fakes: dict, dynamodb_latency: Latency):
+    """
+    Routes the clients of the faked services to the fakes, before any handler imports get_client.
+    DynamoDB goes through the real clients, with the latency added before every call.
+    """
+    real_get_client = awsClients.get_client
+    def get_client(service_name: str, region_name=None, endpoint_url=None):
+        if service_name in fakes:
+            return fakes[service_name]
+        return real_get_client(service_name, region_name, endpoint_url)
+    awsClients.get_client = get_client
+    awsClients.get_session().events.register('before-call.dynamodb', dynamodb_latency.wait)
+
+def load_handler(name: str):
+    """
+    Imports a handler's app.py under its own module name, they are all called app
+    """
+    spec = importlib.util.spec_from_file_location(f'{name}_handler', os.path.join(repository_root, 'matchmakingApi', HANDLERS[name]))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.lambda_handler
+
+class Recorder:
+    """
+    Latency of every call of each handler, and the wall time spent in each handler's phases
+    """
+    def __init__(self):
+        self.latencies:dict[str,list[float]] = {name: [] for name in HANDLERS}
+        self.errors:dict[str,int] = {name: 0 for name in HANDLERS}
+        self.wall_seconds:dict[str,float] = {name: 0.0 for name in HANDLERS}
+        self.stand_in_seconds:dict[str,float] = {name: 0.0 for name in HANDLERS}
+        self._lock = threading.Lock()
+
+    def call(self, name: str, handler, event: dict):
+        started_at = time.perf_counter()
+        try:
+            response = handler(event, None)
+            failed = (response or {}).get('statusCode', 200) >= 500
+        except Exception as e:
+            print(f"{name} raised {type(e).__name__}: {e}", file=sys.stderr)
+            response, failed = None, True
+        elapsed = time.perf_counter() - started_at
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            if failed:
+                self.errors[name] += 1
+        return response
+
+    def phase(self, name: str, handler, events: list[dict], workers: int):
+        """
+        Calls the handler with every event, workers at a time, and returns the responses
+        """
+        if not events:
+            return []
+        started_at = time.perf_counter()
+        stand_in_started_at = stand_in_clock.seconds
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(events)))) as executor:
+            responses = list(executor.map(lambda event: self.call(name, handler, event), events))
+        self.wall_seconds[name] += time.perf_counter() - started_at
+        self.stand_in_seconds[name] += stand_in_clock.seconds - stand_in_started_at
+        return responses
+
+    def report(self):
+        report = {}
+        for name, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            latencies = sorted(latencies)
+            report[name] = {
+                'calls': len(latencies),
+                'errors': self.errors[name],
+                'calls_per_second': len(latencies) / self.wall_seconds[name] if self.wall_seconds[name] else None,
+                **{f'p{percentile}_ms': latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))] * 1000 for percentile in PERCENTILES},
+                'max_ms': latencies[-1] * 1000,
+                'stand_in_share': self.stand_in_seconds[name] / sum(latencies) # Part of the latency spent in moto, not in the handler
+            }
+        return report
+
+def websocket_event(connection_id: str, user_id: str, body: dict = None):
+    event = {
+        'requestContext': {
+            'connectionId': connection_id,
+            'domainName': DOMAIN_NAME,
+            'authorizer': {'principalId': user_id}
+        }
+    }
+    if body is not None:
+        event['body'] = json.dumps(body)
+    return event
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--ticks', type=int, default=1, help="tryCreateMatch runs per round, one at a time as with its concurrency limit of 1")
+    parser.add_argument('--workers', type=int, default=8, help="Concurrent invocations of the other handlers")
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=0)
+    parser.add_argument('--apigw-latency-ms', type=float, default=0)
+    parser.add_argument('--ecs-latency-ms', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0.2, help="Injected latencies vary by up to this fraction")
+    parser.add_argument('--rating-period-seconds', type=int, default=3600, help="0 rates every match when it finishes")
+    parser.add_argument('--matcher-mode', default='python')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="File the JSON report is written to")
+    parser.add_argument('--verbose', action='store_true', help="Show what the handlers print")
+    args = parser.parse_args()
+
+    os.environ['RATING_PERIOD_SECONDS'] = str(args.rating_period_seconds)
+    os.environ['MATCHER_MODE'] = args.matcher_mode
+    rng = random.Random(args.seed)
+
+    serialize_mock_requests()
+    handler_output = sys.stdout if args.verbose else open(os.devnull, 'w')
+    with mock_aws(), contextlib.redirect_stdout(handler_output): # Set once, redirecting in each thread would race
+        create_tables(boto3.client('dynamodb'), ENVIRONMENT)
+        apigw = FakeApiGatewayManagement(Latency(args.apigw_latency_ms, args.jitter, args.seed + 1))
+        ecs = FakeEcs(Latency(args.ecs_latency_ms, args.jitter, args.seed + 2))
+        fake_lambda = FakeLambda()
+        install_fakes({'apigatewaymanagementapi': apigw, 'ecs': ecs, 'ec2': FakeEc2(), 'lambda': fake_lambda}, Latency(args.dynamodb_latency_ms, args.jitter, args.seed + 3))
+        handlers = {name: load_handler(name) for name in HANDLERS}
+
+        recorder = Recorder()
+        idle = [f'load-user-{i}' for i in range(args.players)] # Players not connected
+        connections:dict[str,str] = {} # User id -> connection id of the players in queue
+        matches_finished = 0
+        started_at = time.perf_counter()
+        for round_number in range(args.rounds):
+            arriving = {user_id: f'load-connection-{round_number}-{user_id}' for user_id in idle}
+            recorder.phase('connect', handlers['connect'], [websocket_event(connection_id, user_id) for user_id, connection_id in arriving.items()], args.workers)
+            recorder.phase('joinQueue', handlers['joinQueue'], [websocket_event(connection_id, user_id, {'region': REGION}) for user_id, connection_id in arriving.items()], args.workers)
+            connections.update(arriving)
+            idle = []
+
+            for _ in range(args.ticks):
+                recorder.phase('tryCreateMatch', handlers['tryCreateMatch'], [{'requestContext': {'domainName': DOMAIN_NAME}}], 1)
+            servers = ecs.take_started()
+
+            recorder.phase('serverReady', handlers['serverReady'], [
+                {'headers': {'X-Forwarded-For': f'10.0.0.{index % 250 + 1}'}, 'body': json.dumps({'connection_ids': connection_ids})}
+                for index, (_, connection_ids) in enumerate(servers)
+            ], args.workers)
+            recorder.phase('matchFinished', handlers['matchFinished'], [
+                {'body': json.dumps({'home': user_ids[:len(user_ids) // 2], 'away': user_ids[len(user_ids) // 2:], 'result': rng.choice(['home', 'away', 'draw'])})}
+                for user_ids, _ in servers
+            ], args.workers)
+            matches_finished += len(servers)
+
+            finished = [user_id for user_ids, _ in servers for user_id in user_ids]
+            recorder.phase('disconnect', handlers['disconnect'], [websocket_event(connections.pop(user_id), user_id) for user_id in finished if user_id in connections], args.workers)
+            idle = finished
+            print(f"Round {round_number + 1}: {len(servers)} matches, {len(connections)} players still in queue", file=sys.stderr)
+
+        report = {
+            'players': args.players,
+            'rounds': args.rounds,
+            'workers': args.workers,
+            'latency_ms': {'dynamodb': args.dynamodb_latency_ms, 'apigw': args.apigw_latency_ms, 'ecs': args.ecs_latency_ms, 'jitter': args.jitter},
+            'seconds': time.perf_counter() - started_at,
+            'matches_finished': matches_finished,
+            'messages_posted': apigw.posted,
+            'handlers': recorder.report()
+        }
+
+    print(f"{'handler':<16}{'calls':>8}{'errors':>8}{'calls/s':>10}" + ''.join(f"{f'p{percentile} ms':>10}" for percentile in PERCENTILES) + f"{'max ms':>10}{'in moto':>10}")
+    for name, stats in report['handlers'].items():
+        print(f"{name:<16}{stats['calls']:>8}{stats['errors']:>8}{stats['calls_per_second']:>10.1f}" + ''.join(f"{stats[f'p{percentile}_ms']:>10.1f}" for percentile in PERCENTILES) + f"{stats['max_ms']:>10.1f}{stats['stand_in_share']:>10.0%}")
+    print(f"{report['matches_finished']} matches in {report['seconds']:.1f}s")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    if any(stats['errors'] for stats in report['handlers'].values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Checks the requests the matchFinished handler rejects, in both rating modes, with the repositories mocked.
+
+python -m pytest match_finished_test.py
+"""
+import importlib.util
+import json
+import os
+import sys
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+os.environ.setdefault('CONNECTION_TABLE_NAME', 'test')
+os.environ.setdefault('CONNECTION_TABLE_PK', 'ConnectionId')
+os.environ.setdefault('DATA_TABLE_NAME', 'test')
+os.environ.setdefault('DATA_TABLE_PK', 'UserId')
+
+repository_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(repository_root, 'matchmakingApi'))
+
+from matchmakingTableRepository import User
+
+# Loaded under its own name, every handler is an app module
+spec = importlib.util.spec_from_file_location('matchFinished', os.path.join(repository_root, 'matchmakingApi', 'HTTP', 'matchFinished', 'app.py'))
+match_finished = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(match_finished)
+
+KNOWN_USERS = {user_id: User(user_id, 1500, 200, Decimal('0.06'), 'eu') for user_id in ('a', 'b')}
+
+def event(body):
+    return {'body': body if isinstance(body, str) or body is None else json.dumps(body)}
+
+class MatchFinishedTest(unittest.TestCase):
+    def setUp(self):
+        self.repository = mock.MagicMock()
+        self.repository.get_users_data.side_effect = lambda user_ids, consistent_read=False: {user_id: KNOWN_USERS[user_id] for user_id in user_ids if user_id in KNOWN_USERS}
+        patcher = mock.patch.object(match_finished, 'WebSocketRepository', return_value=self.repository)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use_rating_periods(self):
+        for name, value in (('rating_period_seconds', 3600), ('match_results_table_name', 'results')):
+            patcher = mock.patch.object(match_finished, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(match_finished, 'MatchResultLogRepository')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_rejected(self, body, status: int):
+        response = match_finished.lambda_handler(event(body), None)
+        self.assertEqual(response['statusCode'], status, response.get('body'))
+        self.repository.finish_match.assert_not_called()
+        self.repository.commit_match_ratings.assert_not_called()
+
+    def check_rejections(self):
+        self.assert_rejected('{not json', 400)
+        self.assert_rejected('null', 400)
+        self.assert_rejected('["a", "b"]', 400)
+        self.assert_rejected(None, 400) # No result
+        self.assert_rejected({'home': ['a'], 'away': ['b'], 'result': 'win'}, 400)
+        self.assert_rejected({'home': [], 'away': ['a'], 'result': 'home'}, 400)
+        self.assert_rejected({'home': ['a'], 'away': ['a'], 'result': 'home'}, 400)
+        self.assert_rejected({'home': 'a', 'away': ['b'], 'result': 'home'}, 400)
+        self.assert_rejected({'home': ['a'], 'away': ['missing'], 'result': 'home'}, 404)
+
+    def test_immediate_rating_rejections(self):
+        self.check_rejections()
+
+    def test_rating_period_rejections(self):
+        self.use_rating_periods()
+        self.check_rejections()
+
+    def test_immediate_rating_commits(self):
+        response = match_finished.lambda_handler(event({'home': ['a'], 'away': ['b'], 'result': 'home'}), None)
+        self.assertEqual(response['statusCode'], 200)
+        self.repository.commit_match_ratings.assert_called_once()
+
+    def test_rating_period_logs_the_result(self):
+        self.use_rating_periods()
+        response = match_finished.lambda_handler(event({'home': ['a'], 'away': ['b'], 'result': 'draw'}), None)
+        self.assertEqual(response['statusCode'], 200)
+        self.repository.finish_match.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+"""
+Checks the indexed find_matches_from_queue against the original full scan matcher on randomized queues.
+
+python -m pytest matcher_test.py
+"""
+import os
+import random
+import json
+import sys
+import time
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+os.environ.setdefault('CONNECTION_TABLE_NAME', 'test')
+os.environ.setdefault('CONNECTION_TABLE_PK', 'ConnectionId')
+os.environ.setdefault('DATA_TABLE_NAME', 'test')
+os.environ.setdefault('DATA_TABLE_PK', 'UserId')
+
+repository_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(repository_root, 'matchmakingApi'))
+sys.path.insert(0, os.path.join(repository_root, 'matchmakingApi', 'WEBSOCKET', 'tryCreateMatchHandler'))
+
+import app as matcher # tryCreateMatch handler
+from matchmakingTableRepository import User
+
+SEEDS = range(20)
+TEAM_SIZES = [1, 2, 5]
+
+def random_queue(players: int, rng: random.Random):
+    return [
+        User(
+            user_id=f"user-{i}",
+            rating=int(rng.gauss(1500, 300)),
+            rd=rng.choice([30, 50, 70, 120, 200, 350]),
+            vol=Decimal('0.06'),
+            region='test',
+            joined_at=i,
+            connection_id=f"connection-{i}"
+        )
+        for i in range(players)
+    ]
+
+def baseline_find_intersecting_players(potential_match_players: list[User], match_size: int):
+    """
+    The matcher before the rating index, candidates are read from a list that shrinks as they are skipped
+    """
+    if len(potential_match_players) < match_size:
+        return None
+    next_candidate_index = match_size
+    candidates = potential_match_players[:match_size]
+    while len(potential_match_players) >= match_size:
+        lowest_maximum_player = min(candidates, key=lambda player: player.MaxMatchupRating())
+        highest_minimum_player = max(candidates, key=lambda player: player.MinMatchupRating())
+        if lowest_maximum_player.MaxMatchupRating() >= highest_minimum_player.MinMatchupRating():
+            return candidates
+        replaced_candidates = False
+        while not replaced_candidates:
+            if len(potential_match_players) < next_candidate_index + 1:
+                return None
+            next_candidate = potential_match_players[next_candidate_index]
+            if next_candidate.MinMatchupRating() < highest_minimum_player.MinMatchupRating() and next_candidate.MaxMatchupRating() > lowest_maximum_player.MaxMatchupRating():
+                if random.random() < 0.5:
+                    candidates.remove(highest_minimum_player)
+                    potential_match_players.remove(highest_minimum_player)
+                else:
+                    candidates.remove(lowest_maximum_player)
+                    potential_match_players.remove(lowest_maximum_player)
+                candidates.append(next_candidate)
+                replaced_candidates = True
+            else:
+                potential_match_players.remove(next_candidate)
+
+def baseline_find_matches_from_queue(queue: list[User], match_size: int):
+    """
+    The matcher before the rating index: every anchor scans the whole queue, matched players are removed while iterating
+    """
+    matches:list[list[User]] = []
+    if len(queue) < match_size:
+        return matches
+    for user in queue:
+        potential_match_players = [user] + [
+            teammate for teammate in queue
+            if teammate != user and abs(user.rating - teammate.rating) <= user.max_matchup_delta
+        ]
+        match_players = baseline_find_intersecting_players(potential_match_players, match_size)
+        if match_players:
+            for player in match_players:
+                queue.remove(player)
+            matches.append(match_players)
+    return matches
+
+def match_players(matches):
+    return [sorted(user.connection_id for user in match) for match in matches]
+
+class FindMatchesFromQueueTest(unittest.TestCase):
+    def setUp(self):
+        original_match_size = matcher.MATCH_SIZE
+        self.addCleanup(setattr, matcher, 'MATCH_SIZE', original_match_size)
+
+    def test_same_matches_as_the_full_scan(self):
+        for team_size in TEAM_SIZES:
+            matcher.MATCH_SIZE = team_size * 2
+            for seed in SEEDS:
+                with self.subTest(team_size=team_size, seed=seed):
+                    rng = random.Random(seed)
+                    queue = random_queue(rng.randint(0, 400), rng)
+                    baseline_queue = list(queue)
+
+                    random.seed(seed) # Both matchers draw the same replacements
+                    expected = baseline_find_matches_from_queue(baseline_queue, team_size * 2)
+                    random.seed(seed)
+                    matches = matcher.find_matches_from_queue(queue)
+
+                    self.assertEqual(match_players(match.team1 + match.team2 for match in matches), match_players(expected))
+                    self.assertEqual([user.connection_id for user in queue], [user.connection_id for user in baseline_queue])
+
+    def test_window_is_in_queue_order_and_skips_removed_players(self):
+        queue = random_queue(200, random.Random(1))
+        index = matcher.RatingIntervalIndex(queue)
+        removed = set(range(0, 200, 3))
+        for position in removed:
+            index.remove(position)
+        expected = [position for position, user in enumerate(queue) if 1400 <= user.rating <= 1600 and position not in removed]
+        self.assertEqual(list(index.window(1400, 1600)), expected)
+        self.assertEqual(list(index.window(5000, 6000)), [])
+
+class MatchRegionsTest(unittest.TestCase):
+    def test_a_failing_region_does_not_drop_the_others(self):
+        def match_region(region, notifier, deadline, queue=None, queue_state=None):
+            if region == 'broken':
+                raise KeyError('Rating')
+            return 3, 10
+        with mock.patch.object(matcher, 'queue_source', 'snapshot'), \
+                mock.patch.object(matcher, 'connection_table_queue_index', 'QueueIndex'), \
+                mock.patch.object(matcher, 'matchmaking_regions', ['eu', 'broken', 'us']), \
+                mock.patch.object(matcher, 'new_repositories', return_value=(mock.MagicMock(), None)), \
+                mock.patch.object(matcher, 'match_region_in_thread', side_effect=match_region):
+            response = matcher._match_regions(mock.MagicMock(), time.monotonic() + 10, matcher.TickMetrics({}, False))
+        body = json.loads(response['body'])
+        self.assertEqual(response['statusCode'], 500)
+        self.assertEqual(body['failed_regions'], ['broken'])
+        self.assertEqual(body['matches'], {'eu': 3, 'us': 3})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,45 +1,110 @@
 import os
 import json
-from matchmakingTableRepository import WebSocketRepository, User
+from matchmakingTableRepository import WebSocketRepository, User, RatingCommitFailed
 from glicko_team import Player, TeamRatingCalculator
+from ratingPeriod import MatchResultLogRepository
 from decimal import Decimal
 
 connection_table_name = os.environ['CONNECTION_TABLE_NAME']
 connection_table_pk = os.environ['CONNECTION_TABLE_PK']
 data_table_name = os.environ['DATA_TABLE_NAME']
 data_table_pk = os.environ['DATA_TABLE_PK']
+match_results_table_name = os.environ.get('MATCH_RESULTS_TABLE_NAME', '')
+rating_period_seconds = int(os.environ.get('RATING_PERIOD_SECONDS', '0')) # 0 rates every match as soon as it finishes
 
+MATCH_RESULTS = {'home': 1, 'away': 0, 'draw': 0.5}
+MAX_RATING_COMMIT_ATTEMPTS = 5 # Ratings are read and computed again when another result of the same players was committed first
+
+
+def teams_error(home_ids: list[str], away_ids: list[str]):
+    """
+    Why the teams of a result can't be rated, None when they can
+    """
+    if not isinstance(home_ids, list) or not isinstance(away_ids, list) or not all(isinstance(user_id, str) for user_id in home_ids + away_ids):
+        return "Invalid teams, expected home and away lists of user ids"
+    if not home_ids or not away_ids:
+        return "Invalid teams, both teams need at least one player"
+    if len(set(home_ids + away_ids)) < len(home_ids + away_ids):
+        return "Invalid teams, a player is listed more than once"
+    return None
 
 def lambda_handler(event:dict, context):
-    body:dict = json.loads(event.get('body', '{}'))
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except (json.JSONDecodeError, TypeError):
+        body = None
+    if not isinstance(body, dict):
+        return {
+            'statusCode': 400,
+            'body': 'Invalid body, expected a JSON object with home, away and result'
+        }
     home_ids: list[str] = body.get('home', [])
     away_ids: list[str] = body.get('away', [])
-    result: list[str] = body.get('result', [])
-    
+    result: str = body.get('result', '')
+
+    if not isinstance(result, str) or result not in MATCH_RESULTS:
+        return {
+            'statusCode': 400,
+            'body': f"Invalid result, expected one of {', '.join(MATCH_RESULTS)}"
+        }
+
+    error = teams_error(home_ids, away_ids) # Checked before anything is written, logged results are only rated when their period closes
+    if error:
+        return {
+            'statusCode': 400,
+            'body': error
+        }
+
     webSocketRepo = WebSocketRepository(connection_table_name, connection_table_pk, data_table_name, data_table_pk)
 
-    for user_id in home_ids + away_ids:
-        webSocketRepo.set_user_not_in_match(user_id)
-
-    home_users:list[User] = [webSocketRepo.get_user_data(user_id) for user_id in home_ids]
-    away_users:list[User] = [webSocketRepo.get_user_data(user_id) for user_id in away_ids]
-    
-    away_players = [(Player(user.rating,user.rd,float(user.vol)),user.user_id) for user in away_users]
-    home_players = [(Player(user.rating,user.rd,float(user.vol)),user.user_id) for user in home_users]
-    
-    if result == 'home':
-        teamRatingCalculator = TeamRatingCalculator(home_players,away_players,1)
-    elif result == 'away':
-        teamRatingCalculator = TeamRatingCalculator(home_players,away_players,0)
-    elif result == 'draw':
-        teamRatingCalculator = TeamRatingCalculator(home_players,away_players,0.5)
+    if rating_period_seconds > 0 and match_results_table_name: # Rated with the rest of the period when it closes
+        results_log = MatchResultLogRepository(match_results_table_name)
+        users = webSocketRepo.get_users_data(home_ids + away_ids, consistent_read=True) # Also for their latest connections
+        unknown_ids = [user_id for user_id in home_ids + away_ids if user_id not in users]
+        if unknown_ids:
+            return {
+                'statusCode': 404,
+                'body': f"Unknown players: {', '.join(unknown_ids)}"
+            }
+        webSocketRepo.finish_match(home_ids + away_ids, [results_log.append_result_transact_item(home_ids, away_ids, MATCH_RESULTS[result], rating_period_seconds)])
+        webSocketRepo.sync_connection_profiles(list(users.values()), in_match=False)
+        return {
+            'statusCode': 200,
+        }
+
+    for _ in range(MAX_RATING_COMMIT_ATTEMPTS):
+        users = webSocketRepo.get_users_data(home_ids + away_ids, consistent_read=True)
+        unknown_ids = [user_id for user_id in home_ids + away_ids if user_id not in users]
+        if unknown_ids:
+            return {
+                'statusCode': 404,
+                'body': f"Unknown players: {', '.join(unknown_ids)}"
+            }
+        home_users:list[User] = [users[user_id] for user_id in home_ids]
+        away_users:list[User] = [users[user_id] for user_id in away_ids]
+
+        away_players = [(Player(user.rating,user.rd,float(user.vol)),user.user_id) for user in away_users]
+        home_players = [(Player(user.rating,user.rd,float(user.vol)),user.user_id) for user in home_users]
+
+        teamRatingCalculator = TeamRatingCalculator(home_players,away_players,MATCH_RESULTS[result])
+
+        ratings = []
+        for player in away_players + home_players:
+            updated_player = teamRatingCalculator.update_rating(player[0])
+            ratings.append((users[player[1]],int(updated_player.rating),int(updated_player.rd),Decimal(str(updated_player.vol))))
+
+        try:
+            webSocketRepo.commit_match_ratings(ratings)
+            webSocketRepo.sync_connection_profiles(list(users.values()), {user.user_id: (rating, rd, vol) for user, rating, rd, vol in ratings}, in_match=False)
+            break
+        except RatingCommitFailed:
+            print(f"Ratings of {home_ids + away_ids} changed while rating the match, retrying")
     else:
-        raise Exception('Invalid result')
-    
-    for player in away_players + home_players:
-        updated_player = teamRatingCalculator.update_rating(player[0])
-        webSocketRepo.update_user_rating(player[1],int(updated_player.rating),int(updated_player.rd),Decimal(str(updated_player.vol)))
-        
+        return {
+            'statusCode': 409,
+            'body': 'Ratings were updated concurrently, retry the request'
+        }
+
     return {
         'statusCode': 200,
     }
@@ -0,0 +1,35 @@
+import os
+import json
+from botocore.exceptions import ClientError
+from queueStats import QueueStatsRepository, QueueStatsReader
+
+control_table_name = os.environ['CONTROL_TABLE_NAME']
+matchmaking_regions = [region for region in os.environ.get('MATCHMAKING_REGIONS', '').split(',') if region]
+queue_stats_max_age = float(os.environ.get('QUEUE_STATS_MAX_AGE_SECONDS', '5')) # Warm instances answer from memory for this long
+
+_reader = QueueStatsReader(QueueStatsRepository(control_table_name), queue_stats_max_age)
+
+
+def lambda_handler(event:dict, context):
+    """
+    Queue health for dashboards: depth, wait quantiles and rating histogram of every region,
+    or of the comma separated regions in the region query parameter
+    """
+    parameters:dict = event.get('queryStringParameters') or {}
+    requested = [region for region in parameters.get('region', '').split(',') if region]
+    regions = [region for region in matchmaking_regions if not requested or region in requested]
+    
+    try:
+        stats = _reader.get_queue_stats(regions)
+    except ClientError as e:
+        print(f'Error reading queue stats: {e}')
+        return {
+            'statusCode': 500,
+            'body': 'Error reading queue stats'
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(stats)
+    }
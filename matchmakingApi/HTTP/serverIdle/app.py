@@ -0,0 +1,43 @@
+import os
+import json
+from gameServerPool import GameServerPoolRepository, parse_task_arn, get_server_task_ip
+
+server_pool_table_name = os.environ['SERVER_POOL_TABLE_NAME']
+
+
+def lambda_handler(event:dict, context):
+    """
+    Called by game servers started without players, adds them to the pool of idle servers of their region.
+    The region and ip of the server are read from its ECS task, not from the request.
+    """
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except (json.JSONDecodeError, TypeError):
+        body = None
+    if not isinstance(body, dict):
+        return {
+            'statusCode': 400,
+            'body': 'Body must be a JSON object'
+        }
+    task_arn = body.get('task_arn')
+    assign_token = body.get('assign_token')
+    region = parse_task_arn(task_arn) if isinstance(task_arn, str) else None # arn:aws:ecs:<region>:<account>:task/<cluster>/<id>
+
+    if not region or not assign_token or not isinstance(assign_token, str):
+        return {
+            'statusCode': 400,
+            'body': 'task_arn of a matchmaking server task and assign_token are required'
+        }
+
+    server_ip = get_server_task_ip(task_arn, region)
+    if not server_ip:
+        return {
+            'statusCode': 403,
+            'body': 'task_arn is not a running matchmaking server'
+        }
+
+    GameServerPoolRepository(server_pool_table_name).set_server_idle(region, task_arn, server_ip, assign_token)
+
+    return {
+        'statusCode': 200,
+    }
@@ -1,7 +1,8 @@
 import os
-import boto3
+from awsClients import get_client
 import json
 from matchmakingTableRepository import WebSocketRepository, Match, User, UserNotFound
+from websocketNotifier import WebSocketNotifier
 
 connection_table_name = os.environ['CONNECTION_TABLE_NAME']
 connection_table_pk = os.environ['CONNECTION_TABLE_PK']
@@ -26,10 +27,11 @@ def lambda_handler(event:dict, context):
         matchmakingDataRepo.set_user_in_match(user_id,server_ip)
     
     endpoint_url="https://"+f"{matchmaking_endpoint}"
-    apigw_client = boto3.client('apigatewaymanagementapi', endpoint_url=endpoint_url)
+    apigw_client = get_client('apigatewaymanagementapi', endpoint_url=endpoint_url)
     
-    for connection_id in connection_ids:
-        apigw_client.post_to_connection(ConnectionId=connection_id, Data="server created with ip: " + str(server_ip))
+    result = WebSocketNotifier(apigw_client).post(connection_ids, "server created with ip: " + str(server_ip))
+    if result.gone:
+        matchmakingDataRepo.delete_connections(result.gone)
         
     return {
         'statusCode': 200,
@@ -0,0 +1,116 @@
+from botocore.exceptions import ClientError
+from matchmakingTableRepository import WebSocketRepository
+from ratingPeriod import MatchResultLogRepository, RatingPeriodRepository, rating_period_of, fold_rating_period, grow_idle_deviation
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Optional
+import os
+import json
+import time
+import threading
+
+connection_table_name = os.environ['CONNECTION_TABLE_NAME']
+connection_table_pk = os.environ['CONNECTION_TABLE_PK']
+data_table_name = os.environ['DATA_TABLE_NAME']
+data_table_pk = os.environ['DATA_TABLE_PK']
+match_results_table_name = os.environ['MATCH_RESULTS_TABLE_NAME']
+control_table_name = os.environ['CONTROL_TABLE_NAME']
+rating_period_seconds = int(os.environ['RATING_PERIOD_SECONDS'])
+rating_period_grace_seconds = int(os.environ.get('RATING_PERIOD_GRACE_SECONDS', '60')) # Periods are closed this long after they end, for results appended around the boundary
+
+MAX_PERIODS_PER_RUN = 24 # Periods left behind by a long outage are caught up over several runs
+WRITE_WORKERS = 16
+
+_write_repositories = threading.local()
+
+def write_repository():
+    """
+    Repository of the calling write worker, boto3 resources can't be shared between threads
+    """
+    if not hasattr(_write_repositories, 'repository'):
+        _write_repositories.repository = WebSocketRepository(connection_table_name, connection_table_pk, data_table_name, data_table_pk)
+    return _write_repositories.repository
+
+def close_period(webSocketRepo: WebSocketRepository, results_log: MatchResultLogRepository, period: int):
+    """
+    Rates every player who played in the period with all their games. Their deviation first grows for the
+    periods they sat out since they were last rated, the other players are handled by grow_idle_deviations.
+    Every user is written once per period, writes of a period already applied to a user are skipped, so a failed run can be repeated.
+    """
+    results = results_log.get_period_results(period)
+    users = webSocketRepo.get_users_data([user_id for result in results for user_id in result.home_ids + result.away_ids], consistent_read=True) # Sees the previous period closed in the run
+    for user in users.values():
+        if user.rated_period is not None and user.rated_period < period - rating_period_seconds:
+            user.rd = grow_idle_deviation(user.rd, user.vol, (period - user.rated_period) // rating_period_seconds - 1)
+    rated = fold_rating_period(results, users)
+    
+    def write_rating(user_id: str):
+        player = rated[user_id]
+        rating = (int(player.rating), int(player.rd), Decimal(str(player.vol)))
+        repository = write_repository()
+        if not repository.update_user_rating_for_period(user_id, *rating, period):
+            return False
+        repository.sync_connection_profiles([users[user_id]], {user_id: rating}) # Only the rating, the player may be in a match right now
+        return True
+    
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        rated_writes = sum(executor.map(write_rating, rated))
+    return len(results), rated_writes
+
+def grow_idle_deviations(webSocketRepo: WebSocketRepository, closed_through: int, periods_closed: int):
+    """
+    Grows the deviation of every player not rated through closed_through, with a single scan of the players
+    for all the periods closed in the run. Each player gets the growth of every period missed since they were
+    last rated, players never rated get the periods_closed of this run. Players already at INITIAL_RD are not written.
+    The scan may still return players as they were before close_period rated them, their writes fail on the rating version.
+    """
+    def write_deviation(user: tuple[str, int, Decimal, Optional[int], int, str]):
+        user_id, rd, vol, rated_period, rating_version, connection_id = user
+        missed = periods_closed if rated_period is None else (closed_through - rated_period) // rating_period_seconds
+        new_rd = grow_idle_deviation(rd, vol, missed)
+        if new_rd == rd:
+            return False
+        repository = write_repository()
+        if not repository.update_user_rd_for_period(user_id, new_rd, closed_through, rating_version):
+            return False
+        repository.sync_connection_deviation(user_id, connection_id, new_rd)
+        return True
+    
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        idle_users = (user for user in webSocketRepo.scan_user_deviations() if user[3] is None or user[3] < closed_through)
+        return sum(executor.map(write_deviation, idle_users))
+
+def lambda_handler(event, context):
+    """
+    Closes the rating periods that ended at least RATING_PERIOD_GRACE_SECONDS ago since the last run, oldest first,
+    then grows the deviation of the players who didn't play in them
+    """
+    webSocketRepo = WebSocketRepository(connection_table_name, connection_table_pk, data_table_name, data_table_pk)
+    results_log = MatchResultLogRepository(match_results_table_name)
+    periods = RatingPeriodRepository(control_table_name)
+    
+    last_ended = rating_period_of(time.time() - rating_period_grace_seconds, rating_period_seconds) - rating_period_seconds
+    closed_through = periods.get_closed_through()
+    first = last_ended if closed_through is None else closed_through + rating_period_seconds
+    
+    closed:dict[int,dict[str,int]] = {}
+    for period in range(first, last_ended + 1, rating_period_seconds)[:MAX_PERIODS_PER_RUN]:
+        try:
+            results, rated = close_period(webSocketRepo, results_log, period)
+        except ClientError as e:
+            print(f'Error closing rating period {period}: {e}')
+            break
+        periods.set_closed_through(period)
+        closed[period] = {'results': results, 'rated': rated}
+    
+    did_not_compete = 0
+    if closed:
+        try:
+            did_not_compete = grow_idle_deviations(webSocketRepo, max(closed), len(closed))
+        except ClientError as e: # Grown on the next run, from the periods each player missed
+            print(f'Error growing idle deviations: {e}')
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'closed': closed, 'did_not_compete': did_not_compete})
+    }
@@ -0,0 +1,122 @@
+from botocore.exceptions import ClientError
+from matchmakingScheduler import SchedulerTriggerRepository, TickIntervalPolicy
+from awsClients import get_client
+import os
+import json
+import time
+
+control_table_name = os.environ['CONTROL_TABLE_NAME']
+try_create_match_function = os.environ['TRY_CREATE_MATCH_FUNCTION']
+websocket_domain_name = os.environ['WEBSOCKET_DOMAIN_NAME'] # tryCreateMatch alerts the players through it
+min_tick_interval = float(os.environ.get('MIN_TICK_INTERVAL_SECONDS', '1'))
+max_tick_interval = float(os.environ.get('MAX_TICK_INTERVAL_SECONDS', '10')) # Longest a queued player waits for the next run
+trigger_poll_interval = float(os.environ.get('TRIGGER_POLL_SECONDS', '1'))
+scheduler_run_seconds = float(os.environ.get('SCHEDULER_RUN_SECONDS', '55')) # Slightly less than the schedule rate
+
+LAMBDA_TIMEOUT_MARGIN = 2 # Seconds kept free before the lambda times out
+
+class TickFailed(Exception):
+    """
+        Exception when a tryCreateMatch run failed or returned a result that can't be read
+    """
+    def __init__(self, message="tryCreateMatch run failed"):
+        self.message = message
+
+# Kept between warm invocations, so the arrival rates carry over to the next run
+_policy = TickIntervalPolicy(min_tick_interval, max_tick_interval)
+
+def run_tick():
+    """
+    Runs tryCreateMatch once and returns its result, None if Lambda throttled the invoke.
+    Raises TickFailed if the run failed, its result is not used to pace the next one.
+    """
+    try:
+        response = get_client('lambda').invoke(
+            FunctionName=try_create_match_function,
+            InvocationType='RequestResponse',
+            Payload=json.dumps({'requestContext': {'domainName': websocket_domain_name}})
+        )
+    except ClientError as e:
+        # Ticks of this scheduler never overlap, it invokes synchronously and its own reserved concurrency is 1.
+        # A throttle means the TryCreateMatchConcurrency slots are taken by a run started elsewhere
+        # (the last tick of the previous scheduler run, a manual invoke) or the account limit is reached,
+        # either way no run happened and the tick is retried after MIN_TICK_INTERVAL_SECONDS
+        if e.response['Error']['Code'] == 'TooManyRequestsException':
+            print(f"tryCreateMatch throttled: {e.response.get('Reason', e.response['Error'].get('Message'))}")
+            return None
+        raise
+    payload = response['Payload'].read()
+    if 'FunctionError' in response:
+        raise TickFailed(f"tryCreateMatch raised: {payload[:500]!r}")
+    try:
+        result = json.loads(payload)
+        body = json.loads(result['body'])
+    except (KeyError, TypeError, ValueError):
+        raise TickFailed(f"Unreadable tryCreateMatch result: {payload[:500]!r}")
+    if result.get('statusCode') != 200 or not isinstance(body, dict):
+        raise TickFailed(f"tryCreateMatch answered {result.get('statusCode')}: {body}")
+    return body
+
+def lambda_handler(event, context):
+    """
+    Runs matchmaking ticks for most of the schedule period. The next tick is paced by TickIntervalPolicy,
+    and a pending tryCreateMatch request brings it forward, never closer than MIN_TICK_INTERVAL_SECONDS to the previous one.
+    """
+    triggers = SchedulerTriggerRepository(control_table_name)
+    started_at = time.monotonic()
+    run_until = started_at + scheduler_run_seconds
+    if context is not None:
+        run_until = min(run_until, started_at + context.get_remaining_time_in_millis() / 1000 - LAMBDA_TIMEOUT_MARGIN)
+
+    ticks = 0
+    requested_ticks = 0
+    failed_ticks = 0
+    last_tick_at = started_at - min_tick_interval
+    next_tick_at = started_at
+    tick_duration = 0.0
+    while True:
+        now = time.monotonic()
+        if now + tick_duration >= run_until: # The tick would still be running when the next schedule starts
+            break
+
+        if now < next_tick_at:
+            if now - last_tick_at < min_tick_interval or not triggers.is_run_requested():
+                time.sleep(max(0.0, min(trigger_poll_interval, next_tick_at - now, run_until - now)))
+                continue
+
+        requested = triggers.take_run_request() # Requests received until now are served by this tick
+        try:
+            result = run_tick()
+        except TickFailed as e:
+            print(f'Matchmaking tick failed: {e.message}')
+            last_tick_at = time.monotonic()
+            tick_duration = last_tick_at - now
+            failed_ticks += 1
+            if requested: # Served by the next tick
+                triggers.request_run()
+            next_tick_at = last_tick_at + _policy.next_interval()
+            continue
+        last_tick_at = time.monotonic()
+        tick_duration = last_tick_at - now
+        if result is None:
+            if requested: # Keep the request for the next tick
+                triggers.request_run()
+            next_tick_at = last_tick_at + min_tick_interval
+            continue
+
+        if requested:
+            requested_ticks += 1
+
+        ticks += 1
+        _policy.observe(last_tick_at, result.get('queued', {}), result.get('waiting', {}), result.get('match_size', 0))
+        next_tick_at = last_tick_at + _policy.next_interval()
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'ticks': ticks,
+            'requested_ticks': requested_ticks,
+            'failed_ticks': failed_ticks,
+            'arrival_rates': _policy.arrival_rates
+        })
+    }
@@ -0,0 +1,29 @@
+from botocore.exceptions import ClientError
+from gameServerPool import GameServerPoolRepository, refill_server_pool
+import os
+import json
+
+server_pool_table_name = os.environ['SERVER_POOL_TABLE_NAME']
+server_pool_target_size = int(os.environ['SERVER_POOL_TARGET_SIZE']) # Idle servers kept per region
+matchmaking_regions = [region for region in os.environ.get('MATCHMAKING_REGIONS', '').split(',') if region] # Regions with an ecs cluster
+
+
+def lambda_handler(event, context):
+    """
+    Starts idle game servers until every region has SERVER_POOL_TARGET_SIZE servers idle or booting.
+    Invoked on a schedule for every region, and asynchronously by tryCreateMatch with the regions that used servers.
+    """
+    regions = event.get('regions') or matchmaking_regions
+    pool = GameServerPoolRepository(server_pool_table_name)
+    
+    started:dict[str,int] = {}
+    for region in regions:
+        try:
+            started[region] = refill_server_pool(pool, region, server_pool_target_size)
+        except ClientError as e:
+            print(f'Error refilling server pool in {region}: {e}')
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'started': started})
+    }
@@ -0,0 +1,22 @@
+from queueStats import QueueStatsDelta, QueueStatsRepository, stream_batch_id
+import os
+
+control_table_name = os.environ['CONTROL_TABLE_NAME']
+
+
+def lambda_handler(event, context):
+    """
+    Reads batches of the ConnectionTable stream and adds the players that joined, left or were matched
+    to the queue aggregates of their region. Errors are raised so the batch is retried, the regions it
+    was already added to skip it.
+    """
+    records = event.get('Records', [])
+    if not records:
+        return {'statusCode': 200}
+    
+    delta = QueueStatsDelta.from_stream_records(records)
+    QueueStatsRepository(control_table_name).apply(delta, stream_batch_id(records))
+    
+    return {
+        'statusCode': 200,
+    }
@@ -1,7 +1,7 @@
 from botocore.exceptions import ClientError
-from matchmakingTableRepository import WebSocketRepository, UserNotFound, UserAlreadyInMatch
+from matchmakingTableRepository import WebSocketRepository, UserNotFound, UserAlreadyInMatch, UserRegionNotFound
 import os
-import boto3
+from awsClients import get_client
 import json
 
 connection_table_name = os.environ['CONNECTION_TABLE_NAME']  # Replace with the actual table name
@@ -10,31 +10,48 @@ data_table_name = os.environ['DATA_TABLE_NAME']  # Replace with the actual table
 data_table_pk = os.environ['DATA_TABLE_PK']  # Replace with the actual primary key
 
 
+def join_queue(wssRepo: WebSocketRepository, connection_id: str, eos_id: str, region: str):
+    """
+    Joins with the player's data copied on the connection. When the connection has no copy, it is
+    copied again from the player's data, and new players are created in the region they asked for.
+    """
+    try:
+        wssRepo.join_queue(connection_id, eos_id, region)
+        return
+    except UserNotFound: # Connection made before the player existed, or before player data was copied on connections
+        wssRepo.connect(connection_id, eos_id)
+    
+    try:
+        wssRepo.join_queue(connection_id, eos_id, region)
+        return
+    except UserNotFound:
+        if not region:
+            raise UserRegionNotFound()
+    
+    wssRepo.add_new_user(eos_id, region)
+    wssRepo.connect(connection_id, eos_id)
+    wssRepo.join_queue(connection_id, eos_id, region)
+
+
 def lambda_handler(event, context):
     connection_id = event['requestContext']['connectionId']
     eos_id = event['requestContext']['authorizer']['principalId']
     
     endpoint_url="https://"+f"{event['requestContext']['domainName']}"
-    apigw_client = boto3.client('apigatewaymanagementapi', endpoint_url=endpoint_url)
+    apigw_client = get_client('apigatewaymanagementapi', endpoint_url=endpoint_url)
     
     wssRepo = WebSocketRepository(connection_table_name, connection_table_pk, data_table_name, data_table_pk)
     
     try:
         region = json.loads(event['body'])['region']
-        wssRepo.set_user_region(eos_id, region)
     except (KeyError, TypeError):
         region = ""
     
     try:
-        wssRepo.join_queue(connection_id)
+        join_queue(wssRepo, connection_id, eos_id, region)
         apigw_client.post_to_connection(ConnectionId=connection_id, Data="joined queue")
-    except UserNotFound:
-        if not region:
-            apigw_client.post_to_connection(ConnectionId=connection_id, Data="No region set for user")
-        else:
-            wssRepo.add_new_user(eos_id, region)
-            wssRepo.join_queue(connection_id)
-            apigw_client.post_to_connection(ConnectionId=connection_id, Data="joined queue")
+    except UserRegionNotFound:
+        apigw_client.post_to_connection(ConnectionId=connection_id, Data="No region set for user")
     except UserAlreadyInMatch:
         apigw_client.post_to_connection(ConnectionId=connection_id, Data="already in match")
     return {
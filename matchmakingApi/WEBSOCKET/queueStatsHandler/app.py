@@ -0,0 +1,41 @@
+from botocore.exceptions import ClientError
+from queueStats import QueueStatsRepository, QueueStatsReader
+import os
+import json
+from awsClients import get_client
+
+control_table_name = os.environ['CONTROL_TABLE_NAME']
+matchmaking_regions = [region for region in os.environ.get('MATCHMAKING_REGIONS', '').split(',') if region]
+queue_stats_max_age = float(os.environ.get('QUEUE_STATS_MAX_AGE_SECONDS', '5')) # Warm instances answer from memory for this long
+
+_reader = QueueStatsReader(QueueStatsRepository(control_table_name), queue_stats_max_age)
+
+
+def lambda_handler(event, context):
+    """
+    Handles the queueStats action: depth, wait quantiles and rating histogram of every region,
+    or of the regions in the message, read from the aggregates instead of the queue
+    """
+    connection_id = event['requestContext']['connectionId']
+    endpoint_url="https://"+f"{event['requestContext']['domainName']}"
+    apigw_client = get_client('apigatewaymanagementapi', endpoint_url=endpoint_url)
+    
+    try:
+        requested = json.loads(event['body'])['regions']
+    except (KeyError, TypeError, ValueError):
+        requested = []
+    regions = [region for region in matchmaking_regions if not requested or region in requested]
+    
+    try:
+        stats = _reader.get_queue_stats(regions)
+    except ClientError as e:
+        print(f'Error reading queue stats: {e}')
+        return {
+            'statusCode': 500,
+            'body': f"Error: AWS CLIENT ERROR"
+        }
+    
+    apigw_client.post_to_connection(ConnectionId=connection_id, Data=json.dumps(stats))
+    return {
+        'statusCode': 200,
+    }
@@ -0,0 +1,24 @@
+from botocore.exceptions import ClientError
+from matchmakingScheduler import SchedulerTriggerRepository
+import os
+
+control_table_name = os.environ['CONTROL_TABLE_NAME']
+
+
+def lambda_handler(event, context):
+    """
+    Handles the tryCreateMatch action. Matching is run by the scheduler, the action only asks it to run early,
+    and requests sent while a run is already pending are merged into it.
+    """
+    try:
+        SchedulerTriggerRepository(control_table_name).request_run()
+    except ClientError as e:
+        print(f'Error requesting a matchmaking run: {e}')
+        return {
+            'statusCode': 500,
+            'body': f"Error: AWS CLIENT ERROR"
+        }
+
+    return {
+        'statusCode': 200,
+    }
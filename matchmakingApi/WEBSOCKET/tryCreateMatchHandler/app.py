@@ -1,25 +1,189 @@
 from glicko_team import Player
 import random
-from matchmakingTableRepository import WebSocketRepository, User, Match, MATCH_SIZE
+from bisect import bisect_left, bisect_right
+from heapq import heappush, heappop
+from itertools import islice
+from matchmakingTableRepository import WebSocketRepository, User, Match, MatchCommitFailed, MATCH_SIZE
+from typing import Iterable, Optional
+from websocketNotifier import WebSocketNotifier
+from awsClients import get_client
+from gameServerPool import GameServerPoolRepository, assign_server, run_ecs_task
+from queueState import QueueState, StreamQueueFeed, StreamFeedExpired
+from searchWindow import SearchWindowCurve, ReevaluationEngine
+from queueColumns import QueueColumns
+from tickMetrics import TickMetrics, DEFAULT_NAMESPACE
+from teamSplit import TeamSplitter
 from botocore.exceptions import ClientError
 import os
-import boto3
+import uuid
+import json
+import time
+import traceback
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError: # numpy is optional, without it the pure python matcher is always used
+    np = None
 
 connection_table_name = os.environ['CONNECTION_TABLE_NAME']  # Replace with the actual table name
 connection_table_pk = os.environ['CONNECTION_TABLE_PK']  # Replace with the actual primary key
 data_table_name = os.environ['DATA_TABLE_NAME']  # Replace with the actual table name
 data_table_pk = os.environ['DATA_TABLE_PK']  # Replace with the actual primary key
+connection_table_queue_index = os.environ.get('CONNECTION_TABLE_QUEUE_INDEX', '') # Sparse queue index, the table is scanned when empty
+queue_scan_segments = int(os.environ.get('QUEUE_SCAN_SEGMENTS', '1')) # Parallel scan segments when there is no queue index
+matchmaking_regions = [region for region in os.environ.get('MATCHMAKING_REGIONS', '').split(',') if region] # Regions with an ecs cluster
+matcher_mode = os.environ.get('MATCHER_MODE', 'python') # 'python', 'numpy' or 'sharded'
+matcher_processes = int(os.environ.get('MATCHER_PROCESSES', '0')) or (os.cpu_count() or 1) # Processes of the sharded matcher
+sharded_min_queue_size = int(os.environ.get('SHARDED_MIN_QUEUE_SIZE', '20000')) # Smaller queues are matched in process by the numpy matcher
+queue_source = os.environ.get('QUEUE_SOURCE', 'snapshot') # 'snapshot' reads the whole queue every run, 'stream' keeps it in memory from the table stream
+connection_table_stream_arn = os.environ.get('CONNECTION_TABLE_STREAM_ARN', '')
+server_pool_table_name = os.environ.get('SERVER_POOL_TABLE_NAME', '')
+server_pool_target_size = int(os.environ.get('SERVER_POOL_TARGET_SIZE', '0')) # Idle servers kept per region, 0 starts a new server for every match
+refill_server_pool_function = os.environ.get('REFILL_SERVER_POOL_FUNCTION', '')
+region_time_budget = float(os.environ.get('REGION_TIME_BUDGET_SECONDS', '20')) # Seconds a region can spend provisioning matches
+region_workers = int(os.environ.get('REGION_WORKERS', '4')) # Regions matched at the same time
+search_window_curve = SearchWindowCurve.from_string(os.environ.get('SEARCH_WINDOW_CURVE', '')) # Growth of the rating window with the wait, fixed at rd * 2 when empty
+reevaluate_changed_only = os.environ.get('REEVALUATE_CHANGED_ONLY', 'false') == 'true' # The python matcher only searches from players whose window grew or got new neighbours
+tick_metrics_enabled = os.environ.get('TICK_METRICS', 'false') == 'true' # Prints the phase timings and counters of each tick as CloudWatch EMF lines
+metrics_namespace = os.environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE)
+team_split_rd_weight = float(os.environ.get('TEAM_SPLIT_RD_WEIGHT', '0')) # Weight of the combined RD difference of the teams, 0 balances ratings only
 
-def find_intersecting_players(potential_match_players: list[User]):
-    if len(potential_match_players) < MATCH_SIZE:
-        return None
+LAMBDA_TIMEOUT_MARGIN = 2 # Seconds kept free before the lambda times out
+MAX_CLAIM_ROUNDS = 3 # Times the players of matches that lost a claim are matched again in a run
+
+# Kept between warm invocations when the queue comes from the table stream
+_queue_state: Optional[QueueState] = None
+_queue_feed: Optional[StreamQueueFeed] = None
+
+# Created on the first sharded match and kept for the life of the process
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+# Remembers what each player was last evaluated with, between warm invocations
+_reevaluation_engine = ReevaluationEngine(search_window_curve)
+_team_splitter = TeamSplitter(team_split_rd_weight)
+
+class RatingIntervalIndex:
+    """
+    Index of a region queue sorted by rating, used to look up the players inside a rating window
+    without scanning the whole queue. The window is found with a bisect over the sorted ratings, and a min tree
+    over the sorted slots gives the earliest player still waiting in any slot range, so the window is handed out
+    in queue order one player at a time, each in O(log n), without collecting or sorting it.
+    Players are addressed by their position in the queue.
+    """
+    def __init__(self, queue: list[User]):
+        self._positions = sorted(range(len(queue)), key=lambda position: queue[position].rating)
+        self._ratings = [queue[position].rating for position in self._positions]
+        self._slots = [0] * len(queue)
+        for slot, position in enumerate(self._positions):
+            self._slots[position] = slot
+        self._leaves = 1 << max(0, len(queue) - 1).bit_length()
+        self._removed = len(queue) # Larger than every queue position
+        self._tree = [self._removed] * (2 * self._leaves) # Earliest queue position waiting under each node
+        self._tree[self._leaves:self._leaves + len(queue)] = self._positions
+        for node in range(self._leaves - 1, 0, -1):
+            self._tree[node] = min(self._tree[2 * node], self._tree[2 * node + 1])
+
+    def _earliest(self, start_slot: int, end_slot: int):
+        """
+        Earliest queue position still waiting in the slots start_slot to end_slot (excluded), len(queue) if none
+        """
+        earliest = self._removed
+        low = start_slot + self._leaves
+        high = end_slot + self._leaves
+        while low < high:
+            if low & 1:
+                earliest = min(earliest, self._tree[low])
+                low += 1
+            if high & 1:
+                high -= 1
+                earliest = min(earliest, self._tree[high])
+            low >>= 1
+            high >>= 1
+        return earliest
+
+    def window(self, min_rating, max_rating):
+        """
+        Yields the queue positions of the players with min_rating <= rating <= max_rating, in queue order.
+        Players are only looked up as they are consumed, players removed while iterating may still be yielded.
+        """
+        ranges:list[tuple[int,int,int]] = []
+        def push(start_slot: int, end_slot: int):
+            if start_slot < end_slot:
+                earliest = self._earliest(start_slot, end_slot)
+                if earliest < self._removed:
+                    heappush(ranges, (earliest, start_slot, end_slot))
+        push(bisect_left(self._ratings, min_rating), bisect_right(self._ratings, max_rating))
+        while ranges:
+            position, start_slot, end_slot = heappop(ranges)
+            yield position
+            slot = self._slots[position]
+            push(start_slot, slot)
+            push(slot + 1, end_slot)
+
+    def remove(self, position: int):
+        node = self._slots[position] + self._leaves
+        self._tree[node] = self._removed
+        node >>= 1
+        while node:
+            self._tree[node] = min(self._tree[2 * node], self._tree[2 * node + 1])
+            node >>= 1
+
+class _WaitingPositions:
+    """
+    Fenwick tree over queue positions that tracks which players are still waiting for a match.
+    """
+    def __init__(self, size: int):
+        self._size = size
+        self._count = size
+        self._tree = [0] * (size + 1)
+        for i in range(1, size + 1):
+            self._tree[i] += 1
+            parent = i + (i & -i)
+            if parent <= size:
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self):
+        return self._count
+
+    def remove(self, position: int):
+        i = position + 1
+        while i <= self._size:
+            self._tree[i] -= 1
+            i += i & -i
+        self._count -= 1
 
-    next_candidate_index = MATCH_SIZE
+    def nth(self, n: int):
+        """
+        Returns the queue position of the n-th (0 based) player still waiting
+        """
+        position = 0
+        step = 1 << self._size.bit_length()
+        while step:
+            if position + step <= self._size and self._tree[position + step] <= n:
+                position += step
+                n -= self._tree[position]
+            step >>= 1
+        return position
+
+def find_intersecting_players(potential_match_players: Iterable[User]):
+    """
+    Returns MATCH_SIZE players whose rating windows all overlap, None if there aren't any.
+    Players are taken in the order given, and only as many as needed are read from potential_match_players.
+    """
+    potential_match_players = iter(potential_match_players)
 
     # Initialize the list of candidates
-    candidates = potential_match_players[:MATCH_SIZE]
+    candidates = list(islice(potential_match_players, MATCH_SIZE))
+    if len(candidates) < MATCH_SIZE:
+        return None
 
-    while len(potential_match_players) >= MATCH_SIZE:
+    while True:
         lowest_maximum_player = min(candidates, key=lambda player: player.MaxMatchupRating()) # Lowest rating the match can have
         highest_minimum_player = max(candidates, key=lambda player: player.MinMatchupRating()) # Highest rating the match can have
 
@@ -28,186 +192,523 @@ def find_intersecting_players(potential_match_players: list[User]):
         
         replaced_candidates = False
         while not replaced_candidates:
-            if len(potential_match_players) < next_candidate_index + 1:
+            next_candidate = next(potential_match_players, None) # Players that are skipped or replaced are never evaluated again
+            if next_candidate is None:
                 return None
-            next_candidate = potential_match_players[next_candidate_index]
-            
             
             if next_candidate.MinMatchupRating() < highest_minimum_player.MinMatchupRating() and next_candidate.MaxMatchupRating() > lowest_maximum_player.MaxMatchupRating(): # Next candidate is a better fit
                 
                 if random.random() < 0.5: # Replace the highest minimum player
                     candidates.remove(highest_minimum_player)
-                    potential_match_players.remove(highest_minimum_player)
                     candidates.append(next_candidate)
                 else: # Replace the lowest maximum player
                     candidates.remove(lowest_maximum_player)
-                    potential_match_players.remove(lowest_maximum_player)
                     candidates.append(next_candidate)
                 
                 replaced_candidates = True
-            else:
-                potential_match_players.remove(next_candidate)
     
-def find_matches_from_queue(queue:list[User]):
+def split_teams(match_players: list[User]):
+    """
+    Splits the players in the two most balanced teams, every possible split is scored
+    """
+    return _team_splitter.split(match_players)
+
+def find_matches_from_queue(queue:list[User], anchors: Optional[set[str]] = None, metrics: Optional[TickMetrics] = None):
+    """
+    Greedily pairs players, taking each waiting player in queue order as the anchor of a match.
+    When anchors is given only those connection ids are taken as anchors, every player can still be picked into their matches.
+    Matched players are removed from the queue. The players looked at as candidates are counted in metrics.
+    """
     matches_created:list[Match] = []
     if len(queue) < MATCH_SIZE:
         return matches_created
-    for user in queue:
-        potential_match_players = [user] + [
-            teammate for teammate in queue 
-            if teammate != user 
-            and abs(user.rating - teammate.rating) <= user.max_matchup_delta
-        ]
     
-        match_players = find_intersecting_players(potential_match_players)
+    rating_index = RatingIntervalIndex(queue)
+    waiting = _WaitingPositions(len(queue))
+    queue_positions = {user: position for position, user in enumerate(queue)}
+    
+    candidates = 0
+    def window_players(user: User, position: int):
+        """
+        The anchor then the players in their rating window in queue order, read only as far as the match search needs
+        """
+        nonlocal candidates
+        candidates += 1
+        yield user
+        for teammate_position in rating_index.window(user.rating - user.max_matchup_delta, user.rating + user.max_matchup_delta):
+            if teammate_position != position:
+                candidates += 1
+                yield queue[teammate_position]
+    
+    anchor_index = 0
+    while anchor_index < len(waiting) and len(waiting) >= MATCH_SIZE:
+        position = waiting.nth(anchor_index)
+        user = queue[position]
+        if anchors is not None and user.connection_id not in anchors:
+            anchor_index += 1
+            continue
+        match_players = find_intersecting_players(window_players(user, position))
         if match_players:
-            match_players.sort(key=lambda player: player.rating)
-            
-            team1a = [player for i, player in enumerate(match_players) if i % 2 == 0] 
-            team2a = [player for i, player in enumerate(match_players) if i % 2 == 1]
-            
-            team1b = [player for i, player in enumerate(match_players) if i % 4 <= 1]
-            team2b = [player for i, player in enumerate(match_players) if i % 4 >= 2]
-            
-            avarage_a = abs(sum([player.rating for player in team1a]) - sum([player.rating for player in team2a]))/MATCH_SIZE
-            avarage_b = abs(sum([player.rating for player in team1b]) - sum([player.rating for player in team2b]))/MATCH_SIZE
-            
-            if avarage_a < avarage_b:
-                team1 = team1a
-                team2 = team2a
-            else:
-                team1 = team1b
-                team2 = team2b
-                
             for player in match_players:
-                queue.remove(player)
-            matches_created.append(Match(team1, team2))
+                rating_index.remove(queue_positions[player])
+                waiting.remove(queue_positions[player])
+            matches_created.append(split_teams(match_players))
+        anchor_index += 1 # Same cursor semantics as iterating the queue list while removing matched players
+    
+    queue[:] = [queue[waiting.nth(i)] for i in range(len(waiting))]
+    if metrics is not None:
+        metrics.count('CandidatesEvaluated', candidates)
     return matches_created
 
-def get_subnet_id_by_name(subnet_name:str, region_name:str):
-    ec2_client = boto3.client('ec2', region_name=region_name)
-    response = ec2_client.describe_subnets(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [subnet_name]
-            }
-        ]
-    )
+def find_matches_from_queue_vectorized(queue:list[User], metrics: Optional[TickMetrics] = None):
+    """
+    Vectorized matcher, needs numpy.
+    Loads the queue into rating sorted arrays and evaluates every window of MATCH_SIZE neighbouring players at once,
+    a window is feasible when the lowest maximum matchup rating is above the highest minimum matchup rating.
+    Feasible windows are taken oldest first (by the longest waiting player in the window) until they overlap,
+    then the windows are recomputed over the players left, until no feasible window remains.
+    Matched players are removed from the queue. The windows evaluated are counted in metrics.
+    """
+    matches_created:list[Match] = []
+    if len(queue) < MATCH_SIZE:
+        return matches_created
+    
+    ratings, max_matchup_ratings, min_matchup_ratings, joined_at = _queue_arrays(queue)
+    waiting = np.lexsort((np.arange(len(queue)), joined_at, ratings)) # Queue positions sorted by rating
+    windows, waiting = _take_feasible_windows(max_matchup_ratings, min_matchup_ratings, joined_at, waiting, metrics)
+    for window in windows:
+        matches_created.append(split_teams([queue[position] for position in window.tolist()]))
+    
+    waiting.sort()
+    _keep_positions(queue, waiting.tolist())
+    return matches_created
 
-    subnets = response['Subnets']
-    if not subnets:
-        raise ValueError(f"No subnet found with name '{subnet_name}'")
-    return subnets[0]['SubnetId'] # type: ignore
+def _queue_arrays(queue:list[User]):
+    """
+    Returns the ratings, maximum and minimum matchup ratings and join times of the queue as numpy arrays.
+    The columns of a QueueColumns are read in place, without building the users.
+    """
+    if isinstance(queue, QueueColumns):
+        ratings = np.frombuffer(queue.ratings, dtype=np.int32).astype(np.float64)
+        if queue.matchup_deltas is None:
+            deltas = np.frombuffer(queue.rds, dtype=np.uint16) * 2.0
+        else:
+            deltas = np.frombuffer(queue.matchup_deltas, dtype=np.float64)
+        joined_at = np.frombuffer(queue.joined_at, dtype=np.int64)
+    else:
+        ratings = np.fromiter((user.rating for user in queue), dtype=np.float64, count=len(queue))
+        deltas = np.fromiter((user.max_matchup_delta for user in queue), dtype=np.float64, count=len(queue))
+        joined_at = np.fromiter((user.joined_at for user in queue), dtype=np.int64, count=len(queue))
+    max_matchup_ratings = np.trunc(ratings + deltas) # Same truncation as User.MaxMatchupRating
+    min_matchup_ratings = np.trunc(ratings - deltas) # Same truncation as User.MinMatchupRating
+    return ratings, max_matchup_ratings, min_matchup_ratings, joined_at
+
+def _keep_positions(queue:list[User], positions:list[int]):
+    """
+    Keeps the players at the given queue positions, in increasing order, and removes the rest
+    """
+    if isinstance(queue, QueueColumns):
+        queue.retain(positions)
+    else:
+        queue[:] = [queue[position] for position in positions]
+
+def _take_feasible_windows(max_matchup_ratings, min_matchup_ratings, joined_at, waiting, metrics: Optional[TickMetrics] = None):
+    """
+    Takes non overlapping feasible windows of MATCH_SIZE players, oldest first, over the waiting indexes (sorted by rating),
+    recomputing the windows over the players left until none is feasible. Returns the windows taken and the indexes left.
+    """
+    windows = []
+    while len(waiting) >= MATCH_SIZE:
+        if metrics is not None:
+            metrics.count('CandidatesEvaluated', len(waiting) - MATCH_SIZE + 1)
+        lowest_maximums = sliding_window_view(max_matchup_ratings[waiting], MATCH_SIZE).min(axis=1)
+        highest_minimums = sliding_window_view(min_matchup_ratings[waiting], MATCH_SIZE).max(axis=1)
+        window_starts = np.flatnonzero(lowest_maximums >= highest_minimums)
+        if len(window_starts) == 0:
+            break
+        
+        oldest_joined_at = sliding_window_view(joined_at[waiting], MATCH_SIZE).min(axis=1)[window_starts]
+        window_starts = window_starts[np.argsort(oldest_joined_at, kind='stable')]
+        
+        taken = [False] * len(waiting)
+        for start in window_starts.tolist():
+            end = start + MATCH_SIZE - 1
+            if taken[start] or taken[end]: # Windows have the same size, so any overlap covers one of the ends
+                continue
+            taken[start:end + 1] = [True] * MATCH_SIZE
+            windows.append(waiting[start:end + 1])
+        waiting = waiting[~np.array(taken)]
+    return windows, waiting
+
+def _get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # Forking a process that runs other threads can copy their held locks, forkserver starts clean processes
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None
+            _process_pool = ProcessPoolExecutor(max_workers=matcher_processes, mp_context=multiprocessing.get_context(start_method))
+        return _process_pool
+
+def _match_band(snapshot_name: str, size: int, band_start: int, band_end: int, core_start: int, core_end: int):
+    """
+    Runs in a pool process. Matches the players band_start to band_end of the rating sorted snapshot in shared memory,
+    returns the windows taken that have a player in the band's core as (oldest join time, snapshot indexes),
+    windows outside the core are found by the neighbouring band.
+    """
+    snapshot_memory = shared_memory.SharedMemory(name=snapshot_name)
+    snapshot = np.ndarray((3, size), dtype=np.float64, buffer=snapshot_memory.buf)
+    max_matchup_ratings, min_matchup_ratings, joined_at = snapshot[0], snapshot[1], snapshot[2]
+    try:
+        windows, _ = _take_feasible_windows(max_matchup_ratings, min_matchup_ratings, joined_at, np.arange(band_start, band_end))
+        return [
+            (int(joined_at[window].min()), window.tolist()) for window in windows
+            if window[-1] >= core_start and window[0] < core_end # Windows are sorted by rating, so by index
+        ]
+    finally:
+        del snapshot, max_matchup_ratings, min_matchup_ratings, joined_at # Views of the buffer have to be released before closing it
+        snapshot_memory.close()
 
-def get_security_group_id_by_name(security_group_name, region_name):
-    ec2 = boto3.client('ec2', region_name=region_name)
+def find_matches_from_queue_sharded(queue:list[User], metrics: Optional[TickMetrics] = None):
+    """
+    Multi process matcher, needs numpy. The rating sorted queue is split into one band per process, each band
+    extended on both sides by the widest rating span a match can have, so every match is fully inside some band.
+    The bands are matched in a process pool that reads the queue from a shared memory snapshot.
+    Matches found by two overlapping bands are merged oldest first, and the players freed by conflicts are matched once more in process.
+    Queues smaller than SHARDED_MIN_QUEUE_SIZE, and hosts without shared memory, use the numpy matcher.
+    Matched players are removed from the queue. Only the windows evaluated in process are counted in metrics.
+    """
+    if len(queue) < max(sharded_min_queue_size, MATCH_SIZE) or matcher_processes < 2:
+        return find_matches_from_queue_vectorized(queue, metrics)
     
-    filters = [
-        {
-            'Name': 'tag:Name',
-            'Values': [security_group_name]
-        }
-    ]
-    
-    response = ec2.describe_security_groups(Filters=filters) # type: ignore
-    
-    if len(response['SecurityGroups']) == 0:
-        raise Exception(f"Security group with name '{security_group_name}' not found in region '{region_name}'")
-    elif len(response['SecurityGroups']) > 1:
-        raise Exception(f"Multiple security groups with name '{security_group_name}' found in region '{region_name}'")
-
-    return response['SecurityGroups'][0]['GroupId'] # type: ignore
-
-def run_ecs_task(user_ids: list[str], connection_ids: list[str], region_name: str):
-    ecs_client = boto3.client('ecs', region_name=region_name)
-    
-    user_ids_str = ','.join(str(uid) for uid in user_ids)
-    connection_ids_str = ','.join(str(cid) for cid in connection_ids)
-
-    response = ecs_client.run_task(
-        cluster='MATCHMAKING-CLUSTER',
-        taskDefinition='matchmaking-server',
-        overrides={
-            'containerOverrides': [
-                {
-                    'name': 'GameServerContainer',
-                    'environment': [
-                        {
-                            'name': 'USER_IDS',
-                            'value': user_ids_str
-                        },
-                        {
-                            'name': 'CONNECTION_IDS',
-                            'value': connection_ids_str
-                        }
-                    ]
-                }
-            ]
-        },
-        launchType='FARGATE',
-        networkConfiguration={
-            'awsvpcConfiguration': {
-                'subnets': [
-                    get_subnet_id_by_name('MatchmakingSubnetA',region_name=region_name),
-                ],
-                'securityGroups': [
-                    get_security_group_id_by_name(f'MATCHMAKING-CLUSTER-{region_name}-SecurityGroup', region_name=region_name),
-                ],
-                'assignPublicIp': 'ENABLED'
-            }
-        },
-        count=1,
-    )
-    return response
+    matches_created:list[Match] = []
+    size = len(queue)
+    ratings, max_matchup_ratings, min_matchup_ratings, joined_at = _queue_arrays(queue)
+    order = np.lexsort((np.arange(size), joined_at, ratings)) # Snapshot index -> queue position
+    sorted_ratings = ratings[order]
+    overlap = float((max_matchup_ratings - min_matchup_ratings).max()) + 2 # Truncation can widen a match by a point on each side
+    
+    core_bounds = np.linspace(0, size, matcher_processes + 1).astype(np.int64).tolist()
+    bands = []
+    for core_start, core_end in zip(core_bounds, core_bounds[1:]):
+        if core_start == core_end:
+            continue
+        band_start = int(np.searchsorted(sorted_ratings, sorted_ratings[core_start] - overlap, side='left'))
+        band_end = int(np.searchsorted(sorted_ratings, sorted_ratings[core_end - 1] + overlap, side='right'))
+        bands.append((band_start, band_end, core_start, core_end))
+    
+    try:
+        snapshot_memory = shared_memory.SharedMemory(create=True, size=3 * size * np.dtype(np.float64).itemsize)
+    except OSError as e: # No shared memory on the host, lambda has no /dev/shm
+        print(f"Shared memory not available, matching in process: {e}")
+        return find_matches_from_queue_vectorized(queue, metrics)
+    try:
+        snapshot = np.ndarray((3, size), dtype=np.float64, buffer=snapshot_memory.buf)
+        snapshot[0] = max_matchup_ratings[order]
+        snapshot[1] = min_matchup_ratings[order]
+        snapshot[2] = joined_at[order]
+        del snapshot
+        pool = _get_process_pool()
+        futures = [pool.submit(_match_band, snapshot_memory.name, size, *band) for band in bands]
+        candidates = [candidate for future in futures for candidate in future.result()]
+    finally:
+        snapshot_memory.close()
+        snapshot_memory.unlink()
+    
+    # Bands overlap, so players near a boundary can be in matches of two bands, the oldest match keeps them
+    candidates.sort(key=lambda candidate: (candidate[0], candidate[1][0]))
+    taken = [False] * size
+    queue_positions = order.tolist()
+    for _, window in candidates:
+        if any(taken[index] for index in window):
+            continue
+        for index in window:
+            taken[index] = True
+        matches_created.append(split_teams([queue[queue_positions[index]] for index in window]))
+    
+    windows, waiting = _take_feasible_windows(max_matchup_ratings, min_matchup_ratings, joined_at, order[~np.array(taken)], metrics)
+    for window in windows:
+        matches_created.append(split_teams([queue[position] for position in window.tolist()]))
+    
+    waiting.sort()
+    _keep_positions(queue, waiting.tolist())
+    return matches_created
+
+def find_matches(queue:list[User], anchors: Optional[set[str]] = None, metrics: Optional[TickMetrics] = None):
+    """
+    Runs the matcher selected by MATCHER_MODE, falls back to the pure python matcher when numpy is not available.
+    Anchors only restrict the python matcher, the numpy matchers check every window at once.
+    """
+    if matcher_mode == 'sharded' and np is not None:
+        return find_matches_from_queue_sharded(queue, metrics)
+    if matcher_mode == 'numpy' and np is not None:
+        return find_matches_from_queue_vectorized(queue, metrics)
+    return find_matches_from_queue(queue, anchors, metrics)
 
-def create_match(match: Match):
+def create_match(match: Match, pool: Optional[GameServerPoolRepository] = None):
+    """
+    Hands the match to an idle server of the pool when there is one, otherwise starts a new server for it.
+    Returns True when a server of the pool was used.
+    """
     user_ids = [user.user_id for user in match.team1 + match.team2]
     connection_ids = [user.connection_id for user in match.team1 + match.team2]
-    run_ecs_task(user_ids=user_ids, connection_ids=connection_ids, region_name=match.team1[0].region)
-    return
+    region = match.team1[0].region
+    if pool is not None:
+        server = pool.claim_idle_server(region)
+        while server is not None:
+            if assign_server(server, user_ids, connection_ids):
+                return True
+            pool.remove_server(region, server.server_id) # Unreachable, most likely stopped
+            server = pool.claim_idle_server(region)
+    run_ecs_task(user_ids=user_ids, connection_ids=connection_ids, region_name=region)
+    return False
+
+def request_server_pool_refill(region: str):
+    """
+    Invokes the refill function asynchronously, matching doesn't wait for new servers to start
+    """
+    get_client('lambda').invoke(
+        FunctionName=refill_server_pool_function,
+        InvocationType='Event',
+        Payload=json.dumps({'regions': [region]}).encode('utf-8')
+    )
 
-def try_alert_users(match: Match, apigw_client,message:str):
+def try_alert_users(match: Match, notifier: WebSocketNotifier, message:str, wssRepo: WebSocketRepository):
     """
-    Sends a message to all users in a match.
+    Sends a message to all users in a match at once, connections found closed are deleted.
     Returns True if all messages were sent successfully, False otherwise (indicating wss connection is closed/stale)
     """
-    for user in match.team1 + match.team2:
+    result = notifier.post([user.connection_id for user in match.team1 + match.team2], message)
+    if result.gone:
+        wssRepo.delete_connections(result.gone)
+    return result.all_sent()
+
+def start_stream_queue(wssRepo: WebSocketRepository):
+    """
+    Loads the queue from a snapshot and starts following the table stream from that point, returns the queue and its feed
+    """
+    queue_state = QueueState(wssRepo.queue_item_to_user)
+    queue_feed = StreamQueueFeed(get_client('dynamodbstreams'), connection_table_stream_arn or wssRepo.get_connection_stream_arn(), queue_state, connection_table_pk)
+    queue_feed.start()
+    queue_state.load(wssRepo.get_queue_users(matchmaking_regions))
+    queue_feed.poll()
+    return queue_state, queue_feed
+
+def get_stream_queue_state(wssRepo: WebSocketRepository):
+    """
+    Returns the in memory queue, updated with the changes in the table stream since the last run.
+    The queue is rebuilt from a snapshot on cold starts and when the stream position was lost.
+    """
+    global _queue_state, _queue_feed
+    if _queue_state is not None and _queue_feed is not None:
         try:
-            apigw_client.post_to_connection(
-                ConnectionId=user.connection_id,
-                Data=message
-            )
-        except Exception:
-            return False
-    return True
+            _queue_feed.poll()
+            return _queue_state
+        except StreamFeedExpired:
+            print("Stream position lost, rebuilding the queue")
+    
+    _queue_state, _queue_feed = start_stream_queue(wssRepo)
+    return _queue_state
+
+def _widened_deltas(queue: QueueColumns, now: float):
+    """
+    Rating window of every player in the columns for the time they have waited
+    """
+    delta = search_window_curve.delta
+    return (delta(rd, now - joined_at) for rd, joined_at in zip(queue.rds, queue.joined_at))
+
+def match_region(region: str, wssRepo: WebSocketRepository, notifier: WebSocketNotifier, deadline: float, queue: Optional[list[User]] = None, pool: Optional[GameServerPoolRepository] = None, queue_state: Optional[QueueState] = None):
+    """
+    Matches and provisions the queue of a single region, returns the number of matches created and of players read from the queue.
+    When the queue is not given it is read from the queue index, matched players are removed from queue_state when given.
+    Stops provisioning once the region's time budget is over, players left are matched on the next run.
+    With TICK_METRICS set, the time of each phase and what it did are printed as a metrics line at the end.
+    """
+    metrics = TickMetrics({'Region': region}, tick_metrics_enabled, metrics_namespace)
+    try:
+        return _match_region(region, wssRepo, notifier, deadline, queue, pool, queue_state, metrics)
+    finally:
+        metrics.emit()
+
+def new_repositories():
+    """
+    Repositories of the queue and of the server pool, the pool is None when there is no warm server pool.
+    They hold boto3 resources of the calling thread, so each thread matching regions builds its own.
+    """
+    wssRepo = WebSocketRepository(connection_table_name, connection_table_pk, data_table_name, data_table_pk, connection_table_queue_index, queue_scan_segments)
+    pool = GameServerPoolRepository(server_pool_table_name) if server_pool_table_name and server_pool_target_size > 0 else None
+    return wssRepo, pool
+
+def match_region_in_thread(region: str, notifier: WebSocketNotifier, deadline: float, queue: Optional[list[User]] = None, queue_state: Optional[QueueState] = None):
+    """
+    match_region with repositories built in the calling thread, for regions matched in worker threads
+    """
+    wssRepo, pool = new_repositories()
+    return match_region(region, wssRepo, notifier, deadline, queue, pool, queue_state)
+
+def _match_region(region: str, wssRepo: WebSocketRepository, notifier: WebSocketNotifier, deadline: float, queue: Optional[list[User]], pool: Optional[GameServerPoolRepository], queue_state: Optional[QueueState], metrics: TickMetrics):
+    deadline = min(deadline, time.monotonic() + region_time_budget)
+    with metrics.phase('ReadQueue'):
+        if queue is None and matcher_mode in ('numpy', 'sharded') and np is not None:
+            queue = wssRepo.read_region_queue_columns(region, QueueColumns(region))
+        elif queue is None:
+            queue = wssRepo.get_region_queue_users(region)
+    queued = len(queue) # The matcher removes the matched players from the list
+    metrics.count('QueueSize', queued)
+    
+    with metrics.phase('SearchWindow'):
+        if isinstance(queue, QueueColumns): # Only the python matcher searches from anchors
+            anchors: Optional[set[str]] = None
+            if search_window_curve.expands():
+                queue.set_matchup_deltas(_widened_deltas(queue, time.time()))
+        elif reevaluate_changed_only:
+            anchors = _reevaluation_engine.anchors(region, queue, time.time()) # Also widens the windows with the wait
+        else:
+            anchors = None
+            if search_window_curve.expands():
+                now = time.time()
+                for user in queue:
+                    user.max_matchup_delta = search_window_curve.delta(user.rd, now - user.joined_at)
+    if anchors is not None:
+        metrics.count('Anchors', len(anchors))
+    
+    matches_created = 0
+    pool_servers_used = 0
+    out_of_time = False
+    for _ in range(MAX_CLAIM_ROUNDS):
+        released:list[User] = [] # Players of matches that lost a claim, matched again with the players left
+        with metrics.phase('Match'):
+            matches = find_matches(queue, anchors, metrics)
+        metrics.count('MatchesFound', len(matches))
+        for match_number, match in enumerate(matches):
+            if time.monotonic() > deadline:
+                print(f"Region {region} ran out of time budget, {matches_created} matches created")
+                _reevaluation_engine.forget(region, [user.connection_id for unprovisioned in matches[match_number:] for user in unprovisioned.team1 + unprovisioned.team2])
+                metrics.count('OutOfTime')
+                out_of_time = True
+                break
+            
+            players = match.team1 + match.team2
+            claim_token = uuid.uuid4().hex
+            with metrics.phase('Claim'):
+                unavailable = wssRepo.claim_users(players, claim_token)
+            if unavailable: # Claimed by another matcher or left the queue
+                metrics.count('ClaimConflicts')
+                released.extend(user for user in players if user not in unavailable)
+                continue
+            
+            with metrics.phase('Alert'):
+                alerted = try_alert_users(match, notifier, "MATCH FOUND", wssRepo)
+            if not alerted:
+                metrics.count('FailedAlerts')
+                with metrics.phase('Release'):
+                    wssRepo.release_claims(players, claim_token)
+                _reevaluation_engine.forget(region, [user.connection_id for user in players])
+                try_alert_users(match, notifier, "ERROR: Error in match creation", wssRepo)
+                continue
+            
+            try:
+                with metrics.phase('Commit'):
+                    wssRepo.commit_match(players, 'ip_to_be_determined', claim_token)
+            except MatchCommitFailed: # A player left the queue after being claimed
+                metrics.count('CommitFailures')
+                with metrics.phase('Release'):
+                    wssRepo.release_claims(players, claim_token)
+                _reevaluation_engine.forget(region, [user.connection_id for user in players])
+                try_alert_users(match, notifier, "ERROR: Error in match creation", wssRepo)
+                continue
+            
+            if queue_state is not None: # Don't wait for the stream to drop the matched players
+                for user in players:
+                    queue_state.remove(user.connection_id)
+            
+            with metrics.phase('Provision'):
+                used_pool_server = create_match(match, pool)
+            if used_pool_server:
+                pool_servers_used += 1
+            matches_created += 1
+        
+        if out_of_time or not released:
+            break
+        metrics.count('ReleasedPlayers', len(released))
+        if isinstance(queue, QueueColumns):
+            for user in released:
+                queue.append_user(user)
+            queue.retain(sorted(range(len(queue)), key=queue.joined_at.__getitem__))
+        else:
+            queue = sorted(queue + released, key=lambda user: user.joined_at)
+        if anchors is not None:
+            anchors.update(user.connection_id for user in released)
+    
+    if released: # Not matched again in this run
+        _reevaluation_engine.forget(region, [user.connection_id for user in released])
+    
+    metrics.count('MatchesCreated', matches_created)
+    metrics.count('PoolServersUsed', pool_servers_used)
+    if pool_servers_used and refill_server_pool_function:
+        request_server_pool_refill(region)
+    return matches_created, queued
 
 def lambda_handler(event, context):
     endpoint_url="https://"+f"{event['requestContext']['domainName']}"
-    apigw_client = boto3.client('apigatewaymanagementapi', endpoint_url=endpoint_url)
+    apigw_client = get_client('apigatewaymanagementapi', endpoint_url=endpoint_url)
+    notifier = WebSocketNotifier(apigw_client)
+    
+    deadline = time.monotonic() + region_time_budget
+    if context is not None:
+        deadline = min(deadline, time.monotonic() + context.get_remaining_time_in_millis() / 1000 - LAMBDA_TIMEOUT_MARGIN)
     
+    metrics = TickMetrics({'Function': 'tryCreateMatch'}, tick_metrics_enabled, metrics_namespace) # Regions emit their own line
     try:
-        wssRepo = WebSocketRepository(connection_table_name, connection_table_pk, data_table_name, data_table_pk)
-        queue = wssRepo.get_queue_users()
-        for region in queue.keys():
-            matches = find_matches_from_queue(queue[region])
-            for match in matches:
-                
-                if not try_alert_users(match, apigw_client, "MATCH FOUND"):
-                    try_alert_users(match, apigw_client, "ERROR: Error in match creation")
-                    continue
-                
-                create_match(match)
-                for user in match.team1 + match.team2:
-                    wssRepo.set_user_in_match(user.user_id, 'ip_to_be_determined')
-                
-                for user in match.team1 + match.team2:
-                    wssRepo.leave_queue(user.connection_id)
-            return {
-                'statusCode': 200,
-            }
+        with metrics.phase('Tick'):
+            return _match_regions(notifier, deadline, metrics)
+    finally:
+        metrics.emit()
+
+def _match_regions(notifier: WebSocketNotifier, deadline: float, metrics: TickMetrics):
+    try:
+        wssRepo, _ = new_repositories()
+        queue_state: Optional[QueueState] = None
+        with metrics.phase('ReadQueue'): # Only the whole queue reads, regions read from the queue index time their own
+            if queue_source == 'stream':
+                queue_state = get_stream_queue_state(wssRepo)
+                region_queues:dict[str,Optional[list[User]]] = {region: queue_state.region_queue(region) for region in set(matchmaking_regions + queue_state.regions())}
+            elif connection_table_queue_index and matchmaking_regions:
+                region_queues = {region: None for region in matchmaking_regions} # Each region reads its own queue
+            else:
+                region_queues = wssRepo.get_queue_users()
     except ClientError as e:
+        print(f'Error reading the queue: {e}')
+        metrics.count('ReadErrors')
         return {
             'statusCode': 500,
-            'body': f"Error: AWS CLIENT ERROR"
+            'body': json.dumps({'error': "AWS CLIENT ERROR"}) # Parsed by the scheduler
         }
+    metrics.count('Regions', len(region_queues))
+    
+    matches_created:dict[str,int] = {}
+    queued:dict[str,int] = {}
+    failed_regions:list[str] = []
+    with ThreadPoolExecutor(max_workers=max(1, min(len(region_queues), region_workers))) as executor:
+        futures = {
+            region: executor.submit(match_region_in_thread, region, notifier, deadline, region_queue, queue_state)
+            for region, region_queue in region_queues.items()
+        }
+        for region, future in futures.items():
+            try:
+                matches_created[region], queued[region] = future.result()
+            except Exception as e: # Any error of a region, so the results of the other regions are still returned
+                print(f'Error matching region {region}: {type(e).__name__}: {e}')
+                traceback.print_exc()
+                failed_regions.append(region)
+    metrics.count('FailedRegions', len(failed_regions))
+    
+    return {
+        'statusCode': 500 if failed_regions else 200,
+        'body': json.dumps({
+            'matches': matches_created,
+            'queued': queued, # Read by the scheduler to pace the next run
+            'waiting': {region: queued[region] - matches_created[region] * MATCH_SIZE for region in queued},
+            'match_size': MATCH_SIZE,
+            'failed_regions': failed_regions
+        })
+    }
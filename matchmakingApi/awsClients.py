@@ -0,0 +1,58 @@
+import boto3
+import threading
+from botocore.config import Config
+from typing import Optional
+
+MAX_POOL_CONNECTIONS = 50 # Connections kept open per client, botocore's default is 10
+CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    retries={'mode': 'standard'}
+)
+
+# Module level, so warm lambda invocations reuse the same session, clients and their open connections
+_lock = threading.Lock()
+_session: Optional[boto3.session.Session] = None
+_thread_local = threading.local() # Resources of each thread
+_clients:dict[tuple,object] = {}
+
+def get_session():
+    """
+    Returns the shared boto3 session, created on first use
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+        return _session
+
+def get_resource(service_name: str, region_name: Optional[str] = None):
+    """
+    Returns the calling thread's resource of a service, created on first use in the thread.
+    boto3 resources are not thread safe, so every thread gets its own and code running in worker threads
+    builds its repositories in the thread. The handler's thread keeps its resources between warm invocations.
+    """
+    resources:dict[tuple,object] = _thread_local.__dict__.setdefault('resources', {})
+    key = (service_name, region_name)
+    resource = resources.get(key)
+    if resource is None:
+        session = get_session()
+        with _lock: # Creating resources from the same session is not thread safe
+            resource = session.resource(service_name, region_name=region_name, config=CLIENT_CONFIG)
+        resources[key] = resource
+    return resource
+
+def get_client(service_name: str, region_name: Optional[str] = None, endpoint_url: Optional[str] = None):
+    """
+    Returns the shared client of a service, created on first use. Clients are thread safe.
+    """
+    key = (service_name, region_name, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        session = get_session()
+        with _lock: # Creating clients from the same session is not thread safe
+            client = _clients.get(key)
+            if client is None:
+                client = session.client(service_name, region_name=region_name, endpoint_url=endpoint_url, config=CLIENT_CONFIG)
+                _clients[key] = client
+    return client
@@ -0,0 +1,295 @@
+import json
+import re
+import time
+import urllib.request
+from typing import Optional
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+from awsClients import get_client, get_resource
+
+SERVER_STARTING = "STARTING" # Task was started and the server didn't announce itself yet
+SERVER_IDLE = "IDLE" # Server is booted and waiting for a match
+SERVER_ASSIGNED = "ASSIGNED" # Server is running a match
+
+STARTING_SERVER_TTL = 10 * 60 # Seconds a task has to boot before it stops counting towards the pool
+IDLE_SERVER_TTL = 24 * 60 * 60
+ASSIGNED_SERVER_TTL = 6 * 60 * 60
+ASSIGN_TIMEOUT = 3 # Seconds to wait for an idle server to accept a match
+MAX_TASKS_PER_RUN = 10 # ECS RunTask limit
+ECS_CLUSTER = 'MATCHMAKING-CLUSTER'
+SERVER_TASK_DEFINITION = 'matchmaking-server'
+
+TASK_ARN_PATTERN = re.compile(r'^arn:aws[a-z-]*:ecs:([a-z0-9-]+):\d{12}:task/([A-Za-z0-9_-]+)/([a-f0-9]{32})$')
+
+class GameServer:
+    def __init__(self, server_id: str, region: str, ip: str = "", assign_token: str = "", status: str = SERVER_STARTING, idle_since: int = 0):
+        self.server_id = server_id # ECS task arn
+        self.region = region
+        self.ip = ip
+        self.assign_token = assign_token # Secret generated by the server, required to assign it a match
+        self.status = status
+        self.idle_since = idle_since
+
+class GameServerPoolRepository:
+    """
+    Pool of pre-started game servers, partitioned by region.
+    Items expire through the table's TTL so crashed servers eventually leave the pool.
+    """
+    def __init__(
+            self,
+            table_name: str,
+            region_attr: str = "Matchmaking_Region",
+            server_id_attr: str = "ServerId",
+            status_attr: str = "ServerStatus",
+            ip_attr: str = "ServerIp",
+            assign_token_attr: str = "AssignToken",
+            idle_since_attr: str = "IdleSince",
+            expires_at_attr: str = "ExpiresAt"
+        ):
+        self.region_attr = region_attr
+        self.server_id_attr = server_id_attr
+        self.status_attr = status_attr
+        self.ip_attr = ip_attr
+        self.assign_token_attr = assign_token_attr
+        self.idle_since_attr = idle_since_attr
+        self.expires_at_attr = expires_at_attr
+
+        self.table = get_resource('dynamodb').Table(table_name)
+
+    def add_starting_server(self, region: str, server_id: str):
+        self.table.put_item(Item={
+            self.region_attr: region,
+            self.server_id_attr: server_id,
+            self.status_attr: SERVER_STARTING,
+            self.expires_at_attr: int(time.time()) + STARTING_SERVER_TTL
+        })
+
+    def set_server_idle(self, region: str, server_id: str, ip: str, assign_token: str):
+        now = int(time.time())
+        self.table.put_item(Item={
+            self.region_attr: region,
+            self.server_id_attr: server_id,
+            self.status_attr: SERVER_IDLE,
+            self.ip_attr: ip,
+            self.assign_token_attr: assign_token,
+            self.idle_since_attr: now,
+            self.expires_at_attr: now + IDLE_SERVER_TTL
+        })
+
+    def remove_server(self, region: str, server_id: str):
+        self.table.delete_item(Key={
+            self.region_attr: region,
+            self.server_id_attr: server_id
+        })
+
+    def _get_region_servers(self, region: str, statuses: list[str]):
+        query_kwargs = {
+            'KeyConditionExpression': Key(self.region_attr).eq(region),
+            'FilterExpression': Attr(self.status_attr).is_in(statuses) & Attr(self.expires_at_attr).gt(int(time.time()))
+        }
+        response = self.table.query(**query_kwargs)
+        items = response['Items']
+        while 'LastEvaluatedKey' in response:
+            response = self.table.query(ExclusiveStartKey=response['LastEvaluatedKey'], **query_kwargs)
+            items.extend(response['Items'])
+
+        return [GameServer(
+            server_id=item[self.server_id_attr], # type: ignore
+            region=item[self.region_attr], # type: ignore
+            ip=item.get(self.ip_attr, ""), # type: ignore
+            assign_token=item.get(self.assign_token_attr, ""), # type: ignore
+            status=item[self.status_attr], # type: ignore
+            idle_since=int(item.get(self.idle_since_attr, 0)) # type: ignore
+        ) for item in items]
+
+    def count_available_servers(self, region: str):
+        """
+        Number of servers that are idle or still booting in the region
+        """
+        return len(self._get_region_servers(region, [SERVER_STARTING, SERVER_IDLE]))
+
+    def claim_idle_server(self, region: str):
+        """
+        Marks the longest idle server of the region as assigned and returns it, None when there is no idle server.
+        The claim is a conditional write, so concurrent matchers never get the same server.
+        """
+        idle_servers = self._get_region_servers(region, [SERVER_IDLE])
+        idle_servers.sort(key=lambda server: server.idle_since)
+        for server in idle_servers:
+            try:
+                self.table.update_item(
+                    Key={
+                        self.region_attr: region,
+                        self.server_id_attr: server.server_id
+                    },
+                    UpdateExpression=f"SET {self.status_attr} = :assigned, {self.expires_at_attr} = :expires_at",
+                    ConditionExpression=Attr(self.status_attr).eq(SERVER_IDLE),
+                    ExpressionAttributeValues={
+                        ':assigned': SERVER_ASSIGNED,
+                        ':expires_at': int(time.time()) + ASSIGNED_SERVER_TTL
+                    }
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ConditionalCheckFailedException': # Claimed by someone else
+                    continue
+                raise
+            server.status = SERVER_ASSIGNED
+            return server
+        return None
+
+def assign_server(server: GameServer, user_ids: list[str], connection_ids: list[str]):
+    """
+    Sends the match players to an idle server, which then announces itself through serverReady.
+    Returns False if the server could not be reached.
+    """
+    request = urllib.request.Request(
+        f"http://{server.ip}/assign",
+        data=json.dumps({
+            "assign_token": server.assign_token,
+            "user_ids": user_ids,
+            "connection_ids": connection_ids
+        }).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=ASSIGN_TIMEOUT) as response:
+            return response.status == 200
+    except Exception as e:
+        print(f"Error assigning server {server.server_id}: {e}")
+        return False
+
+def get_subnet_id_by_name(subnet_name:str, region_name:str):
+    ec2_client = get_client('ec2', region_name=region_name)
+    response = ec2_client.describe_subnets(
+        Filters=[
+            {
+                'Name': 'tag:Name',
+                'Values': [subnet_name]
+            }
+        ]
+    )
+
+    subnets = response['Subnets']
+    if not subnets:
+        raise ValueError(f"No subnet found with name '{subnet_name}'")
+    return subnets[0]['SubnetId'] # type: ignore
+
+def get_security_group_id_by_name(security_group_name, region_name):
+    ec2 = get_client('ec2', region_name=region_name)
+
+    filters = [
+        {
+            'Name': 'tag:Name',
+            'Values': [security_group_name]
+        }
+    ]
+
+    response = ec2.describe_security_groups(Filters=filters) # type: ignore
+
+    if len(response['SecurityGroups']) == 0:
+        raise Exception(f"Security group with name '{security_group_name}' not found in region '{region_name}'")
+    elif len(response['SecurityGroups']) > 1:
+        raise Exception(f"Multiple security groups with name '{security_group_name}' found in region '{region_name}'")
+
+    return response['SecurityGroups'][0]['GroupId'] # type: ignore
+
+def parse_task_arn(task_arn: str):
+    """
+    Region of a game server task arn, None if it is not the arn of a task of the matchmaking cluster
+    """
+    match = TASK_ARN_PATTERN.match(task_arn)
+    if not match or match.group(2) != ECS_CLUSTER:
+        return None
+    return match.group(1)
+
+def get_server_task_ip(task_arn: str, region_name: str) -> Optional[str]:
+    """
+    Public ip of a running game server task, read from ECS and its network interface.
+    None when the task is not a running game server, so callers don't have to trust the address a request came from.
+    """
+    response = get_client('ecs', region_name=region_name).describe_tasks(cluster=ECS_CLUSTER, tasks=[task_arn])
+    tasks = response.get('tasks', [])
+    if not tasks:
+        return None
+    task = tasks[0]
+    if task.get('lastStatus') != 'RUNNING' or f":task-definition/{SERVER_TASK_DEFINITION}:" not in task.get('taskDefinitionArn', ''):
+        return None
+
+    network_interface_id = None
+    for attachment in task.get('attachments', []):
+        if attachment.get('type') == 'ElasticNetworkInterface':
+            details = {detail['name']: detail['value'] for detail in attachment.get('details', [])}
+            network_interface_id = details.get('networkInterfaceId')
+    if not network_interface_id:
+        return None
+
+    network_interfaces = get_client('ec2', region_name=region_name).describe_network_interfaces(
+        NetworkInterfaceIds=[network_interface_id]
+    )['NetworkInterfaces']
+    if not network_interfaces:
+        return None
+    return network_interfaces[0].get('Association', {}).get('PublicIp') # Tasks are started with assignPublicIp
+
+def run_ecs_task(user_ids: list[str], connection_ids: list[str], region_name: str, count: int = 1):
+    """
+    Starts game server tasks. Without user ids the servers start idle and join the server pool.
+    """
+    ecs_client = get_client('ecs', region_name=region_name)
+
+    user_ids_str = ','.join(str(uid) for uid in user_ids)
+    connection_ids_str = ','.join(str(cid) for cid in connection_ids)
+
+    response = ecs_client.run_task(
+        cluster=ECS_CLUSTER,
+        taskDefinition=SERVER_TASK_DEFINITION,
+        overrides={
+            'containerOverrides': [
+                {
+                    'name': 'GameServerContainer',
+                    'environment': [
+                        {
+                            'name': 'USER_IDS',
+                            'value': user_ids_str
+                        },
+                        {
+                            'name': 'CONNECTION_IDS',
+                            'value': connection_ids_str
+                        }
+                    ]
+                }
+            ]
+        },
+        launchType='FARGATE',
+        networkConfiguration={
+            'awsvpcConfiguration': {
+                'subnets': [
+                    get_subnet_id_by_name('MatchmakingSubnetA',region_name=region_name),
+                ],
+                'securityGroups': [
+                    get_security_group_id_by_name(f'MATCHMAKING-CLUSTER-{region_name}-SecurityGroup', region_name=region_name),
+                ],
+                'assignPublicIp': 'ENABLED'
+            }
+        },
+        count=count,
+    )
+    return response
+
+def refill_server_pool(pool: GameServerPoolRepository, region: str, target_size: int):
+    """
+    Starts idle servers until the region has target_size servers idle or booting, returns the number of tasks started
+    """
+    missing = target_size - pool.count_available_servers(region)
+    started = 0
+    while missing > 0:
+        response = run_ecs_task([], [], region, count=min(missing, MAX_TASKS_PER_RUN))
+        tasks = response.get('tasks', [])
+        if not tasks: # Capacity or quota errors come back as failures, try again on the next refill
+            print(f"Could not start servers in {region}: {response.get('failures', [])}")
+            break
+        for task in tasks:
+            pool.add_starting_server(region, task['taskArn'])
+        started += len(tasks)
+        missing -= len(tasks)
+    return started
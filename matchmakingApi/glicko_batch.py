@@ -0,0 +1,92 @@
+"""
+Batch version of glicko_team.Player, updating many players at once with numpy.
+Every step follows Player.update_player, including the order in which volatility and deviation are updated,
+so results match the scalar implementation to floating point precision.
+"""
+
+import numpy as np
+from glicko_team import Player
+
+GLICKO2_SCALE = 173.7178
+VOLATILITY_EPSILON = 0.000001
+
+def _g(RD):
+    return 1 / np.sqrt(1 + 3 * RD ** 2 / np.pi ** 2)
+
+def _E(rating, p2rating, p2RD):
+    return 1 / (1 + np.exp(-1 * _g(p2RD) * (rating - p2rating)))
+
+def _f(x, rating, delta, v, a, tau):
+    # Same terms as Player._f
+    ex = np.exp(x)
+    num1 = ex * (delta ** 2 - rating ** 2 - v - ex)
+    denom1 = 2 * ((rating ** 2 + v + ex) ** 2)
+    return (num1 / denom1) - ((x - a) / (tau ** 2))
+
+def _new_vol(rating, rd, vol, delta, v, tau):
+    """
+    Illinois iteration of Player._newVol run on every player at once, players stop iterating as they converge
+    """
+    a = np.log(vol ** 2)
+    A = a.copy()
+
+    B = np.empty_like(a)
+    large_delta = delta ** 2 > rd ** 2 + v
+    B[large_delta] = np.log(delta[large_delta] ** 2 - rd[large_delta] ** 2 - v[large_delta])
+    searching = np.nonzero(~large_delta)[0]
+    k = np.ones(len(a))
+    while len(searching):
+        below = _f(a[searching] - k[searching] * tau, rating[searching], delta[searching], v[searching], a[searching], tau) < 0
+        k[searching[below]] += 1
+        searching = searching[below]
+    B[~large_delta] = a[~large_delta] - k[~large_delta] * tau
+
+    fA = _f(A, rating, delta, v, a, tau)
+    fB = _f(B, rating, delta, v, a, tau)
+
+    active = np.nonzero(np.abs(B - A) > VOLATILITY_EPSILON)[0]
+    while len(active):
+        C = A[active] + ((A[active] - B[active]) * fA[active]) / (fB[active] - fA[active])
+        fC = _f(C, rating[active], delta[active], v[active], a[active], tau)
+        crossed = fC * fB[active] < 0
+        A[active] = np.where(crossed, B[active], A[active])
+        fA[active] = np.where(crossed, fB[active], fA[active] / 2.0)
+        B[active] = C
+        fB[active] = fC
+        active = active[np.abs(B[active] - A[active]) > VOLATILITY_EPSILON]
+
+    return np.exp(A / 2)
+
+def update_players(rating, rd, vol, opponent_rating, opponent_rd, outcome, tau: float = Player._tau):
+    """
+    Rates a batch of players, returns their new (rating, rd, vol) arrays.
+    rating, rd and vol have one value per player. Opponent ratings, deviations and outcomes either have
+    one value per player, or one row per player with a column per game of the rating period.
+    """
+    rating = (np.asarray(rating, dtype=np.float64) - 1500) / GLICKO2_SCALE
+    rd = np.asarray(rd, dtype=np.float64) / GLICKO2_SCALE
+    vol = np.asarray(vol, dtype=np.float64)
+    opponent_rating = (np.asarray(opponent_rating, dtype=np.float64) - 1500) / GLICKO2_SCALE
+    opponent_rd = np.asarray(opponent_rd, dtype=np.float64) / GLICKO2_SCALE
+    outcome = np.asarray(outcome, dtype=np.float64)
+    if opponent_rating.ndim == 1:
+        opponent_rating, opponent_rd, outcome = opponent_rating[:, None], opponent_rd[:, None], outcome[:, None]
+
+    g = _g(opponent_rd)
+    E = _E(rating[:, None], opponent_rating, opponent_rd)
+    v = 1 / np.sum(g ** 2 * E * (1 - E), axis=1)
+    improvement = np.sum(g * (outcome - E), axis=1)
+    delta = v * improvement
+
+    new_vol = _new_vol(rating, rd, vol, delta, v, tau)
+    new_rd = np.sqrt(rd ** 2 + new_vol ** 2)
+    new_rd = 1 / np.sqrt((1 / new_rd ** 2) + (1 / v))
+    new_rating = rating + new_rd ** 2 * improvement
+    return new_rating * GLICKO2_SCALE + 1500, new_rd * GLICKO2_SCALE, new_vol
+
+def did_not_compete(rd, vol):
+    """
+    Batch version of Player.did_not_compete, returns the new rd array
+    """
+    rd = np.asarray(rd, dtype=np.float64) / GLICKO2_SCALE
+    return np.sqrt(rd ** 2 + np.asarray(vol, dtype=np.float64) ** 2) * GLICKO2_SCALE
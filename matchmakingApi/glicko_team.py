@@ -224,23 +224,27 @@ class TeamRatingCalculator:
 
         self.rating_delta_team1 = avg_rating_team2 - avg_rating_team1
         self.rating_delta_team2 = -(self.rating_delta_team1)
+        self.team1_players = {player[self.glicko_player_index] for player in self.team1}
+        self.team2_players = {player[self.glicko_player_index] for player in self.team2}
         
         
-    def update_rating(self, player:Player):
-        
-        if player in [player[self.glicko_player_index] for player in self.team1]:
+    def opponent_game(self, player:Player):
+        """
+        Returns the game played by the player as (opponent rating, opponent rd, outcome), the opposing team seen as a single opponent
+        """
+        if player in self.team1_players:
             opponent_assumed_rating = player.rating + self.rating_delta_team1
-            rd = self.rd_team_2
-            
-            player.update_player([opponent_assumed_rating],[rd],[self.team1Win])
-            
-        elif player in [player[self.glicko_player_index] for player in self.team2]:
+            return opponent_assumed_rating, self.rd_team_2, self.team1Win
+        
+        elif player in self.team2_players:
             opponent_assumed_rating = player.rating + self.rating_delta_team2
-            rd = self.rd_team_1
-            
-            player.update_player([opponent_assumed_rating],[rd],[abs(1 - self.team1Win)])
+            return opponent_assumed_rating, self.rd_team_1, abs(1 - self.team1Win)
+        
+        raise ValueError("Player not in either team")
+        
+    def update_rating(self, player:Player):
         
-        else:
-            raise ValueError("Player not in either team")
+        opponent_assumed_rating, rd, outcome = self.opponent_game(player)
+        player.update_player([opponent_assumed_rating],[rd],[outcome])
         
         return player
\ No newline at end of file
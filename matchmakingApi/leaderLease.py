@@ -0,0 +1,74 @@
+import time
+from typing import Optional
+from botocore.exceptions import ClientError
+from awsClients import get_resource
+
+LEADER_CONTROL_KEY = "matchmaker-leader" # Control table item holding the lease
+
+class LeaderLeaseRepository:
+    """
+    Lease on the matchmaker leadership, stored as a single item written with conditional updates.
+    The holder renews it before it expires, any other instance can take it once it has expired.
+    Expiry times are wall clock milliseconds, so instances clocks must agree to well under the lease duration.
+    """
+    def __init__(
+            self,
+            table_name: str,
+            lease_key: str = LEADER_CONTROL_KEY,
+            table_pk: str = "ControlKey",
+            owner_attr: str = "OwnerId",
+            expires_at_attr: str = "LeaseExpiresAt",
+            term_attr: str = "LeaseTerm"
+        ):
+        self.lease_key = lease_key
+        self.table_pk = table_pk
+        self.owner_attr = owner_attr
+        self.expires_at_attr = expires_at_attr
+        self.term_attr = term_attr
+
+        self.table = get_resource('dynamodb').Table(table_name)
+
+    def _conditional_update(self, **kwargs):
+        try:
+            return self.table.update_item(Key={self.table_pk: self.lease_key}, ReturnValues='ALL_NEW', **kwargs)['Attributes']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+
+    def try_acquire(self, owner_id: str, duration: float) -> Optional[int]:
+        """
+        Renews the lease if owner_id holds it, otherwise takes it if it is free or expired.
+        Returns the lease term, which grows every time the lease changes hands, or None if another instance holds it.
+        """
+        now = int(time.time() * 1000)
+        expires_at = now + int(duration * 1000)
+        renewed = self._conditional_update(
+            UpdateExpression="SET #expires_at = :expires_at",
+            ConditionExpression="#owner = :owner",
+            ExpressionAttributeNames={'#owner': self.owner_attr, '#expires_at': self.expires_at_attr},
+            ExpressionAttributeValues={':owner': owner_id, ':expires_at': expires_at}
+        )
+        if renewed is not None:
+            return int(renewed.get(self.term_attr, 0))
+
+        acquired = self._conditional_update(
+            UpdateExpression="SET #owner = :owner, #expires_at = :expires_at ADD #term :one",
+            ConditionExpression="attribute_not_exists(#owner) OR #expires_at < :now",
+            ExpressionAttributeNames={'#owner': self.owner_attr, '#expires_at': self.expires_at_attr, '#term': self.term_attr},
+            ExpressionAttributeValues={':owner': owner_id, ':expires_at': expires_at, ':now': now, ':one': 1}
+        )
+        if acquired is not None:
+            return int(acquired[self.term_attr])
+        return None
+
+    def release(self, owner_id: str):
+        """
+        Frees the lease if owner_id holds it, so a standby takes over without waiting for it to expire
+        """
+        self._conditional_update(
+            UpdateExpression="REMOVE #owner, #expires_at",
+            ConditionExpression="#owner = :owner",
+            ExpressionAttributeNames={'#owner': self.owner_attr, '#expires_at': self.expires_at_attr},
+            ExpressionAttributeValues={':owner': owner_id}
+        )
@@ -0,0 +1,86 @@
+import time
+from typing import Optional
+from awsClients import get_resource
+
+SCHEDULER_CONTROL_KEY = "scheduler" # Control table item holding the pending trigger
+
+class TickIntervalPolicy:
+    """
+    Picks the wait before the next matchmaking tick from the queue depth and the arrival rate of every region.
+    Busy queues are matched often, idle ones rarely, and no player waits more than max_interval between two ticks.
+    """
+    def __init__(self, min_interval: float, max_interval: float, smoothing: float = 0.3):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing # Weight of the latest tick in the arrival rate
+        self.arrival_rates:dict[str,float] = {} # Region -> players joining per second
+        self._waiting:dict[str,int] = {} # Region -> players left in queue after the last tick
+        self._match_size = 0
+        self._last_tick_at: Optional[float] = None
+
+    def observe(self, tick_at: float, queued: dict[str,int], waiting: dict[str,int], match_size: int):
+        """
+        Records a tick, queued are the players read from each region's queue and waiting the players left unmatched
+        """
+        if self._last_tick_at is not None and tick_at > self._last_tick_at:
+            elapsed = tick_at - self._last_tick_at
+            for region in set(queued) | set(self.arrival_rates):
+                arrivals = max(0, queued.get(region, 0) - self._waiting.get(region, 0)) # Leaves hide some arrivals, close enough
+                rate = self.arrival_rates.get(region, 0.0)
+                self.arrival_rates[region] = rate + self.smoothing * (arrivals / elapsed - rate)
+        self._last_tick_at = tick_at
+        self._waiting = dict(waiting)
+        self._match_size = match_size
+
+    def next_interval(self):
+        """
+        Seconds until enough players should have joined some region to form a new match
+        """
+        interval = self.max_interval
+        for region, rate in self.arrival_rates.items():
+            if rate <= 0:
+                continue
+            players_needed = max(1, self._match_size - self._waiting.get(region, 0)) # Any arrival can complete a match with players that are waiting
+            interval = min(interval, players_needed / rate)
+        return max(self.min_interval, interval)
+
+class SchedulerTriggerRepository:
+    """
+    Pending matchmaking request shared by the clients and the scheduler.
+    Requests only set the trigger when it is not set yet, so a burst of requests collapses into a single pending run.
+    """
+    def __init__(self, table_name: str, table_pk: str = "ControlKey", triggered_at_attr: str = "TriggeredAt"):
+        self.table_pk = table_pk
+        self.triggered_at_attr = triggered_at_attr
+
+        self.table = get_resource('dynamodb').Table(table_name)
+
+    def request_run(self):
+        """
+        Sets the pending trigger, returns False if a run was already pending
+        """
+        response = self.table.update_item(
+            Key={self.table_pk: SCHEDULER_CONTROL_KEY},
+            UpdateExpression=f"SET {self.triggered_at_attr} = if_not_exists({self.triggered_at_attr}, :now)",
+            ExpressionAttributeValues={':now': int(time.time())},
+            ReturnValues='UPDATED_OLD'
+        )
+        return self.triggered_at_attr not in response.get('Attributes', {})
+
+    def is_run_requested(self):
+        response = self.table.get_item(
+            Key={self.table_pk: SCHEDULER_CONTROL_KEY},
+            ProjectionExpression=self.triggered_at_attr
+        )
+        return self.triggered_at_attr in response.get('Item', {})
+
+    def take_run_request(self):
+        """
+        Clears the pending trigger, returns True if it was set. Requests made after this call trigger another run.
+        """
+        response = self.table.update_item(
+            Key={self.table_pk: SCHEDULER_CONTROL_KEY},
+            UpdateExpression=f"REMOVE {self.triggered_at_attr}",
+            ReturnValues='UPDATED_OLD'
+        )
+        return self.triggered_at_attr in response.get('Attributes', {})
@@ -1,14 +1,20 @@
-import boto3
+from awsClients import get_resource, get_client, MAX_POOL_CONNECTIONS
+from botocore.exceptions import ClientError
 from decimal import Decimal
 from glicko_team import Player
 import time
-from boto3.dynamodb.conditions import Key
+from typing import Optional
+from boto3.dynamodb.conditions import Key, Attr
+from concurrent.futures import ThreadPoolExecutor
 
 INITIAL_RATING = 1500
 INITIAL_RD = 350
 VOLATILITY = Decimal('0.06')
 TEAM_SIZE = 1
 MATCH_SIZE = TEAM_SIZE * 2
+MAX_SCAN_WORKERS = MAX_POOL_CONNECTIONS # More threads would wait for a connection
+CLAIM_TTL = 30 # Seconds after which a claim left by a crashed matcher can be taken by another one
+MAX_BATCH_GET_KEYS = 100 # DynamoDB BatchGetItem limit
 
 class UserRegionNotFound(Exception):
     """
@@ -38,8 +44,22 @@ class UserAlreadyInMatch(Exception):
     def __init__(self, message="User is already in a match"):
         self.message = message
 
+class MatchCommitFailed(Exception):
+    """
+        Exception when a match can't be committed because a player is no longer in queue
+    """
+    def __init__(self, message="A player in the match is no longer in queue"):
+        self.message = message
+
+class RatingCommitFailed(Exception):
+    """
+        Exception when new ratings can't be committed because a player's rating changed since it was read
+    """
+    def __init__(self, message="A player's rating was updated concurrently"):
+        self.message = message
+
 class User:
-    def __init__(self, user_id, rating:int, rd:int, vol:Decimal, region:str, joined_at:int = 0, connection_id:str = ""):
+    def __init__(self, user_id, rating:int, rd:int, vol:Decimal, region:str, joined_at:int = 0, connection_id:str = "", rating_version:int = 0, rated_period:Optional[int] = None):
         self.user_id = str(user_id)
         self.rating = rating
         self.rd = rd
@@ -50,6 +70,8 @@ class User:
         self.joined_at = joined_at
         self.region = region
         self.connection_id = connection_id
+        self.rating_version = rating_version # Times the rating was written, guards concurrent updates
+        self.rated_period = rated_period # Last closed rating period applied to the player, None if never
     
     def MaxMatchupRating(self):
         return int(self.rating + self.max_matchup_delta)
@@ -82,9 +104,17 @@ class _MatchmakingConnectionRepository:
             rd_attr: str = "RD", 
             vol_attr: str = "Vol", 
             joined_at_attr: str = "JoinedAt", 
-            region_attr: str = "Matchmaking_Region"
+            region_attr: str = "Matchmaking_Region",
+            in_match_attr: str = "PlayerInMatch",
+            claim_token_attr: str = "ClaimToken",
+            claimed_at_attr: str = "ClaimedAt",
+            queue_index_name: str = "",
+            scan_segments: int = 1
         ):
         self.table_pk = table_pk # connectionId
+        self.queue_index_name = queue_index_name # Sparse GSI, region as partition key and joined at as sort key
+        self.scan_segments = scan_segments # Parallel scan segments used when there is no queue index
+        self.last_scan_segment_times:dict[int,float] = {} # Seconds taken by each segment of the last parallel scan
         
         self.user_id_attr = user_id_attr
         self.rating_attr = rating_attr
@@ -92,65 +122,323 @@ class _MatchmakingConnectionRepository:
         self.vol_attr = vol_attr
         self.joined_at_attr = joined_at_attr
         self.region_attr = region_attr
+        self.in_match_attr = in_match_attr
+        self.claim_token_attr = claim_token_attr # Set by the matcher that is forming a match with the connection
+        self.claimed_at_attr = claimed_at_attr
         
-        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.table = get_resource('dynamodb').Table(table_name)
     
-    def join_queue(self, connectionId: str, rating: int, rd: int, vol: Decimal, region: str):
-        self.table.update_item(
-            Key={
-                self.table_pk: connectionId
-            },
-            UpdateExpression=f"SET {self.rating_attr} = :rating, {self.rd_attr} = :rd, {self.vol_attr} = :vol, {self.region_attr} = :region, {self.joined_at_attr} = :joined_at",
-            ExpressionAttributeValues={
-                ':rating': rating,
-                ':rd': rd,
-                ':vol': vol,
-                ':region': region,
-                ':joined_at': int(time.time())
-            }
-        )
-        return
+    def profile_attributes(self, rating: int, rd: int, vol: Decimal, region: Optional[str], in_match: bool):
+        """
+        Copy of the player's data kept on their connection, so joining the queue doesn't read the data table
+        """
+        attributes = {
+            self.rating_attr: rating,
+            self.rd_attr: rd,
+            self.vol_attr: vol,
+            self.in_match_attr: in_match
+        }
+        if region:
+            attributes[self.region_attr] = region
+        return attributes
+    
+    def update_profile(self, connectionId: str, user_id: str, attributes: dict):
+        """
+        Updates the copy of the player's data on the connection, if the connection still exists.
+        Returns False when it doesn't.
+        """
+        names = {f"#attr{i}": name for i, name in enumerate(attributes)}
+        values = {f":attr{i}": value for i, value in enumerate(attributes.values())}
+        try:
+            self.table.update_item(
+                Key={
+                    self.table_pk: connectionId
+                },
+                UpdateExpression="SET " + ", ".join(f"#attr{i} = :attr{i}" for i in range(len(attributes))),
+                ConditionExpression="#user_id = :user_id",
+                ExpressionAttributeNames={'#user_id': self.user_id_attr, **names},
+                ExpressionAttributeValues={':user_id': user_id, **values}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+    
+    def join_queue(self, connectionId: str, region: Optional[str] = None):
+        """
+        Puts the connection in queue with the player's data copied on it, in a single conditional write.
+        The region is changed first when given. Returns the region the connection had before, None if unchanged.
+        Raises UserNotFound when the connection has no copy of the player's data, UserRegionNotFound when
+        no region is known and UserAlreadyInMatch when the player is in a match.
+        """
+        update_expression = "SET #joined_at = :joined_at"
+        condition = "attribute_exists(#rating) AND (attribute_not_exists(#in_match) OR #in_match = :false)"
+        names = {'#joined_at': self.joined_at_attr, '#rating': self.rating_attr, '#in_match': self.in_match_attr, '#region': self.region_attr}
+        values:dict = {':joined_at': int(time.time()), ':false': False}
+        if region:
+            update_expression += ", #region = :region"
+            values[':region'] = region
+        else:
+            condition += " AND attribute_exists(#region)"
+        
+        try:
+            response = self.table.update_item(
+                Key={
+                    self.table_pk: connectionId
+                },
+                UpdateExpression=update_expression,
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues='UPDATED_OLD'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            item = self.table.get_item(Key={self.table_pk: connectionId}).get('Item') # Only read to tell why it failed
+            if not item or self.rating_attr not in item:
+                raise UserNotFound()
+            if item.get(self.in_match_attr):
+                raise UserAlreadyInMatch()
+            raise UserRegionNotFound()
+        
+        previous_region = response.get('Attributes', {}).get(self.region_attr)
+        if region and previous_region != region:
+            return previous_region or ""
+        return None
 
     def leave_queue(self, connectionId: str):
         self.table.update_item(
             Key={
                 self.table_pk: connectionId
             },
-            UpdateExpression=f"DELETE {self.rating_attr}, {self.rd_attr}, {self.vol_attr}, {self.region_attr}, {self.joined_at_attr}"
+            UpdateExpression=f"REMOVE {self.joined_at_attr}, {self.claim_token_attr}, {self.claimed_at_attr}"
         )
         return
     
-    def get_queue_users(self):
-        response = self.table.scan()
-        
+    def leave_queue_transact_item(self, connectionId: str, claim_token: Optional[str] = None):
+        """
+        Transaction item that takes the connection out of the queue and marks the player in match,
+        conditioned on the connection still being in queue and, when a claim token is given, still being claimed with it
+        """
+        transact_item = {
+            'Update': {
+                'TableName': self.table.name,
+                'Key': {
+                    self.table_pk: connectionId
+                },
+                'UpdateExpression': f"SET {self.in_match_attr} = :in_match REMOVE {self.joined_at_attr}, {self.claim_token_attr}, {self.claimed_at_attr}",
+                'ConditionExpression': "attribute_exists(#joined_at)",
+                'ExpressionAttributeNames': {
+                    '#joined_at': self.joined_at_attr
+                },
+                'ExpressionAttributeValues': {
+                    ':in_match': True
+                }
+            }
+        }
+        if claim_token is not None:
+            transact_item['Update']['ConditionExpression'] += " AND #claim_token = :claim_token"
+            transact_item['Update']['ExpressionAttributeNames']['#claim_token'] = self.claim_token_attr
+            transact_item['Update']['ExpressionAttributeValues'][':claim_token'] = claim_token
+        return transact_item
+    
+    def claim_connection_transact_item(self, connectionId: str, claim_token: str, now: int):
+        """
+        Transaction item that reserves a connection in queue for a match being formed, conditioned on it still
+        being in queue and on no other matcher holding a claim on it that is not older than CLAIM_TTL
+        """
+        return {
+            'Update': {
+                'TableName': self.table.name,
+                'Key': {
+                    self.table_pk: connectionId
+                },
+                'UpdateExpression': "SET #claim_token = :claim_token, #claimed_at = :now",
+                'ConditionExpression': "attribute_exists(#joined_at) AND (attribute_not_exists(#claim_token) OR #claimed_at < :stale)",
+                'ExpressionAttributeNames': {
+                    '#joined_at': self.joined_at_attr,
+                    '#claim_token': self.claim_token_attr,
+                    '#claimed_at': self.claimed_at_attr
+                },
+                'ExpressionAttributeValues': {
+                    ':claim_token': claim_token,
+                    ':now': now,
+                    ':stale': now - CLAIM_TTL
+                }
+            }
+        }
+    
+    def release_claim(self, connectionId: str, claim_token: str):
+        """
+        Removes the claim if it is still the one made with claim_token
+        """
+        try:
+            self.table.update_item(
+                Key={
+                    self.table_pk: connectionId
+                },
+                UpdateExpression="REMOVE #claim_token, #claimed_at",
+                ConditionExpression="#claim_token = :claim_token",
+                ExpressionAttributeNames={
+                    '#claim_token': self.claim_token_attr,
+                    '#claimed_at': self.claimed_at_attr
+                },
+                ExpressionAttributeValues={
+                    ':claim_token': claim_token
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException': # Expired and taken by another matcher
+                raise
+    
+    def _queue_item_to_user(self, item):
+        return User(
+            connection_id = item[self.table_pk], # type: ignore
+            user_id = item[self.user_id_attr], # type: ignore
+            rating = int(item[self.rating_attr]), # type: ignore
+            rd = int(item[self.rd_attr]), # type: ignore
+            vol= Decimal(item[self.vol_attr]), # type: ignore
+            region= item[self.region_attr], # type: ignore
+            joined_at= int(item[self.joined_at_attr]) # type: ignore
+        )
+    
+    def get_queue_users(self, regions: Optional[list[str]] = None):
+        """
+        Returns a dict of users in queue where the key is the region and the value is the list of users in that region, sorted by joined at.
+        When the queue index and the regions are known, each region is read from the sparse queue index, otherwise the whole table is scanned.
+        """
+        if self.queue_index_name and regions:
+            return {region: self.get_region_queue_users(region) for region in regions}
+        return self._scan_queue_users()
+    
+    def get_region_queue_users(self, region: str):
+        """
+        Reads the queue of a region from the sparse queue index, only queued connections are in the index and they come sorted by joined at
+        """
+        query_kwargs = {
+            'IndexName': self.queue_index_name,
+            'KeyConditionExpression': Key(self.region_attr).eq(region),
+            'ScanIndexForward': True
+        }
+        response = self.table.query(**query_kwargs)
         items = response['Items']
         while 'LastEvaluatedKey' in response:
-            response = self.table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+            response = self.table.query(ExclusiveStartKey=response['LastEvaluatedKey'], **query_kwargs)
             items.extend(response['Items'])
         
+        return [self._queue_item_to_user(item) for item in items]
+
+    def read_region_queue_columns(self, region: str, columns):
+        """
+        Reads the queue of a region from the sparse queue index straight into columns (a QueueColumns), in join order.
+        Goes through a low level client and only projects the matched attributes, so no Decimal or User is built per player.
+        """
+        client = get_client('dynamodb')
+        query_kwargs = {
+            'TableName': self.table.name,
+            'IndexName': self.queue_index_name,
+            'KeyConditionExpression': "#region = :region",
+            'ProjectionExpression': "#pk, #user_id, #rating, #rd, #vol, #joined_at",
+            'ExpressionAttributeNames': {
+                '#region': self.region_attr,
+                '#pk': self.table_pk,
+                '#user_id': self.user_id_attr,
+                '#rating': self.rating_attr,
+                '#rd': self.rd_attr,
+                '#vol': self.vol_attr,
+                '#joined_at': self.joined_at_attr
+            },
+            'ExpressionAttributeValues': {':region': {'S': region}},
+            'ScanIndexForward': True
+        }
+        pk, user_id, rating, rd, vol, joined_at = self.table_pk, self.user_id_attr, self.rating_attr, self.rd_attr, self.vol_attr, self.joined_at_attr
+        while True:
+            response = client.query(**query_kwargs)
+            items = response['Items']
+            columns.extend(
+                [item[pk]['S'] for item in items],
+                [item[user_id]['S'] for item in items],
+                [int(item[rating]['N']) for item in items],
+                [int(item[rd]['N']) for item in items],
+                [float(item[vol]['N']) for item in items],
+                [int(item[joined_at]['N']) for item in items]
+            )
+            if 'LastEvaluatedKey' not in response:
+                return columns
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _scan_queue_users(self):
+        if self.scan_segments > 1:
+            items = self._parallel_scan_queue_items()
+        else:
+            items = self._scan_queue_items()
+        
         queue:dict[str,list[User]] = {}
-        try:
-            for item in items:
-                user = (User(
-                    connection_id = item[self.table_pk], # type: ignore
-                    user_id = item[self.user_id_attr], # type: ignore
-                    rating = int(item[self.rating_attr]), # type: ignore
-                    rd = int(item[self.rd_attr]), # type: ignore
-                    vol= Decimal(item[self.vol_attr]), # type: ignore
-                    region= item[self.region_attr], # type: ignore
-                    joined_at= int(item[self.joined_at_attr]) # type: ignore
-                ))
-                if queue.get(user.region,''):
-                    queue[user.region].append(user)
-                else:
-                    queue[user.region] = [user]
-        except KeyError:
-            return queue
+        for item in items:
+            try:
+                user = self._queue_item_to_user(item)
+            except KeyError: # Connection is not in queue
+                continue
+            if queue.get(user.region,''):
+                queue[user.region].append(user)
+            else:
+                queue[user.region] = [user]
         
         for region in queue.keys():
             queue[region].sort(key=lambda user: user.joined_at)
         return queue
     
+    def _scan_queue_items(self):
+        scan_kwargs = {
+            'FilterExpression': Attr(self.joined_at_attr).exists()
+        }
+        response = self.table.scan(**scan_kwargs)
+        
+        items = response['Items']
+        while 'LastEvaluatedKey' in response:
+            response = self.table.scan(ExclusiveStartKey=response['LastEvaluatedKey'], **scan_kwargs)
+            items.extend(response['Items'])
+        return items
+    
+    def _parallel_scan_queue_items(self):
+        """
+        Scans the table with scan_segments parallel segments, at most MAX_SCAN_WORKERS at a time.
+        The time taken by each segment is kept in last_scan_segment_times.
+        """
+        with ThreadPoolExecutor(max_workers=min(self.scan_segments, MAX_SCAN_WORKERS)) as executor:
+            results = list(executor.map(self._scan_queue_segment, range(self.scan_segments)))
+        
+        items = []
+        self.last_scan_segment_times = {}
+        for segment, (segment_items, elapsed) in enumerate(results):
+            items.extend(segment_items)
+            self.last_scan_segment_times[segment] = elapsed
+            print(f"Queue scan segment {segment + 1}/{self.scan_segments}: {len(segment_items)} items in {elapsed:.3f}s")
+        return items
+    
+    def _scan_queue_segment(self, segment: int):
+        """
+        Scans a single segment through the table's client, boto3 resources are not thread safe but clients are.
+        The resource's client still serializes conditions and deserializes items.
+        """
+        started_at = time.perf_counter()
+        client = self.table.meta.client
+        scan_kwargs = {
+            'TableName': self.table.name,
+            'Segment': segment,
+            'TotalSegments': self.scan_segments,
+            'FilterExpression': Attr(self.joined_at_attr).exists()
+        }
+        response = client.scan(**scan_kwargs)
+        
+        items = response['Items']
+        while 'LastEvaluatedKey' in response:
+            response = client.scan(ExclusiveStartKey=response['LastEvaluatedKey'], **scan_kwargs)
+            items.extend(response['Items'])
+        return items, time.perf_counter() - started_at
+    
     def get_queue_user(self, connectionId: str):
         response = self.table.get_item(
             Key={
@@ -193,8 +481,11 @@ class _MatchmakingDataRepository:
         self.regionAtt = "Matchmaking_Region"
         self.playerInMatchAtt = "PlayerInMatch"
         self.ip = "MatchIp"
+        self.ratedPeriodAtt = "RatedPeriod"
+        self.ratingVersionAtt = "RatingVersion"
+        self.connectionIdAtt = "ConnectionId" # Latest connection of the player, its copy of the player's data is kept in sync
         
-        self.table = boto3.resource('dynamodb').Table(self.table_name)
+        self.table = get_resource('dynamodb').Table(self.table_name)
         
     def set_player_in_match(self, user_id: str, ip: str):
         self.table.update_item(
@@ -209,6 +500,24 @@ class _MatchmakingDataRepository:
         )
         return
     
+    def set_player_in_match_transact_item(self, user_id: str, ip: str):
+        """
+        Transaction item equivalent to set_player_in_match
+        """
+        return {
+            'Update': {
+                'TableName': self.table_name,
+                'Key': {
+                    self.table_pk: user_id
+                },
+                'UpdateExpression': f"SET {self.playerInMatchAtt} = :playerInMatch, {self.ip} = :ip",
+                'ExpressionAttributeValues': {
+                    ':playerInMatch': True,
+                    ':ip': ip
+                }
+            }
+        }
+    
     def set_player_not_in_match(self, user_id: str):
         self.table.update_item(
             Key={
@@ -221,6 +530,75 @@ class _MatchmakingDataRepository:
         )
         return
         
+    def set_player_not_in_match_transact_item(self, user_id: str):
+        """
+        Transaction item equivalent to set_player_not_in_match
+        """
+        return {
+            'Update': {
+                'TableName': self.table_name,
+                'Key': {
+                    self.table_pk: user_id
+                },
+                'UpdateExpression': f"SET {self.playerInMatchAtt} = :playerInMatch REMOVE {self.ip}",
+                'ConditionExpression': f"attribute_exists({self.table_pk})", # An unknown user id would create a stub item without a rating
+                'ExpressionAttributeValues': {
+                    ':playerInMatch': False
+                }
+            }
+        }
+    
+    def finish_match_rating_transact_item(self, user: User, rating: int, rd: int, vol: Decimal):
+        """
+        Transaction item setting the player's new rating and taking them out of the match,
+        only if the rating wasn't written since user was read
+        """
+        if user.rating_version:
+            condition = f"{self.ratingVersionAtt} = :version"
+            values = {':version': user.rating_version}
+        else:
+            condition = f"attribute_exists({self.table_pk}) AND attribute_not_exists({self.ratingVersionAtt})"
+            values = {}
+        return {
+            'Update': {
+                'TableName': self.table_name,
+                'Key': {
+                    self.table_pk: user.user_id
+                },
+                'UpdateExpression': f"SET {self.ratingAtt} = :rating, {self.rdAtt} = :rd, {self.volAtt} = :vol, {self.playerInMatchAtt} = :playerInMatch, {self.ratingVersionAtt} = :next_version REMOVE {self.ip}",
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': {
+                    ':rating': rating,
+                    ':rd': rd,
+                    ':vol': vol,
+                    ':playerInMatch': False,
+                    ':next_version': user.rating_version + 1,
+                    **values
+                }
+            }
+        }
+        
+    def attach_connection(self, user_id: str, connectionId: str):
+        """
+        Records the player's latest connection and returns the player's item, None if the player doesn't exist yet
+        """
+        try:
+            return self.table.update_item(
+                Key={
+                    self.table_pk: user_id
+                },
+                UpdateExpression=f"SET {self.connectionIdAtt} = :connectionId",
+                ConditionExpression=f"attribute_exists({self.table_pk})",
+                ExpressionAttributeValues={
+                    ':connectionId': connectionId
+                },
+                ReturnValues='ALL_NEW'
+            )['Attributes']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+    
     def get_user_data(self, user_id: str, connectionId: str):
         response = self.table.get_item(
             Key={
@@ -296,18 +674,127 @@ class _MatchmakingDataRepository:
             Key={
                 self.table_pk: user_id
             },
-            UpdateExpression=f"SET {self.ratingAtt} = :rating, {self.rdAtt} = :rd, {self.volAtt} = :vol",
+            UpdateExpression=f"SET {self.ratingAtt} = :rating, {self.rdAtt} = :rd, {self.volAtt} = :vol ADD {self.ratingVersionAtt} :one",
             ExpressionAttributeValues={
                 ':rating': rating,
                 ':rd': rd,
-                ':vol': vol
+                ':vol': vol,
+                ':one': 1
             }
         )
         return
+    
+    def get_users_data(self, user_ids: list[str], consistent_read: bool = False):
+        """
+        Reads many users with BatchGetItem, returns them by user id. Users not found are left out,
+        as are items without a rating, like the ones left by updates of unknown user ids.
+        """
+        users:dict[str,User] = {}
+        unique_ids = list(dict.fromkeys(user_ids))
+        for start in range(0, len(unique_ids), MAX_BATCH_GET_KEYS):
+            request_items = {self.table_name: {
+                'Keys': [{self.table_pk: user_id} for user_id in unique_ids[start:start + MAX_BATCH_GET_KEYS]],
+                'ConsistentRead': consistent_read
+            }}
+            while request_items:
+                response = self.table.meta.client.batch_get_item(RequestItems=request_items)
+                for item in response['Responses'].get(self.table_name, []):
+                    if any(attr not in item for attr in (self.ratingAtt, self.rdAtt, self.volAtt)):
+                        print(f"Skipping user {item[self.table_pk]} without a rating")
+                        continue
+                    users[item[self.table_pk]] = User(
+                        user_id=item[self.table_pk],
+                        rating=int(item[self.ratingAtt]),
+                        rd=int(item[self.rdAtt]),
+                        vol=Decimal(item[self.volAtt]),
+                        region=item.get(self.regionAtt, ""),
+                        connection_id=item.get(self.connectionIdAtt, ""),
+                        rating_version=int(item.get(self.ratingVersionAtt, 0)),
+                        rated_period=int(item[self.ratedPeriodAtt]) if self.ratedPeriodAtt in item else None
+                    )
+                request_items = response.get('UnprocessedKeys') # Throttled keys are read again
+        return users
+    
+    def update_user_rating_for_period(self, user_id: str, rating: int, rd: int, vol: Decimal, period: int):
+        """
+        Applies the rating of a closed rating period, once. Returns False if the period was already applied to the user.
+        """
+        try:
+            self.table.update_item(
+                Key={
+                    self.table_pk: user_id
+                },
+                UpdateExpression=f"SET {self.ratingAtt} = :rating, {self.rdAtt} = :rd, {self.volAtt} = :vol, {self.ratedPeriodAtt} = :period ADD {self.ratingVersionAtt} :one",
+                ConditionExpression=f"attribute_exists({self.table_pk}) AND (attribute_not_exists({self.ratedPeriodAtt}) OR {self.ratedPeriodAtt} < :period)",
+                ExpressionAttributeValues={
+                    ':rating': rating,
+                    ':rd': rd,
+                    ':vol': vol,
+                    ':period': period,
+                    ':one': 1
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+    
+    def scan_user_deviations(self):
+        """
+        Yields (user_id, rd, vol, rated period, rating version, latest connection id) for every user, the rated period
+        is None for users never rated in a period and the connection id empty for users who never connected.
+        The scan is eventually consistent, writes based on it are conditioned on the rating version read.
+        """
+        kwargs = {
+            'ProjectionExpression': "#pk, #rd, #vol, #period, #version, #connection",
+            'ExpressionAttributeNames': {'#pk': self.table_pk, '#rd': self.rdAtt, '#vol': self.volAtt, '#period': self.ratedPeriodAtt, '#version': self.ratingVersionAtt, '#connection': self.connectionIdAtt}
+        }
+        while True:
+            response = self.table.scan(**kwargs)
+            for item in response['Items']:
+                if self.rdAtt not in item:
+                    continue
+                rated_period = int(item[self.ratedPeriodAtt]) if self.ratedPeriodAtt in item else None
+                yield item[self.table_pk], int(item[self.rdAtt]), Decimal(item[self.volAtt]), rated_period, int(item.get(self.ratingVersionAtt, 0)), item.get(self.connectionIdAtt, "")
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    def update_user_rd_for_period(self, user_id: str, rd: int, period: int, rating_version: int):
+        """
+        Applies the rating deviation growth of a player who did not play in a closed period, once.
+        Returns False if the period was already applied or the rating was written since rating_version was read.
+        """
+        if rating_version:
+            version_condition = f"{self.ratingVersionAtt} = :version"
+            version_values = {':version': rating_version}
+        else:
+            version_condition = f"attribute_not_exists({self.ratingVersionAtt})"
+            version_values = {}
+        try:
+            self.table.update_item(
+                Key={
+                    self.table_pk: user_id
+                },
+                UpdateExpression=f"SET {self.rdAtt} = :rd, {self.ratedPeriodAtt} = :period ADD {self.ratingVersionAtt} :one",
+                ConditionExpression=f"attribute_exists({self.table_pk}) AND {version_condition} AND (attribute_not_exists({self.ratedPeriodAtt}) OR {self.ratedPeriodAtt} < :period)",
+                ExpressionAttributeValues={
+                    ':rd': rd,
+                    ':period': period,
+                    ':one': 1,
+                    **version_values
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
         
 class WebSocketRepository:
         
-    def __init__(self, connection_table_name: str, connection_table_pk: str, data_table_name: str, data_table_pk: str):
+    def __init__(self, connection_table_name: str, connection_table_pk: str, data_table_name: str, data_table_pk: str, connection_table_queue_index: str = "", queue_scan_segments: int = 1):
         self._connection_table_name = connection_table_name
         self._connection_table_pk = connection_table_pk
         self._data_table_name = data_table_name
@@ -315,36 +802,96 @@ class WebSocketRepository:
         
         self._eos_id_attr = "UserId"
 
-        self._table = boto3.resource('dynamodb').Table(self._connection_table_name)
-        self._matchMakingConnectionRepo = _MatchmakingConnectionRepository(table_pk = self._connection_table_pk, table_name=self._connection_table_name, user_id_attr=self._eos_id_attr)
+        self._table = get_resource('dynamodb').Table(self._connection_table_name)
+        self._matchMakingConnectionRepo = _MatchmakingConnectionRepository(table_pk = self._connection_table_pk, table_name=self._connection_table_name, user_id_attr=self._eos_id_attr, queue_index_name=connection_table_queue_index, scan_segments=queue_scan_segments)
         self._matchMakingDataRepo = _MatchmakingDataRepository(table_name = self._data_table_name, table_pk = self._data_table_pk)
 
     def connect(self, connectionId: str, user_id: str):
-        self._table.put_item(Item={
+        """
+        Stores the connection with a copy of the player's data, when the player already exists
+        """
+        item = {
             self._connection_table_pk: connectionId,
             self._eos_id_attr: user_id
-        })
-        
-    def join_queue(self, connectionId: str):
-        
-        userId = self._matchMakingConnectionRepo.get_connection_user_id(connectionId)
-        user_data, playerInMatch = self._matchMakingDataRepo.get_user_data(userId, connectionId)
-        if playerInMatch:
-            raise UserAlreadyInMatch()
+        }
+        user_item = self._matchMakingDataRepo.attach_connection(user_id, connectionId)
+        if user_item is not None:
+            item.update(self._matchMakingConnectionRepo.profile_attributes(
+                int(user_item[self._matchMakingDataRepo.ratingAtt]),
+                int(user_item[self._matchMakingDataRepo.rdAtt]),
+                Decimal(user_item[self._matchMakingDataRepo.volAtt]),
+                user_item.get(self._matchMakingDataRepo.regionAtt),
+                bool(user_item.get(self._matchMakingDataRepo.playerInMatchAtt, False))
+            ))
+        self._table.put_item(Item=item)
         
-        self._matchMakingConnectionRepo.join_queue(
-            connectionId,
-            user_data.rating,
-            user_data.rd,
-            user_data.vol,
-            user_data.region
-        )
+    def join_queue(self, connectionId: str, user_id: str = "", region: Optional[str] = None):
+        """
+        Puts the connection in queue with a single conditional write on the connection item.
+        When the region changes it is also saved as the player's region, for the next connections.
+        """
+        previous_region = self._matchMakingConnectionRepo.join_queue(connectionId, region)
+        if previous_region is not None and user_id:
+            self._matchMakingDataRepo.set_user_region(user_id, region) # type: ignore
+    
+    def sync_connection_profiles(self, users: list[User], ratings: Optional[dict[str, tuple[int, int, Decimal]]] = None, in_match: Optional[bool] = None):
+        """
+        Copies the players' new ratings, by user id, to their latest connection. The match state is only
+        copied when in_match is given, by the end of the match, other syncs must not touch it.
+        """
+        for user in users:
+            if not user.connection_id:
+                continue
+            attributes:dict = {}
+            if in_match is not None:
+                attributes[self._matchMakingConnectionRepo.in_match_attr] = in_match
+            if ratings and user.user_id in ratings:
+                rating, rd, vol = ratings[user.user_id] # type: ignore
+                attributes.update({
+                    self._matchMakingConnectionRepo.rating_attr: rating,
+                    self._matchMakingConnectionRepo.rd_attr: rd,
+                    self._matchMakingConnectionRepo.vol_attr: vol
+                })
+            if attributes:
+                self._matchMakingConnectionRepo.update_profile(user.connection_id, user.user_id, attributes)
+    
+    def sync_connection_deviation(self, user_id: str, connectionId: str, rd: int):
+        """
+        Copies the deviation a player gained by not playing in a rating period to their latest connection
+        """
+        if connectionId:
+            self._matchMakingConnectionRepo.update_profile(connectionId, user_id, {self._matchMakingConnectionRepo.rd_attr: rd})
         
-    def get_queue_users(self):
+    def get_queue_users(self, regions: Optional[list[str]] = None):
+        """
+        Returns a dict of users in queue where the key is the region and the value is the list of users in that region.
+        Pass the matchmaking regions to read them from the queue index instead of scanning the connection table.
+        """
+        return self._matchMakingConnectionRepo.get_queue_users(regions)
+    
+    def get_region_queue_users(self, region: str):
+        """
+        Returns the users in queue of a single region, read from the queue index
+        """
+        return self._matchMakingConnectionRepo.get_region_queue_users(region)
+
+    def read_region_queue_columns(self, region: str, columns):
         """
-        Returns a dict of users in queue where the key is the region and the value is the list of users in that region
+        Fills columns (a QueueColumns) with the queue of a single region, read from the queue index
         """
-        return self._matchMakingConnectionRepo.get_queue_users()
+        return self._matchMakingConnectionRepo.read_region_queue_columns(region, columns)
+
+    def queue_item_to_user(self, item: dict):
+        """
+        Builds the queued user of a connection item, raises KeyError if the connection is not in queue
+        """
+        return self._matchMakingConnectionRepo._queue_item_to_user(item)
+    
+    def get_connection_stream_arn(self):
+        """
+        Returns the ARN of the connection table's latest stream, None if the table has no stream
+        """
+        return self._matchMakingConnectionRepo.table.latest_stream_arn
     
     def get_user_data(self,user_id:str, connection_id:str=""):
         user_data, playerInMatch = self._matchMakingDataRepo.get_user_data(user_id,connection_id)
@@ -367,14 +914,98 @@ class WebSocketRepository:
             self._connection_table_pk: connectionId
         })
     
+    def delete_connections(self, connectionIds: list[str]):
+        """
+        Deletes stale connections in batches
+        """
+        with self._table.batch_writer() as batch:
+            for connectionId in set(connectionIds):
+                batch.delete_item(Key={
+                    self._connection_table_pk: connectionId
+                })
+    
     def leave_queue(self, connectionId: str):
         self._matchMakingConnectionRepo.leave_queue(connectionId)
 
     def set_user_in_match(self, user_id:str, ip: str):
         self._matchMakingDataRepo.set_player_in_match(user_id, ip)
         
+    def claim_users(self, users: list[User], claim_token: str):
+        """
+        Claims the connections of every user for a match being formed, so concurrent matchers can't use them.
+        All of them are claimed in a single transaction, so either every claim is made or none is.
+        Returns the users that could not be claimed, empty when all of them were.
+        """
+        now = int(time.time())
+        transact_items = [self._matchMakingConnectionRepo.claim_connection_transact_item(user.connection_id, claim_token, now) for user in users]
+        try:
+            self._table.meta.client.transact_write_items(TransactItems=transact_items)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            reasons = [reason.get('Code', 'None') for reason in e.response.get('CancellationReasons', [])]
+            # Another matcher's transaction on the same connection means it is being claimed right now
+            unavailable = [user for user, reason in zip(users, reasons) if reason in ('ConditionalCheckFailed', 'TransactionConflict')]
+            if not unavailable:
+                raise
+            return unavailable
+        return []
+    
+    def release_claims(self, users: list[User], claim_token: str):
+        for user in users:
+            self._matchMakingConnectionRepo.release_claim(user.connection_id, claim_token)
+    
+    def commit_match(self, users: list[User], ip: str, claim_token: Optional[str] = None):
+        """
+        Sets every user in match and removes them from the queue in a single transaction.
+        Raises MatchCommitFailed, writing nothing, if any user is no longer in queue or no longer claimed with claim_token.
+        """
+        transact_items = []
+        for user in users:
+            transact_items.append(self._matchMakingDataRepo.set_player_in_match_transact_item(user.user_id, ip))
+            transact_items.append(self._matchMakingConnectionRepo.leave_queue_transact_item(user.connection_id, claim_token))
+        
+        try:
+            self._table.meta.client.transact_write_items(TransactItems=transact_items)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'TransactionCanceledException':
+                raise MatchCommitFailed()
+            raise
+    
     def set_user_not_in_match(self, user_id: str):
         self._matchMakingDataRepo.set_player_not_in_match(user_id)
         
     def update_user_rating(self, user_id: str, rating: int, rd: int, vol: Decimal):
-        self._matchMakingDataRepo.update_user_rating(user_id, rating, rd, vol)
\ No newline at end of file
+        self._matchMakingDataRepo.update_user_rating(user_id, rating, rd, vol)
+        
+    def get_users_data(self, user_ids: list[str], consistent_read: bool = False):
+        return self._matchMakingDataRepo.get_users_data(user_ids, consistent_read)
+    
+    def finish_match(self, user_ids: list[str], extra_transact_items: Optional[list[dict]] = None):
+        """
+        Takes every user out of their match in a single transaction, along with extra_transact_items
+        """
+        transact_items = [self._matchMakingDataRepo.set_player_not_in_match_transact_item(user_id) for user_id in user_ids]
+        self._table.meta.client.transact_write_items(TransactItems=transact_items + (extra_transact_items or []))
+    
+    def commit_match_ratings(self, ratings: list[tuple[User, int, int, Decimal]]):
+        """
+        Sets the new (rating, rd, vol) of every user and takes them out of the match in a single transaction.
+        Raises RatingCommitFailed, writing nothing, if any rating was written since the users were read.
+        """
+        transact_items = [self._matchMakingDataRepo.finish_match_rating_transact_item(user, rating, rd, vol) for user, rating, rd, vol in ratings]
+        try:
+            self._table.meta.client.transact_write_items(TransactItems=transact_items)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'TransactionCanceledException':
+                raise RatingCommitFailed()
+            raise
+    
+    def update_user_rating_for_period(self, user_id: str, rating: int, rd: int, vol: Decimal, period: int):
+        return self._matchMakingDataRepo.update_user_rating_for_period(user_id, rating, rd, vol, period)
+    
+    def scan_user_deviations(self):
+        return self._matchMakingDataRepo.scan_user_deviations()
+    
+    def update_user_rd_for_period(self, user_id: str, rd: int, period: int, rating_version: int):
+        return self._matchMakingDataRepo.update_user_rd_for_period(user_id, rd, period, rating_version)
\ No newline at end of file
@@ -0,0 +1,168 @@
+from array import array
+from decimal import Decimal
+from itertools import accumulate
+from typing import Iterable, Optional
+from matchmakingTableRepository import User
+
+class StringTable:
+    """
+    Strings stored back to back in a single buffer, addressed by position. Costs the encoded bytes
+    plus 4 bytes per string, where a list of str costs about 60 bytes of object header per string.
+    """
+    def __init__(self):
+        self._data = bytearray()
+        self._offsets = array('I', [0])
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def append(self, value: str):
+        self._data += value.encode()
+        self._offsets.append(len(self._data))
+
+    def extend(self, values: list[str]):
+        encoded = [value.encode() for value in values]
+        self._offsets.pop() # Start of the new strings, given again as the accumulate initial value
+        self._offsets.extend(accumulate(map(len, encoded), initial=len(self._data)))
+        self._data += b''.join(encoded)
+
+    def __getitem__(self, index: int):
+        return self._data[self._offsets[index]:self._offsets[index + 1]].decode()
+
+    def take(self, positions: list[int]):
+        """
+        Returns a new table with the strings at positions, copied without decoding them
+        """
+        taken = StringTable()
+        data, offsets = self._data, self._offsets
+        taken._data = bytearray(b''.join([data[offsets[position]:offsets[position + 1]] for position in positions]))
+        taken._offsets = array('I', accumulate((offsets[position + 1] - offsets[position] for position in positions), initial=0))
+        return taken
+
+    def nbytes(self):
+        return len(self._data) + self._offsets.itemsize * len(self._offsets)
+
+class QueueColumns:
+    """
+    Compact queue of a single region: one array per attribute and string tables for the ids, in join order.
+    Users are only built for the players that are actually matched, indexing returns a new User every time.
+    Works as a read only sequence of users with the matchers, which keep the players left with retain.
+    """
+    def __init__(self, region: str):
+        self.region = region
+        self.ratings = array('i')
+        self.rds = array('H') # Never above INITIAL_RD
+        self.vols = array('d')
+        self.joined_at = array('q')
+        self.matchup_deltas: Optional[array] = None # Rating window on each side, None while every window is rd * 2
+        self.connection_ids = StringTable()
+        self.user_ids = StringTable()
+
+    @classmethod
+    def from_users(cls, region: str, users: Iterable[User]):
+        columns = cls(region)
+        for user in users:
+            columns.append_user(user)
+        return columns
+
+    def append(self, connection_id: str, user_id: str, rating: int, rd: int, vol: float, joined_at: int):
+        self.ratings.append(rating)
+        self.rds.append(rd)
+        self.vols.append(vol)
+        self.joined_at.append(joined_at)
+        if self.matchup_deltas is not None:
+            self.matchup_deltas.append(rd * 2)
+        self.connection_ids.append(connection_id)
+        self.user_ids.append(user_id)
+
+    def extend(self, connection_ids: list[str], user_ids: list[str], ratings: list[int], rds: list[int], vols: list[float], joined_at: list[int]):
+        """
+        Appends many players at once, a page of the queue read is added with a single call per column
+        """
+        self.ratings.extend(ratings)
+        self.rds.extend(rds)
+        self.vols.extend(vols)
+        self.joined_at.extend(joined_at)
+        if self.matchup_deltas is not None:
+            self.matchup_deltas.extend(rd * 2 for rd in rds)
+        self.connection_ids.extend(connection_ids)
+        self.user_ids.extend(user_ids)
+
+    def append_user(self, user: User):
+        self.append(user.connection_id, user.user_id, user.rating, user.rd, float(user.vol), user.joined_at)
+        if user.max_matchup_delta != user.rd * 2:
+            self.set_matchup_delta(len(self) - 1, user.max_matchup_delta)
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def matchup_delta(self, index: int):
+        if self.matchup_deltas is None:
+            return self.rds[index] * 2
+        return self.matchup_deltas[index]
+
+    def set_matchup_delta(self, index: int, delta: float):
+        if self.matchup_deltas is None:
+            self.matchup_deltas = array('d', [rd * 2 for rd in self.rds])
+        self.matchup_deltas[index] = delta
+
+    def set_matchup_deltas(self, deltas: Iterable[float]):
+        self.matchup_deltas = array('d', deltas)
+
+    def user(self, index: int):
+        user = User(
+            user_id=self.user_ids[index],
+            rating=self.ratings[index],
+            rd=self.rds[index],
+            vol=Decimal(repr(self.vols[index])),
+            region=self.region,
+            joined_at=self.joined_at[index],
+            connection_id=self.connection_ids[index]
+        )
+        user.max_matchup_delta = self.matchup_delta(index)
+        return user
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.user(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("queue index out of range")
+        return self.user(index)
+
+    def __iter__(self):
+        return (self.user(index) for index in range(len(self)))
+
+    def __setitem__(self, index, users: list[User]):
+        """
+        Only replacing the whole queue is supported, as the python matcher does with the players left
+        """
+        if index != slice(None):
+            raise TypeError("QueueColumns only supports replacing the whole queue")
+        replaced = QueueColumns.from_users(self.region, users)
+        self.__dict__.update(replaced.__dict__)
+
+    def _columns(self):
+        columns = ['ratings', 'rds', 'vols', 'joined_at']
+        if self.matchup_deltas is not None:
+            columns.append('matchup_deltas')
+        return columns
+
+    def retain(self, positions: Iterable[int]):
+        """
+        Keeps only the players at positions, in the order given
+        """
+        positions = list(positions)
+        for name in self._columns():
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, [column[position] for position in positions]))
+        self.connection_ids = self.connection_ids.take(positions)
+        self.user_ids = self.user_ids.take(positions)
+
+    def nbytes(self):
+        """
+        Memory used by the columns, without the fixed size of the objects themselves
+        """
+        arrays = [getattr(self, name) for name in self._columns()]
+        return sum(column.itemsize * len(column) for column in arrays) + self.connection_ids.nbytes() + self.user_ids.nbytes()
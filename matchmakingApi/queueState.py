@@ -0,0 +1,204 @@
+import threading
+from bisect import bisect_left, insort
+from typing import Callable, Optional
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from matchmakingTableRepository import User
+
+MAX_PAGES_PER_SHARD = 100 # GetRecords pages read from a shard on each poll, the rest is read on the next one
+
+class StreamFeedExpired(Exception):
+    """
+        Exception when the stream position was lost (iterator expired or records trimmed), the queue has to be rebuilt
+    """
+    def __init__(self, message="Stream position lost, the queue has to be rebuilt"):
+        self.message = message
+
+class QueueState:
+    """
+    In memory copy of the queue of every region, kept sorted by join time and by rating.
+    It is loaded once from a snapshot and then updated one change at a time, so keeping it current
+    costs the number of changes instead of the size of the queue.
+    """
+    def __init__(self, item_to_user: Callable[[dict], User]):
+        self._item_to_user = item_to_user # Raises KeyError for connections that are not in queue
+        self._lock = threading.Lock()
+        self._users:dict[str,User] = {} # Connection id -> queued user
+        self._by_joined_at:dict[str,list[tuple[int,str]]] = {}
+        self._by_rating:dict[str,list[tuple[int,int,str]]] = {}
+
+    def __len__(self):
+        return len(self._users)
+
+    def _insert(self, user: User):
+        insort(self._by_joined_at.setdefault(user.region, []), (user.joined_at, user.connection_id))
+        insort(self._by_rating.setdefault(user.region, []), (user.rating, user.joined_at, user.connection_id))
+        self._users[user.connection_id] = user
+
+    def _delete(self, connection_id: str):
+        user = self._users.pop(connection_id, None)
+        if user is None:
+            return
+        by_joined_at = self._by_joined_at[user.region]
+        del by_joined_at[bisect_left(by_joined_at, (user.joined_at, user.connection_id))]
+        by_rating = self._by_rating[user.region]
+        del by_rating[bisect_left(by_rating, (user.rating, user.joined_at, user.connection_id))]
+
+    def load(self, queue: dict[str,list[User]]):
+        """
+        Replaces the state with a full snapshot, as returned by get_queue_users
+        """
+        with self._lock:
+            self._users = {}
+            self._by_joined_at = {}
+            self._by_rating = {}
+            for users in queue.values():
+                for user in users:
+                    self._insert(user)
+
+    def upsert(self, user: User):
+        with self._lock:
+            self._delete(user.connection_id)
+            self._insert(user)
+
+    def remove(self, connection_id: str):
+        with self._lock:
+            self._delete(connection_id)
+
+    def apply_item(self, connection_id: str, item: Optional[dict]):
+        """
+        Applies the new image of a connection item, None when the item was deleted
+        """
+        user = None
+        if item is not None:
+            try:
+                user = self._item_to_user(item)
+            except KeyError: # Connection is not in queue
+                user = None
+        if user is None:
+            self.remove(connection_id)
+        else:
+            self.upsert(user)
+
+    def regions(self):
+        return [region for region, users in self._by_joined_at.items() if users]
+
+    def region_queue(self, region: str):
+        """
+        Returns the users in queue of a region sorted by join time, the same shape get_queue_users returns
+        """
+        with self._lock:
+            return [self._users[connection_id] for _, connection_id in self._by_joined_at.get(region, [])]
+
+    def region_queue_by_rating(self, region: str):
+        with self._lock:
+            return [self._users[connection_id] for _, _, connection_id in self._by_rating.get(region, [])]
+
+class StreamQueueFeed:
+    """
+    Tails the connection table stream and applies every change to a QueueState.
+    Works with the dynamodbstreams client or any object with the same describe_stream, get_shard_iterator and get_records calls.
+    """
+    def __init__(self, streams_client, stream_arn: str, queue_state: QueueState, table_pk: str):
+        self._streams_client = streams_client
+        self._stream_arn = stream_arn
+        self._queue_state = queue_state
+        self._table_pk = table_pk # connectionId
+        self._deserializer = TypeDeserializer() # Stream images come in the low level format
+        self._iterators:dict[str,Optional[str]] = {} # Shard id -> iterator, None once the shard is closed and read to the end
+        self._parents:dict[str,Optional[str]] = {}
+
+    def _describe_shards(self):
+        kwargs = {'StreamArn': self._stream_arn}
+        shards = []
+        while True:
+            description = self._streams_client.describe_stream(**kwargs)['StreamDescription']
+            shards.extend(description['Shards'])
+            if 'LastEvaluatedShardId' not in description:
+                return shards
+            kwargs['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+
+    def _shard_iterator(self, shard_id: str, iterator_type: str):
+        return self._streams_client.get_shard_iterator(
+            StreamArn=self._stream_arn,
+            ShardId=shard_id,
+            ShardIteratorType=iterator_type
+        )['ShardIterator']
+
+    def start(self):
+        """
+        Positions the feed at the end of every open shard. Call it before loading the snapshot,
+        changes made while the snapshot is read are then applied again on the first poll, which is harmless.
+        """
+        self._iterators = {}
+        self._parents = {}
+        for shard in self._describe_shards():
+            self._parents[shard['ShardId']] = shard.get('ParentShardId')
+            if 'EndingSequenceNumber' in shard['SequenceNumberRange']: # Closed, its records are older than the snapshot
+                self._iterators[shard['ShardId']] = None
+            else:
+                self._iterators[shard['ShardId']] = self._shard_iterator(shard['ShardId'], 'LATEST')
+
+    def _discover_shards(self):
+        for shard in self._describe_shards():
+            if shard['ShardId'] not in self._parents:
+                self._parents[shard['ShardId']] = shard.get('ParentShardId')
+
+    def _readable_shards(self):
+        """
+        Shards whose parent was read to the end, so changes of the same item are applied in order
+        """
+        shard_ids = []
+        for shard_id, parent_id in self._parents.items():
+            if parent_id is not None and self._iterators.get(parent_id, None) is not None:
+                continue
+            if shard_id not in self._iterators:
+                self._iterators[shard_id] = self._shard_iterator(shard_id, 'TRIM_HORIZON')
+            if self._iterators[shard_id] is not None:
+                shard_ids.append(shard_id)
+        return shard_ids
+
+    def poll(self):
+        """
+        Applies every change recorded since the last poll, returns the number of changes applied.
+        Raises StreamFeedExpired when the position in the stream was lost.
+        """
+        applied = 0
+        try:
+            self._discover_shards()
+            read_shard_ids = set()
+            shard_ids = self._readable_shards()
+            while shard_ids: # Children of shards closed during this poll become readable once their parent is read
+                for shard_id in shard_ids:
+                    applied += self._read_shard(shard_id)
+                read_shard_ids.update(shard_ids)
+                shard_ids = [shard_id for shard_id in self._readable_shards() if shard_id not in read_shard_ids]
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('ExpiredIteratorException', 'TrimmedDataAccessException'):
+                raise StreamFeedExpired()
+            raise
+        return applied
+
+    def _read_shard(self, shard_id: str):
+        applied = 0
+        for _ in range(MAX_PAGES_PER_SHARD):
+            iterator = self._iterators[shard_id]
+            if iterator is None:
+                break
+            response = self._streams_client.get_records(ShardIterator=iterator)
+            for record in response['Records']:
+                self._apply_record(record)
+                applied += 1
+            self._iterators[shard_id] = response.get('NextShardIterator')
+            if not response['Records']: # Caught up with an open shard, or a closed shard was read to the end
+                break
+        return applied
+
+    def _apply_record(self, record: dict):
+        change = record['dynamodb']
+        connection_id = self._deserializer.deserialize(change['Keys'][self._table_pk])
+        if record['eventName'] == 'REMOVE' or 'NewImage' not in change:
+            self._queue_state.apply_item(connection_id, None)
+            return
+        item = {key: self._deserializer.deserialize(value) for key, value in change['NewImage'].items()}
+        self._queue_state.apply_item(connection_id, item)
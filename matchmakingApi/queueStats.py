@@ -0,0 +1,304 @@
+import math
+import threading
+import time
+from typing import Optional
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from awsClients import get_resource
+
+QUEUE_STATS_CONTROL_KEY_PREFIX = "queue-stats#" # Control table item of each region, followed by the region
+WAIT_BUCKET_SECONDS = 10 # Join times are counted in buckets this long, waits are known to this precision
+RATING_BIN_SIZE = 100 # Width of the rating histogram bins
+WAIT_QUANTILES = (0.5, 0.95, 0.99)
+APPLIED_BATCH_SECONDS = 900 # Ids of applied stream batches are kept this long, longer than the stream mapping retries a batch
+JOINED_BUCKET_PREFIX = "J#"
+RATING_BIN_PREFIX = "R#"
+
+def wait_bucket_of(joined_at: int):
+    return joined_at // WAIT_BUCKET_SECONDS * WAIT_BUCKET_SECONDS
+
+def rating_bin_of(rating: int):
+    return rating // RATING_BIN_SIZE * RATING_BIN_SIZE
+
+class QueueStatsDelta:
+    """
+    Changes to the queue aggregates of each region made by a batch of connection changes.
+    Changes to the same attribute are added up, so a batch costs one write per region whatever its size.
+    """
+    def __init__(
+            self,
+            region_attr: str = "Matchmaking_Region",
+            joined_at_attr: str = "JoinedAt",
+            rating_attr: str = "Rating",
+            in_match_attr: str = "PlayerInMatch"
+        ):
+        self.region_attr = region_attr
+        self.joined_at_attr = joined_at_attr
+        self.rating_attr = rating_attr
+        self.in_match_attr = in_match_attr
+        self.regions:dict[str,dict[str,int]] = {} # Region -> attribute -> amount added
+        self._deserializer = TypeDeserializer() # Stream images come in the low level format
+
+    def _add(self, region: str, attribute: str, amount: int):
+        changes = self.regions.setdefault(region, {})
+        changes[attribute] = changes.get(attribute, 0) + amount
+
+    def _queue_entry(self, item: Optional[dict]):
+        """
+        Region, join time and rating of a connection item, None when it is not in queue
+        """
+        if not item or self.joined_at_attr not in item or self.region_attr not in item or self.rating_attr not in item:
+            return None
+        return item[self.region_attr], int(item[self.joined_at_attr]), int(item[self.rating_attr])
+
+    def _count_player(self, entry: tuple[str,int,int], amount: int):
+        region, joined_at, rating = entry
+        self._add(region, f"{JOINED_BUCKET_PREFIX}{wait_bucket_of(joined_at)}", amount)
+        self._add(region, f"{RATING_BIN_PREFIX}{rating_bin_of(rating)}", amount)
+
+    def apply_change(self, old_item: Optional[dict], new_item: Optional[dict]):
+        """
+        Counts the change between two images of a connection item, None when the item didn't exist
+        """
+        old, new = self._queue_entry(old_item), self._queue_entry(new_item)
+        if old == new: # Not in queue, or a change to something else than its place in the queue
+            return
+        if old is not None:
+            self._count_player(old, -1)
+            if new is None and new_item and new_item.get(self.in_match_attr):
+                self._add(old[0], "Matched", 1)
+            elif new is None or new[0] != old[0]: # Left the queue, disconnected or moved to another region
+                self._add(old[0], "Left", 1)
+        if new is not None:
+            self._count_player(new, 1)
+            if old is None or old[0] != new[0]:
+                self._add(new[0], "Joined", 1)
+
+    def apply_stream_record(self, record: dict):
+        change = record['dynamodb']
+        old_item = {key: self._deserializer.deserialize(value) for key, value in change['OldImage'].items()} if 'OldImage' in change else None
+        new_item = {key: self._deserializer.deserialize(value) for key, value in change['NewImage'].items()} if 'NewImage' in change else None
+        self.apply_change(old_item, new_item)
+
+    @classmethod
+    def from_stream_records(cls, records: list[dict], **attributes):
+        delta = cls(**attributes)
+        for record in records:
+            delta.apply_stream_record(record)
+        return delta
+
+def stream_batch_id(records: list[dict]):
+    """
+    Id of a batch of stream records, the same when the batch is retried. Starts with the creation time of
+    its first record so ids that can no longer be retried are recognized and dropped.
+    """
+    first = records[0]['dynamodb']
+    return f"{int(first.get('ApproximateCreationDateTime', time.time()))}:{first['SequenceNumber']}"
+
+class RegionQueueStats:
+    """
+    Aggregates of a region's queue as stored in its control item: how many players joined in each
+    wait bucket and have each rating, which is enough to get the depth, the wait quantiles and the histogram.
+    """
+    def __init__(self, region: str, joined_buckets: dict[int,int], rating_bins: dict[int,int], joined: int = 0, left: int = 0, matched: int = 0, updated_at: Optional[int] = None):
+        self.region = region
+        self.joined_buckets = {bucket: count for bucket, count in joined_buckets.items() if count > 0}
+        self.rating_bins = {rating_bin: count for rating_bin, count in rating_bins.items() if count > 0}
+        self.joined = joined # Totals since the aggregates were first written
+        self.left = left
+        self.matched = matched
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_item(cls, region: str, item: Optional[dict]):
+        item = item or {}
+        joined_buckets:dict[int,int] = {}
+        rating_bins:dict[int,int] = {}
+        for name, value in item.items():
+            if name.startswith(JOINED_BUCKET_PREFIX):
+                joined_buckets[int(name[len(JOINED_BUCKET_PREFIX):])] = int(value)
+            elif name.startswith(RATING_BIN_PREFIX):
+                rating_bins[int(name[len(RATING_BIN_PREFIX):])] = int(value)
+        updated_at = item.get("UpdatedAt")
+        return cls(
+            region, joined_buckets, rating_bins,
+            joined=int(item.get("Joined", 0)),
+            left=int(item.get("Left", 0)),
+            matched=int(item.get("Matched", 0)),
+            updated_at=int(updated_at) if updated_at is not None else None
+        )
+
+    @property
+    def depth(self):
+        return sum(self.joined_buckets.values())
+
+    def wait_quantiles(self, now: float, quantiles: tuple[float, ...] = WAIT_QUANTILES):
+        """
+        Seconds waited so far by the players in queue at each quantile, measured from the middle of their
+        join bucket. None for every quantile when the queue is empty.
+        """
+        depth = self.depth
+        if not depth:
+            return {quantile: None for quantile in quantiles}
+        ranks = {quantile: max(1, math.ceil(quantile * depth)) for quantile in quantiles}
+        waits:dict[float,Optional[float]] = {}
+        seen = 0
+        for bucket in sorted(self.joined_buckets, reverse=True): # Latest joins first, shortest waits first
+            seen += self.joined_buckets[bucket]
+            wait = round(max(0.0, now - (bucket + WAIT_BUCKET_SECONDS / 2)), 1)
+            for quantile, rank in ranks.items():
+                if quantile not in waits and seen >= rank:
+                    waits[quantile] = wait
+        return waits
+
+    def max_wait(self, now: float):
+        if not self.joined_buckets:
+            return None
+        return round(max(0.0, now - (min(self.joined_buckets) + WAIT_BUCKET_SECONDS / 2)), 1)
+
+    def rating_histogram(self):
+        return [
+            {'min': rating_bin, 'max': rating_bin + RATING_BIN_SIZE, 'count': self.rating_bins[rating_bin]}
+            for rating_bin in sorted(self.rating_bins)
+        ]
+
+    def to_dict(self, now: float):
+        return {
+            'depth': self.depth,
+            'wait': {
+                **{f"p{round(quantile * 100)}": wait for quantile, wait in self.wait_quantiles(now).items()},
+                'max': self.max_wait(now)
+            },
+            'rating_histogram': self.rating_histogram(),
+            'joined': self.joined,
+            'left': self.left,
+            'matched': self.matched,
+            'updated_at': self.updated_at
+        }
+
+class QueueStatsRepository:
+    """
+    Queue aggregates of each region, one item per region in the matchmaking control table.
+    Items are updated with ADD from the changes of the connection table stream, and read without
+    touching the queue, so reading them costs the same whatever the number of players in queue.
+    """
+    def __init__(self, table_name: str, table_pk: str = "ControlKey", applied_batches_attr: str = "AppliedBatches", updated_at_attr: str = "UpdatedAt"):
+        self.table_pk = table_pk
+        self.applied_batches_attr = applied_batches_attr # Stream batches already added, a retried batch isn't added twice
+        self.updated_at_attr = updated_at_attr
+
+        self.table = get_resource('dynamodb').Table(table_name)
+
+    def _key(self, region: str):
+        return {self.table_pk: f"{QUEUE_STATS_CONTROL_KEY_PREFIX}{region}"}
+
+    def apply(self, delta: QueueStatsDelta, batch_id: str):
+        """
+        Adds the changes of a stream batch to every region it touched. Regions that already have the
+        batch are skipped, so a batch that failed halfway can be retried as a whole.
+        """
+        for region, changes in delta.regions.items():
+            changes = {name: amount for name, amount in changes.items() if amount}
+            if changes:
+                self._apply_region(region, changes, batch_id)
+
+    def _apply_region(self, region: str, changes: dict[str,int], batch_id: str):
+        names = {'#applied': self.applied_batches_attr, '#updated': self.updated_at_attr, '#region': 'Region'}
+        values = {':batch': batch_id, ':batches': {batch_id}, ':now': int(time.time()), ':region': region}
+        additions = []
+        for i, (name, amount) in enumerate(changes.items()):
+            names[f'#a{i}'] = name
+            values[f':a{i}'] = amount
+            additions.append(f"#a{i} :a{i}")
+        try:
+            response = self.table.update_item(
+                Key=self._key(region),
+                UpdateExpression=f"ADD {', '.join(additions)}, #applied :batches SET #updated = :now, #region = :region",
+                ConditionExpression="attribute_not_exists(#applied) OR NOT contains(#applied, :batch)",
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues='ALL_NEW'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException': # Added by a previous try of the batch
+                return
+            raise
+        self._prune(region, response['Attributes'])
+
+    def _prune(self, region: str, item: dict):
+        """
+        Removes the buckets nobody is in anymore and the batch ids that can't be retried anymore,
+        which keeps the item the size of the current queue's spread instead of growing forever
+        """
+        empty = [name for name, value in item.items() if name.startswith((JOINED_BUCKET_PREFIX, RATING_BIN_PREFIX)) and value <= 0]
+        expired_before = time.time() - APPLIED_BATCH_SECONDS
+        expired = {batch for batch in item.get(self.applied_batches_attr, set()) if int(batch.split(':', 1)[0]) < expired_before}
+        if not empty and not expired:
+            return
+
+        names:dict[str,str] = {}
+        values:dict = {':zero': 0}
+        conditions = []
+        for i, name in enumerate(empty):
+            names[f'#e{i}'] = name
+            conditions.append(f"#e{i} <= :zero")
+        expression = f"REMOVE {', '.join(f'#e{i}' for i in range(len(empty)))}" if empty else ""
+        if expired:
+            names['#applied'] = self.applied_batches_attr
+            values[':expired'] = expired
+            expression += " DELETE #applied :expired"
+        kwargs = {
+            'Key': self._key(region),
+            'UpdateExpression': expression.strip(),
+            'ExpressionAttributeNames': names
+        }
+        if conditions:
+            kwargs['ConditionExpression'] = " AND ".join(conditions)
+        if expired or conditions:
+            kwargs['ExpressionAttributeValues'] = values
+        try:
+            self.table.update_item(**kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException': # A player joined one of the buckets since, pruned on a later batch
+                raise
+
+    def get_regions_stats(self, regions: list[str]):
+        stats:dict[str,RegionQueueStats] = {}
+        regions = list(dict.fromkeys(regions))
+        for start in range(0, len(regions), 100): # batch_get_item takes at most 100 keys
+            keys = [self._key(region) for region in regions[start:start + 100]]
+            request = {self.table.name: {'Keys': keys}}
+            while request:
+                response = self.table.meta.client.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table.name, []):
+                    region = item[self.table_pk][len(QUEUE_STATS_CONTROL_KEY_PREFIX):]
+                    stats[region] = RegionQueueStats.from_item(region, item)
+                request = response.get('UnprocessedKeys')
+        return {region: stats.get(region) or RegionQueueStats(region, {}, {}) for region in regions}
+
+class QueueStatsReader:
+    """
+    Serves the queue stats of a set of regions from memory for max_age seconds, so a warm instance
+    polled by many dashboards reads each region item at most once per max_age
+    """
+    def __init__(self, repository: QueueStatsRepository, max_age: float):
+        self.repository = repository
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._cached:dict[tuple[str, ...],tuple[float,dict[str,RegionQueueStats]]] = {}
+
+    def get_queue_stats(self, regions: list[str]):
+        """
+        Response body of the queueStats action
+        """
+        key = tuple(sorted(set(regions)))
+        now = time.time()
+        with self._lock:
+            read_at, stats = self._cached.get(key, (0.0, {}))
+            if now - read_at > self.max_age:
+                stats = self.repository.get_regions_stats(list(key))
+                self._cached[key] = (now, stats)
+        return {
+            'generated_at': int(now),
+            'regions': {region: region_stats.to_dict(now) for region, region_stats in stats.items()}
+        }
@@ -0,0 +1,167 @@
+import time
+import uuid
+from decimal import Decimal
+from typing import Optional
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from awsClients import get_resource
+from glicko_team import Player, TeamRatingCalculator
+from matchmakingTableRepository import User, INITIAL_RD
+
+RATING_PERIOD_CONTROL_KEY = "rating-period" # Control table item holding the last closed period
+RESULT_LOG_TTL = 30 * 24 * 60 * 60 # Seconds results are kept after their match
+
+def rating_period_of(timestamp: float, period_seconds: int):
+    """
+    Start of the rating period containing timestamp, in epoch seconds
+    """
+    return int(timestamp // period_seconds) * period_seconds
+
+class MatchResult:
+    def __init__(self, home_ids: list[str], away_ids: list[str], team1_win: float):
+        self.home_ids = home_ids
+        self.away_ids = away_ids
+        self.team1_win = team1_win # 1 home win, 0 away win, 0.5 draw
+
+class MatchResultLogRepository:
+    """
+    Results of finished matches, partitioned by the rating period they were played in.
+    Ratings are only updated when the period is closed, with every game of the period at once.
+    """
+    def __init__(
+            self,
+            table_name: str,
+            period_attr: str = "RatingPeriod",
+            result_id_attr: str = "ResultId",
+            home_attr: str = "Home",
+            away_attr: str = "Away",
+            team1_win_attr: str = "Team1Win",
+            finished_at_attr: str = "FinishedAt",
+            expires_at_attr: str = "ExpiresAt"
+        ):
+        self.period_attr = period_attr
+        self.result_id_attr = result_id_attr
+        self.home_attr = home_attr
+        self.away_attr = away_attr
+        self.team1_win_attr = team1_win_attr
+        self.finished_at_attr = finished_at_attr
+        self.expires_at_attr = expires_at_attr
+
+        self.table = get_resource('dynamodb').Table(table_name)
+
+    def _result_item(self, home_ids: list[str], away_ids: list[str], team1_win: float, period_seconds: int):
+        finished_at = int(time.time())
+        return {
+            self.period_attr: rating_period_of(finished_at, period_seconds),
+            self.result_id_attr: f"{finished_at}-{uuid.uuid4().hex}",
+            self.home_attr: home_ids,
+            self.away_attr: away_ids,
+            self.team1_win_attr: Decimal(str(team1_win)),
+            self.finished_at_attr: finished_at,
+            self.expires_at_attr: finished_at + RESULT_LOG_TTL
+        }
+
+    def append_result(self, home_ids: list[str], away_ids: list[str], team1_win: float, period_seconds: int):
+        """
+        Logs the result in the current rating period, returns the period
+        """
+        item = self._result_item(home_ids, away_ids, team1_win, period_seconds)
+        self.table.put_item(Item=item)
+        return item[self.period_attr]
+
+    def append_result_transact_item(self, home_ids: list[str], away_ids: list[str], team1_win: float, period_seconds: int):
+        """
+        Transaction item equivalent to append_result
+        """
+        return {
+            'Put': {
+                'TableName': self.table.name,
+                'Item': self._result_item(home_ids, away_ids, team1_win, period_seconds)
+            }
+        }
+
+    def get_period_results(self, period: int):
+        results:list[MatchResult] = []
+        kwargs = {'KeyConditionExpression': Key(self.period_attr).eq(period)}
+        while True:
+            response = self.table.query(**kwargs)
+            for item in response['Items']:
+                results.append(MatchResult(item[self.home_attr], item[self.away_attr], float(item[self.team1_win_attr])))
+            if 'LastEvaluatedKey' not in response:
+                return results
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+class RatingPeriodRepository:
+    """
+    Tracks the last rating period whose results were applied, in the matchmaking control table
+    """
+    def __init__(self, table_name: str, table_pk: str = "ControlKey", closed_through_attr: str = "ClosedThrough"):
+        self.table_pk = table_pk
+        self.closed_through_attr = closed_through_attr
+
+        self.table = get_resource('dynamodb').Table(table_name)
+
+    def get_closed_through(self) -> Optional[int]:
+        item = self.table.get_item(Key={self.table_pk: RATING_PERIOD_CONTROL_KEY}, ConsistentRead=True).get('Item')
+        if not item or self.closed_through_attr not in item:
+            return None
+        return int(item[self.closed_through_attr])
+
+    def set_closed_through(self, period: int):
+        try:
+            self.table.update_item(
+                Key={self.table_pk: RATING_PERIOD_CONTROL_KEY},
+                UpdateExpression="SET #closed = :period",
+                ConditionExpression="attribute_not_exists(#closed) OR #closed < :period",
+                ExpressionAttributeNames={'#closed': self.closed_through_attr},
+                ExpressionAttributeValues={':period': period}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException': # Already closed by another run
+                raise
+
+def grow_idle_deviation(rd: int, vol: Decimal, periods: int):
+    """
+    Deviation of a player after periods rating periods without a game, capped at INITIAL_RD.
+    Rounded rather than truncated, truncating would never let it grow.
+    """
+    player = Player(rd=rd, vol=float(vol))
+    for _ in range(periods):
+        if player.rd >= INITIAL_RD:
+            break
+        player.did_not_compete()
+    return min(INITIAL_RD, round(player.rd))
+
+def fold_rating_period(results: list[MatchResult], users: dict[str, User]):
+    """
+    Rates every player who played in the period with all their games at once, as Glicko-2 expects.
+    Games are seen from the ratings at the start of the period. Malformed results, with an empty team, a player
+    listed twice or unknown players, are skipped so one bad result can't stop the period from closing.
+    Returns the updated players by user id.
+    """
+    period_start_players = {user_id: Player(user.rating, user.rd, float(user.vol)) for user_id, user in users.items()}
+    games:dict[str,tuple[list[float],list[float],list[float]]] = {}
+    for result in results:
+        if not result.home_ids or not result.away_ids or len(set(result.home_ids + result.away_ids)) < len(result.home_ids + result.away_ids):
+            print(f"Skipping malformed result: {result.home_ids} vs {result.away_ids}")
+            continue
+        if any(user_id not in users for user_id in result.home_ids + result.away_ids):
+            print(f"Skipping result with unknown players: {result.home_ids} vs {result.away_ids}")
+            continue
+        home_players = [(period_start_players[user_id], user_id) for user_id in result.home_ids]
+        away_players = [(period_start_players[user_id], user_id) for user_id in result.away_ids]
+        teamRatingCalculator = TeamRatingCalculator(home_players, away_players, result.team1_win)
+        for player, user_id in home_players + away_players:
+            opponent_rating, opponent_rd, outcome = teamRatingCalculator.opponent_game(player)
+            player_games = games.setdefault(user_id, ([], [], []))
+            player_games[0].append(opponent_rating)
+            player_games[1].append(opponent_rd)
+            player_games[2].append(outcome)
+
+    rated:dict[str,Player] = {}
+    for user_id, (opponent_ratings, opponent_rds, outcomes) in games.items():
+        user = users[user_id]
+        player = Player(user.rating, user.rd, float(user.vol))
+        player.update_player(opponent_ratings, opponent_rds, outcomes)
+        rated[user_id] = player
+    return rated
@@ -0,0 +1,125 @@
+import heapq
+import math
+from bisect import bisect_left
+from matchmakingTableRepository import User
+
+class SearchWindowCurve:
+    """
+    Widens the rating window of a player with the time spent in queue, so players far from everyone else
+    eventually find a match. The window starts at rd * base_multiplier and grows every step_seconds,
+    by step_growth rating points ('linear') or by growth_factor times ('exponential'), up to max_delta.
+    The default curve never grows, which is the fixed rd * 2 window.
+    """
+    def __init__(self, base_multiplier: float = 2, step_seconds: float = 10, step_growth: float = 0, growth_factor: float = 1, max_delta: float = 0, shape: str = 'linear'):
+        self.base_multiplier = base_multiplier
+        self.step_seconds = step_seconds
+        self.step_growth = step_growth
+        self.growth_factor = growth_factor
+        self.max_delta = max_delta # 0 for no cap
+        self.shape = shape
+
+    @classmethod
+    def from_string(cls, curve: str):
+        """
+        Builds a curve from comma separated settings, e.g. "shape=linear,step_seconds=10,step_growth=25,max_delta=400"
+        """
+        settings = {}
+        for setting in curve.split(','):
+            if not setting.strip():
+                continue
+            name, value = setting.split('=')
+            settings[name.strip()] = value.strip() if name.strip() == 'shape' else float(value)
+        return cls(**settings)
+
+    def expands(self):
+        if self.shape == 'exponential':
+            return self.growth_factor > 1
+        return self.step_growth > 0
+
+    def delta(self, rd: int, waited_seconds: float):
+        """
+        Rating window of a player, on each side of their rating
+        """
+        delta = rd * self.base_multiplier
+        steps = max(0, int(waited_seconds // self.step_seconds)) if self.expands() else 0
+        if steps:
+            if self.shape == 'exponential':
+                delta *= self.growth_factor ** steps
+            else:
+                delta += self.step_growth * steps
+        if self.max_delta:
+            delta = min(delta, max(self.max_delta, rd * self.base_multiplier))
+        return delta
+
+    def next_expansion(self, rd: int, waited_seconds: float):
+        """
+        Wait in seconds at which the window grows next, None when it doesn't grow anymore
+        """
+        if not self.expands():
+            return None
+        if self.max_delta and self.delta(rd, waited_seconds) >= self.max_delta:
+            return None
+        return (math.floor(max(0, waited_seconds) / self.step_seconds) + 1) * self.step_seconds
+
+class ReevaluationEngine:
+    """
+    Decides which players of a region are worth taking as anchors of a match search on each run.
+    A player is evaluated again only when their window has grown or a player arrived inside their window,
+    players whose situation didn't change are skipped instead of being searched again on every run.
+    Window growth deadlines are kept in a priority queue. The players covering a new arrival are found with one
+    bisect per player over the sorted ratings of the run's arrivals, so a run costs O(n log m) for m arrivals.
+    """
+    def __init__(self, curve: SearchWindowCurve):
+        self.curve = curve
+        self._players:dict[str,dict[str,tuple[int,int,int]]] = {} # Region -> connection id -> (rating, rd, joined at)
+        self._deadlines:dict[str,list[tuple[float,str,int]]] = {} # Region -> heap of (next expansion time, connection id, joined at)
+
+    def anchors(self, region: str, queue: list[User], now: float):
+        """
+        Sets the current window of every player in the queue and returns the connection ids to take as anchors on this run
+        """
+        players = self._players.setdefault(region, {})
+        deadlines = self._deadlines.setdefault(region, [])
+
+        for user in queue:
+            user.max_matchup_delta = self.curve.delta(user.rd, now - user.joined_at)
+
+        current = {user.connection_id: user for user in queue}
+        for connection_id in [connection_id for connection_id, (_, _, joined_at) in players.items()
+                              if connection_id not in current or current[connection_id].joined_at != joined_at]:
+            del players[connection_id] # Matched, left, or rejoined the queue
+
+        anchors:set[str] = set()
+        for connection_id, user in current.items():
+            if connection_id in players:
+                continue
+            players[connection_id] = (user.rating, user.rd, user.joined_at)
+            anchors.add(connection_id)
+            next_expansion = self.curve.next_expansion(user.rd, now - user.joined_at)
+            if next_expansion is not None:
+                heapq.heappush(deadlines, (user.joined_at + next_expansion, connection_id, user.joined_at))
+
+        if anchors: # New players can complete the match of players already waiting around them
+            arrival_ratings = sorted(players[connection_id][0] for connection_id in anchors)
+            for connection_id, user in current.items():
+                first_above = bisect_left(arrival_ratings, user.rating - user.max_matchup_delta)
+                if first_above < len(arrival_ratings) and arrival_ratings[first_above] <= user.rating + user.max_matchup_delta:
+                    anchors.add(connection_id)
+
+        while deadlines and deadlines[0][0] <= now:
+            _, connection_id, joined_at = heapq.heappop(deadlines)
+            if connection_id not in players or players[connection_id][2] != joined_at: # Stale entry
+                continue
+            anchors.add(connection_id)
+            _, rd, _ = players[connection_id]
+            next_expansion = self.curve.next_expansion(rd, now - joined_at)
+            if next_expansion is not None:
+                heapq.heappush(deadlines, (joined_at + next_expansion, connection_id, joined_at))
+        return anchors
+
+    def forget(self, region: str, connection_ids: list[str]):
+        """
+        Drops players so they are evaluated as new ones on the next run, used when their match could not be committed
+        """
+        for connection_id in connection_ids:
+            self._players.get(region, {}).pop(connection_id, None)
@@ -0,0 +1,84 @@
+import math
+import threading
+from typing import Optional
+from matchmakingTableRepository import User, Match
+
+try:
+    import numpy as np
+except ImportError: # Without numpy the splits are scored one at a time, every one of them still is
+    np = None
+
+NUMPY_MIN_SPLITS = 16 # Smaller tables are scored faster by the python loop than by the numpy calls
+
+class SplitTable:
+    """
+    Every way to split match_size players in two teams of the same size, as bitmasks of the first team.
+    Player 0 is always in the first team so a split isn't there twice with the teams swapped,
+    which leaves C(match_size - 1, match_size / 2 - 1) splits, 126 for 5 against 5.
+    """
+    def __init__(self, match_size: int):
+        team_size = match_size // 2
+        self.match_size = match_size
+        self.masks = [mask for mask in range(1, 1 << match_size, 2) if bin(mask).count('1') == team_size]
+        self.teams = [tuple(i for i in range(match_size) if mask >> i & 1) for mask in self.masks] # Positions of the first team
+        self.members = None # Splits x players, 1 for the first team
+        self.signs = None # Splits x players, 1 for the first team and -1 for the second
+        if np is not None:
+            self.members = ((np.array(self.masks, dtype=np.int64)[:, None] >> np.arange(match_size)) & 1).astype(np.float64)
+            self.signs = 2 * self.members - 1
+
+class TeamSplitter:
+    """
+    Splits the players of a match in the two teams with the closest total rating, out of every possible split.
+    With an rd_weight, the difference between the combined RD of the teams (square root of the sum of their
+    RD squared) times rd_weight is added to the score, so neither team is much less certain than the other.
+    Ties go to the first split of the table, the players being sorted by rating.
+    """
+    def __init__(self, rd_weight: float = 0):
+        self.rd_weight = rd_weight
+        self._tables:dict[int,SplitTable] = {}
+        self._lock = threading.Lock() # Regions are matched in threads
+
+    def table(self, match_size: int):
+        table = self._tables.get(match_size)
+        if table is None:
+            with self._lock:
+                table = self._tables.setdefault(match_size, SplitTable(match_size))
+        return table
+
+    def best_split(self, ratings: list[float], rds: Optional[list[float]] = None):
+        """
+        Positions of the first team in the best split of the players with these ratings and rds
+        """
+        table = self.table(len(ratings))
+        if len(table.teams) == 1:
+            return table.teams[0]
+        use_rd = bool(self.rd_weight) and rds is not None
+        if np is not None and len(table.teams) >= NUMPY_MIN_SPLITS:
+            scores = np.abs(table.signs @ np.asarray(ratings, dtype=np.float64))
+            if use_rd:
+                variances = np.square(np.asarray(rds, dtype=np.float64))
+                team_variances = table.members @ variances
+                scores += self.rd_weight * np.abs(np.sqrt(team_variances) - np.sqrt(variances.sum() - team_variances))
+            return table.teams[int(np.argmin(scores))]
+
+        total_rating = sum(ratings)
+        variances = [rd * rd for rd in rds] if use_rd else []
+        total_variance = sum(variances)
+        best_team, best_score = table.teams[0], math.inf
+        for team in table.teams:
+            team_rating = sum(ratings[i] for i in team)
+            score = abs(2 * team_rating - total_rating)
+            if use_rd:
+                team_variance = sum(variances[i] for i in team)
+                score += self.rd_weight * abs(math.sqrt(team_variance) - math.sqrt(total_variance - team_variance))
+            if score < best_score:
+                best_team, best_score = team, score
+        return best_team
+
+    def split(self, match_players: list[User]):
+        match_players.sort(key=lambda player: player.rating)
+        first_team = set(self.best_split([player.rating for player in match_players], [player.rd for player in match_players]))
+        team1 = [player for i, player in enumerate(match_players) if i in first_team]
+        team2 = [player for i, player in enumerate(match_players) if i not in first_team]
+        return Match(team1, team2)
@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+
+DEFAULT_NAMESPACE = "Matchmaking"
+
+class _Phase:
+    """
+    Adds the time spent in a with block to a phase of the tick
+    """
+    __slots__ = ('_metrics', '_name', '_started_at')
+
+    def __init__(self, metrics: "TickMetrics", name: str):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.add_time(self._name, time.perf_counter() - self._started_at)
+        return False
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_PHASE = _NoPhase()
+
+class TickMetrics:
+    """
+    Time spent in each phase of a matchmaking tick and counters of what it did, for one region.
+    emit prints them as a single CloudWatch embedded metric format line, which CloudWatch Logs turns into metrics.
+    When disabled, phase returns a shared no-op context manager and nothing is recorded or printed.
+    Phases entered several times in a tick (each claim round) add up.
+    """
+    def __init__(self, dimensions: dict[str,str], enabled: bool = True, namespace: str = DEFAULT_NAMESPACE):
+        self.enabled = enabled
+        self.namespace = namespace
+        self.dimensions = dimensions
+        self.timings:dict[str,float] = {} # Phase -> seconds
+        self.counts:dict[str,float] = {}
+        self._lock = threading.Lock() # Phases can run in the threads of a region's matcher
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return _NO_PHASE
+        return _Phase(self, name)
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_emf(self):
+        metrics = [{'Name': f"{name}Time", 'Unit': 'Milliseconds'} for name in self.timings]
+        metrics += [{'Name': name, 'Unit': 'Count'} for name in self.counts]
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(self.dimensions)],
+                    'Metrics': metrics
+                }]
+            },
+            **self.dimensions,
+            **{f"{name}Time": round(seconds * 1000, 3) for name, seconds in self.timings.items()},
+            **self.counts
+        }
+
+    def emit(self):
+        if not self.enabled or not (self.timings or self.counts):
+            return
+        print(json.dumps(self.to_emf()))
@@ -0,0 +1,75 @@
+import threading
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from awsClients import MAX_POOL_CONNECTIONS
+
+MAX_NOTIFY_WORKERS = MAX_POOL_CONNECTIONS # More threads would wait for a connection
+
+# Module level, so every notifier and warm lambda invocation reuses the same threads
+_lock = threading.Lock()
+_executors:dict[int,ThreadPoolExecutor] = {} # Max workers -> executor
+
+def get_executor(max_workers: int):
+    """
+    Returns the shared executor with max_workers threads, created on first use. Threads are only started when needed.
+    """
+    with _lock:
+        executor = _executors.get(max_workers)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='notifier')
+            _executors[max_workers] = executor
+        return executor
+
+class NotificationResult:
+    """
+    Outcome of posting a message to a group of connections
+    """
+    def __init__(self):
+        self.sent:list[str] = []
+        self.gone:list[str] = [] # Connections closed on the client side (GoneException), their items are stale
+        self.failed:list[str] = [] # Connections that failed for any other reason
+
+    def all_sent(self):
+        return not self.gone and not self.failed
+
+class WebSocketNotifier:
+    """
+    Posts messages to websocket connections concurrently through the API Gateway management client
+    """
+    def __init__(self, apigw_client, max_workers: int = MAX_NOTIFY_WORKERS):
+        self.apigw_client = apigw_client
+        self.executor = get_executor(max_workers)
+
+    def _post(self, connection_id: str, message: str):
+        try:
+            self.apigw_client.post_to_connection(
+                ConnectionId=connection_id,
+                Data=message
+            )
+            return 'sent'
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'GoneException':
+                return 'gone'
+            print(f'Error posting to connection {connection_id}: {e}')
+            return 'failed'
+        except Exception as e:
+            print(f'Error posting to connection {connection_id}: {e}')
+            return 'failed'
+
+    def post(self, connection_ids: list[str], message: str):
+        """
+        Sends the message to every connection, all posts are attempted even when some of them fail.
+        Returns a NotificationResult with the connections grouped by outcome.
+        """
+        result = NotificationResult()
+        if not connection_ids:
+            return result
+
+        if len(connection_ids) == 1: # Not worth a thread hop
+            outcomes = [self._post(connection_ids[0], message)]
+        else:
+            outcomes = list(self.executor.map(lambda connection_id: self._post(connection_id, message), connection_ids))
+
+        for connection_id, outcome in zip(connection_ids, outcomes):
+            getattr(result, outcome).append(connection_id)
+        return result
@@ -0,0 +1,282 @@
+"""
+Checks that QueueState and StreamQueueFeed keep the queue in step with the connection table stream,
+against an in-memory stand-in for the dynamodbstreams client.
+
+python -m pytest queue_state_test.py
+"""
+import os
+import sys
+import unittest
+from decimal import Decimal
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'matchmakingApi'))
+
+import queueState
+from queueState import QueueState, StreamQueueFeed, StreamFeedExpired
+from matchmakingTableRepository import User
+
+TABLE_PK = 'connectionId'
+STREAM_ARN = 'arn:aws:dynamodb:local:000000000000:table/Connections/stream/local'
+
+def queue_item(connection_id: str, rating: int, joined_at: int, region: str = 'eu'):
+    return {
+        TABLE_PK: connection_id,
+        'UserId': f'user-{connection_id}',
+        'Rating': rating,
+        'RD': 100,
+        'Vol': Decimal('0.06'),
+        'Matchmaking_Region': region,
+        'JoinedAt': joined_at
+    }
+
+def item_to_user(item: dict):
+    """
+    Same as the repository's, raises KeyError for connections that are not in queue
+    """
+    return User(
+        connection_id=item[TABLE_PK],
+        user_id=item['UserId'],
+        rating=int(item['Rating']),
+        rd=int(item['RD']),
+        vol=Decimal(item['Vol']),
+        region=item['Matchmaking_Region'],
+        joined_at=int(item['JoinedAt'])
+    )
+
+def stream_error(code: str):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'GetRecords')
+
+class FakeShard:
+    def __init__(self, shard_id: str, parent_id: str = None):
+        self.shard_id = shard_id
+        self.parent_id = parent_id
+        self.records:list[dict] = []
+        self.closed = False
+        self.trimmed = 0 # Records before this position are past the stream's retention
+
+class FakeStreamsClient:
+    """
+    Stands in for the dynamodbstreams client: shards with parents, iterators that can expire and records that can be trimmed
+    """
+    def __init__(self, page_size: int = 100, describe_page_size: int = 100):
+        self.page_size = page_size # Records returned by each get_records call
+        self.describe_page_size = describe_page_size # Shards returned by each describe_stream call
+        self.shards:list[FakeShard] = []
+        self._iterators:dict[str,tuple[str,int]] = {}
+        self._expired:set[str] = set()
+        self._serializer = TypeSerializer()
+
+    def add_shard(self, shard_id: str, parent_id: str = None):
+        shard = FakeShard(shard_id, parent_id)
+        self.shards.append(shard)
+        return shard
+
+    def shard(self, shard_id: str):
+        return next(shard for shard in self.shards if shard.shard_id == shard_id)
+
+    def split(self, shard_id: str, *child_ids: str):
+        self.shard(shard_id).closed = True
+        return [self.add_shard(child_id, shard_id) for child_id in child_ids]
+
+    def put(self, shard_id: str, connection_id: str, item: dict = None):
+        """
+        Records a change of a connection item, item None records its deletion
+        """
+        change = {'Keys': {TABLE_PK: self._serializer.serialize(connection_id)}}
+        if item is not None:
+            change['NewImage'] = {key: self._serializer.serialize(value) for key, value in item.items()}
+        self.shard(shard_id).records.append({'eventName': 'MODIFY' if item is not None else 'REMOVE', 'dynamodb': change})
+
+    def expire_iterators(self):
+        self._expired.update(self._iterators)
+
+    def _new_iterator(self, shard_id: str, position: int):
+        token = f'{shard_id}/{len(self._iterators)}'
+        self._iterators[token] = (shard_id, position)
+        return token
+
+    def describe_stream(self, StreamArn: str, ExclusiveStartShardId: str = None):
+        start = 0
+        if ExclusiveStartShardId is not None:
+            start = [shard.shard_id for shard in self.shards].index(ExclusiveStartShardId) + 1
+        page = self.shards[start:start + self.describe_page_size]
+        description = {'Shards': []}
+        for shard in page:
+            sequence_range = {'StartingSequenceNumber': '0'}
+            if shard.closed:
+                sequence_range['EndingSequenceNumber'] = str(len(shard.records))
+            description['Shards'].append({'ShardId': shard.shard_id, 'SequenceNumberRange': sequence_range, **({'ParentShardId': shard.parent_id} if shard.parent_id else {})})
+        if start + self.describe_page_size < len(self.shards):
+            description['LastEvaluatedShardId'] = page[-1].shard_id
+        return {'StreamDescription': description}
+
+    def get_shard_iterator(self, StreamArn: str, ShardId: str, ShardIteratorType: str):
+        shard = self.shard(ShardId)
+        position = len(shard.records) if ShardIteratorType == 'LATEST' else shard.trimmed
+        return {'ShardIterator': self._new_iterator(ShardId, position)}
+
+    def get_records(self, ShardIterator: str):
+        if ShardIterator in self._expired:
+            raise stream_error('ExpiredIteratorException')
+        shard_id, position = self._iterators[ShardIterator]
+        shard = self.shard(shard_id)
+        if position < shard.trimmed:
+            raise stream_error('TrimmedDataAccessException')
+        records = shard.records[position:position + self.page_size]
+        response = {'Records': records}
+        if not (shard.closed and position + len(records) >= len(shard.records)): # Closed shards read to the end have no next iterator
+            response['NextShardIterator'] = self._new_iterator(shard_id, position + len(records))
+        return response
+
+class QueueStateTest(unittest.TestCase):
+    def test_region_queues_are_sorted(self):
+        state = QueueState(item_to_user)
+        state.load({'eu': [item_to_user(queue_item('a', 1600, 1)), item_to_user(queue_item('b', 1400, 2))]})
+        state.upsert(item_to_user(queue_item('c', 1500, 3)))
+        state.upsert(item_to_user(queue_item('d', 1700, 4, region='us')))
+        self.assertEqual([user.connection_id for user in state.region_queue('eu')], ['a', 'b', 'c'])
+        self.assertEqual([user.connection_id for user in state.region_queue_by_rating('eu')], ['b', 'c', 'a'])
+        self.assertEqual(sorted(state.regions()), ['eu', 'us'])
+
+    def test_upsert_replaces_the_previous_entry(self):
+        state = QueueState(item_to_user)
+        state.upsert(item_to_user(queue_item('a', 1600, 1)))
+        state.upsert(item_to_user(queue_item('a', 1400, 5, region='us'))) # Rejoined in another region
+        self.assertEqual(len(state), 1)
+        self.assertEqual(state.region_queue('eu'), [])
+        self.assertEqual(state.region_queue_by_rating('us')[0].rating, 1400)
+
+    def test_apply_item_removes_connections_not_in_queue(self):
+        state = QueueState(item_to_user)
+        state.apply_item('a', queue_item('a', 1600, 1))
+        left_queue = queue_item('a', 1600, 1)
+        del left_queue['JoinedAt']
+        state.apply_item('a', left_queue)
+        self.assertEqual(len(state), 0)
+        state.apply_item('b', queue_item('b', 1500, 2))
+        state.apply_item('b', None)
+        state.apply_item('missing', None) # Deletion of a connection that was never queued
+        self.assertEqual(len(state), 0)
+
+class StreamQueueFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.streams = FakeStreamsClient()
+        self.state = QueueState(item_to_user)
+        self.feed = StreamQueueFeed(self.streams, STREAM_ARN, self.state, TABLE_PK)
+
+    def queued(self, region: str = 'eu'):
+        return {user.connection_id: user.rating for user in self.state.region_queue(region)}
+
+    def test_changes_before_start_are_left_to_the_snapshot(self):
+        self.streams.add_shard('shard-1')
+        self.streams.put('shard-1', 'old', queue_item('old', 1500, 1))
+        self.feed.start()
+        self.streams.put('shard-1', 'new', queue_item('new', 1600, 2))
+        self.assertEqual(self.feed.poll(), 1)
+        self.assertEqual(self.queued(), {'new': 1600})
+        self.assertEqual(self.feed.poll(), 0)
+
+    def test_changes_during_the_snapshot_are_applied_again(self):
+        self.streams.add_shard('shard-1')
+        self.feed.start()
+        # Written while the snapshot was read: the join is in the snapshot, the leave isn't
+        self.streams.put('shard-1', 'joined', queue_item('joined', 1500, 2))
+        self.streams.put('shard-1', 'left', None)
+        self.state.load({'eu': [item_to_user(queue_item('joined', 1500, 2)), item_to_user(queue_item('left', 1400, 1))]})
+        self.feed.poll()
+        self.assertEqual(self.queued(), {'joined': 1500})
+        self.assertEqual(len(self.state), 1)
+
+    def test_closed_shards_at_start_are_not_read(self):
+        self.streams.add_shard('shard-1')
+        self.streams.put('shard-1', 'old', queue_item('old', 1500, 1))
+        self.streams.split('shard-1', 'shard-2')
+        self.feed.start()
+        self.streams.put('shard-2', 'new', queue_item('new', 1600, 2))
+        self.feed.poll()
+        self.assertEqual(self.queued(), {'new': 1600})
+
+    def test_children_are_read_after_their_parent(self):
+        self.streams.add_shard('shard-1')
+        self.feed.start()
+        self.streams.put('shard-1', 'a', queue_item('a', 1500, 1))
+        self.streams.split('shard-1', 'shard-2', 'shard-3')
+        self.streams.put('shard-2', 'a', queue_item('a', 1550, 1))
+        self.streams.put('shard-3', 'b', queue_item('b', 1450, 2))
+        self.assertEqual(self.feed.poll(), 3)
+        self.assertEqual(self.queued(), {'a': 1550, 'b': 1450})
+
+    def test_children_wait_for_a_parent_read_over_several_polls(self):
+        self.streams.page_size = 1
+        original_max_pages = queueState.MAX_PAGES_PER_SHARD
+        queueState.MAX_PAGES_PER_SHARD = 2
+        self.addCleanup(setattr, queueState, 'MAX_PAGES_PER_SHARD', original_max_pages)
+        self.streams.add_shard('shard-1')
+        self.feed.start()
+        for rating in (1500, 1510, 1520):
+            self.streams.put('shard-1', 'a', queue_item('a', rating, 1))
+        self.streams.split('shard-1', 'shard-2')
+        self.streams.put('shard-2', 'a', queue_item('a', 1600, 1))
+        self.feed.poll()
+        self.assertEqual(self.queued(), {'a': 1510}) # The child's newer rating is not applied before the parent's
+        self.feed.poll()
+        self.assertEqual(self.queued(), {'a': 1600})
+
+    def test_shards_are_described_over_several_pages(self):
+        self.streams.describe_page_size = 1
+        for shard_id in ('shard-1', 'shard-2', 'shard-3'):
+            self.streams.add_shard(shard_id)
+        self.feed.start()
+        for index, shard_id in enumerate(('shard-1', 'shard-2', 'shard-3')):
+            self.streams.put(shard_id, f'c{index}', queue_item(f'c{index}', 1500 + index, index))
+        self.assertEqual(self.feed.poll(), 3)
+
+    def test_new_shards_without_a_known_parent_are_read_from_the_start(self):
+        self.streams.add_shard('shard-1')
+        self.feed.start()
+        self.streams.add_shard('shard-2')
+        self.streams.put('shard-2', 'a', queue_item('a', 1500, 1))
+        self.feed.poll()
+        self.assertEqual(self.queued(), {'a': 1500})
+
+    def test_expired_iterator_raises_stream_feed_expired(self):
+        self.streams.add_shard('shard-1')
+        self.feed.start()
+        self.streams.expire_iterators()
+        with self.assertRaises(StreamFeedExpired):
+            self.feed.poll()
+
+    def test_trimmed_records_raise_stream_feed_expired(self):
+        shard = self.streams.add_shard('shard-1')
+        self.feed.start()
+        self.streams.put('shard-1', 'a', queue_item('a', 1500, 1))
+        shard.trimmed = len(shard.records)
+        with self.assertRaises(StreamFeedExpired):
+            self.feed.poll()
+
+    def test_feed_recovers_after_restart(self):
+        shard = self.streams.add_shard('shard-1')
+        self.feed.start()
+        self.streams.put('shard-1', 'a', queue_item('a', 1500, 1))
+        shard.trimmed = len(shard.records)
+        with self.assertRaises(StreamFeedExpired):
+            self.feed.poll()
+        self.feed.start() # As the handlers do: start again, then reload the snapshot
+        self.state.load({'eu': [item_to_user(queue_item('a', 1500, 1))]})
+        self.streams.put('shard-1', 'b', queue_item('b', 1600, 2))
+        self.feed.poll()
+        self.assertEqual(self.queued(), {'a': 1500, 'b': 1600})
+
+    def test_other_errors_are_raised(self):
+        self.streams.add_shard('shard-1')
+        self.feed.start()
+        def throttled(**kwargs):
+            raise stream_error('LimitExceededException')
+        self.streams.get_records = throttled
+        with self.assertRaises(ClientError):
+            self.feed.poll()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Checks the anchors picked by ReevaluationEngine against their definition on randomized queues.
+
+python -m pytest search_window_test.py
+"""
+import os
+import random
+import sys
+import unittest
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'matchmakingApi'))
+
+from searchWindow import SearchWindowCurve, ReevaluationEngine
+from matchmakingTableRepository import User
+
+CURVE = 'shape=linear,step_seconds=10,step_growth=25,max_delta=500'
+NOW = 1_000_000
+
+def random_users(players: int, rng: random.Random, prefix: str, joined_before: int):
+    return [
+        User(
+            user_id=f"{prefix}-user-{i}",
+            rating=int(rng.gauss(1500, 300)),
+            rd=rng.choice([30, 50, 70, 120, 200, 350]),
+            vol=Decimal('0.06'),
+            region='test',
+            joined_at=NOW - rng.randint(1, joined_before),
+            connection_id=f"{prefix}-{i}"
+        )
+        for i in range(players)
+    ]
+
+class ReevaluationEngineTest(unittest.TestCase):
+    def test_anchors_are_the_arrivals_and_the_players_covering_them(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                curve = SearchWindowCurve.from_string(CURVE)
+                engine = ReevaluationEngine(curve)
+                waiting = random_users(rng.randint(0, 300), rng, 'waiting', 120)
+                self.assertEqual(engine.anchors('test', waiting, NOW), {user.connection_id for user in waiting})
+
+                arrivals = random_users(rng.randint(0, 10), rng, 'arrival', 1)
+                queue = waiting + arrivals
+                anchors = engine.anchors('test', queue, NOW + 0.5) # No window grows in between
+                expected = {user.connection_id for user in arrivals} | {
+                    user.connection_id for user in queue
+                    if any(abs(user.rating - arrival.rating) <= curve.delta(user.rd, NOW + 0.5 - user.joined_at) for arrival in arrivals)
+                }
+                self.assertEqual(anchors, expected)
+
+    def test_players_are_anchors_again_when_their_window_grows(self):
+        engine = ReevaluationEngine(SearchWindowCurve.from_string(CURVE))
+        user = random_users(1, random.Random(0), 'waiting', 1)[0]
+        user.joined_at = NOW
+        engine.anchors('test', [user], NOW)
+        self.assertEqual(engine.anchors('test', [user], NOW + 5), set())
+        self.assertEqual(engine.anchors('test', [user], NOW + 10), {user.connection_id})
+
+    def test_forgotten_players_are_new_again(self):
+        engine = ReevaluationEngine(SearchWindowCurve())
+        users = random_users(5, random.Random(0), 'waiting', 60)
+        engine.anchors('test', users, NOW)
+        engine.forget('test', [users[0].connection_id])
+        self.assertIn(users[0].connection_id, engine.anchors('test', users, NOW))
+
+if __name__ == '__main__':
+    unittest.main()
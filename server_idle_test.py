@@ -0,0 +1,95 @@
+"""
+Checks that the serverIdle handler takes the region and ip of a server from its ECS task, with AWS mocked.
+
+python -m pytest server_idle_test.py
+"""
+import importlib.util
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+os.environ.setdefault('SERVER_POOL_TABLE_NAME', 'test')
+
+repository_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(repository_root, 'matchmakingApi'))
+
+import gameServerPool
+
+# Loaded under its own name, every handler is an app module
+spec = importlib.util.spec_from_file_location('serverIdle', os.path.join(repository_root, 'matchmakingApi', 'HTTP', 'serverIdle', 'app.py'))
+server_idle = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(server_idle)
+
+TASK_ARN = 'arn:aws:ecs:eu-west-1:123456789012:task/MATCHMAKING-CLUSTER/0123456789abcdef0123456789abcdef'
+
+def describe_tasks(last_status='RUNNING', task_definition='matchmaking-server'):
+    return {'tasks': [{
+        'taskArn': TASK_ARN,
+        'lastStatus': last_status,
+        'taskDefinitionArn': f'arn:aws:ecs:eu-west-1:123456789012:task-definition/{task_definition}:3',
+        'attachments': [{
+            'type': 'ElasticNetworkInterface',
+            'details': [{'name': 'networkInterfaceId', 'value': 'eni-1'}, {'name': 'privateIPv4Address', 'value': '10.0.0.5'}]
+        }]
+    }]}
+
+class ParseTaskArnTest(unittest.TestCase):
+    def test_region_of_a_cluster_task(self):
+        self.assertEqual(gameServerPool.parse_task_arn(TASK_ARN), 'eu-west-1')
+
+    def test_rejects_other_arns(self):
+        for task_arn in ('', 'arn:', 'arn:aws:ecs', 'arn:aws:ecs:eu-west-1:123456789012:task/OTHER-CLUSTER/0123456789abcdef0123456789abcdef',
+                         'arn:aws:s3:eu-west-1:123456789012:task/MATCHMAKING-CLUSTER/0123456789abcdef0123456789abcdef',
+                         TASK_ARN + '/extra'):
+            with self.subTest(task_arn=task_arn):
+                self.assertIsNone(gameServerPool.parse_task_arn(task_arn))
+
+class GetServerTaskIpTest(unittest.TestCase):
+    def get_ip(self, tasks_response):
+        clients = {'ecs': mock.MagicMock(), 'ec2': mock.MagicMock()}
+        clients['ecs'].describe_tasks.return_value = tasks_response
+        clients['ec2'].describe_network_interfaces.return_value = {'NetworkInterfaces': [{'Association': {'PublicIp': '203.0.113.7'}}]}
+        with mock.patch.object(gameServerPool, 'get_client', side_effect=lambda service, region_name: clients[service]):
+            return gameServerPool.get_server_task_ip(TASK_ARN, 'eu-west-1')
+
+    def test_public_ip_of_a_running_server(self):
+        self.assertEqual(self.get_ip(describe_tasks()), '203.0.113.7')
+
+    def test_none_for_tasks_that_are_not_running_servers(self):
+        self.assertIsNone(self.get_ip({'tasks': [], 'failures': [{'reason': 'MISSING'}]}))
+        self.assertIsNone(self.get_ip(describe_tasks(last_status='STOPPED')))
+        self.assertIsNone(self.get_ip(describe_tasks(task_definition='other')))
+
+class ServerIdleTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = mock.MagicMock()
+        for name, value in (('GameServerPoolRepository', mock.MagicMock(return_value=self.pool)), ('get_server_task_ip', mock.MagicMock(return_value='203.0.113.7'))):
+            patcher = mock.patch.object(server_idle, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def handle(self, body, headers=None):
+        body = body if isinstance(body, str) or body is None else json.dumps(body)
+        return server_idle.lambda_handler({'body': body, 'headers': headers or {}}, None)
+
+    def test_registers_the_task_ip_not_the_forwarded_one(self):
+        response = self.handle({'task_arn': TASK_ARN, 'assign_token': 'token'}, {'X-Forwarded-For': '198.51.100.1'})
+        self.assertEqual(response['statusCode'], 200)
+        self.pool.set_server_idle.assert_called_once_with('eu-west-1', TASK_ARN, '203.0.113.7', 'token')
+
+    def test_rejects_bad_requests(self):
+        for body in ('{not json', 'null', '[]', None, {'task_arn': 'arn:aws', 'assign_token': 'token'},
+                     {'task_arn': TASK_ARN}, {'task_arn': 5, 'assign_token': 'token'}):
+            with self.subTest(body=body):
+                self.assertEqual(self.handle(body)['statusCode'], 400)
+        self.pool.set_server_idle.assert_not_called()
+
+    def test_rejects_tasks_that_are_not_running_servers(self):
+        server_idle.get_server_task_ip.return_value = None
+        self.assertEqual(self.handle({'task_arn': TASK_ARN, 'assign_token': 'token'})['statusCode'], 403)
+        self.pool.set_server_idle.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Checks that WebSocketNotifier groups the connections by outcome and reuses its threads, with the API Gateway client mocked.
+
+python -m pytest websocket_notifier_test.py
+"""
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'matchmakingApi'))
+
+from websocketNotifier import WebSocketNotifier
+
+def post_to_connection(ConnectionId, Data):
+    if ConnectionId.startswith('gone'):
+        raise ClientError({'Error': {'Code': 'GoneException', 'Message': 'gone'}}, 'PostToConnection')
+    if ConnectionId.startswith('failed'):
+        raise ClientError({'Error': {'Code': 'LimitExceededException', 'Message': 'slow down'}}, 'PostToConnection')
+
+class WebSocketNotifierTest(unittest.TestCase):
+    def setUp(self):
+        self.threads:list[str] = []
+        def record_thread(ConnectionId, Data):
+            self.threads.append(threading.current_thread().name)
+            post_to_connection(ConnectionId, Data)
+        self.client = mock.MagicMock()
+        self.client.post_to_connection.side_effect = record_thread
+
+    def test_groups_connections_by_outcome(self):
+        result = WebSocketNotifier(self.client).post(['sent-1', 'gone-1', 'failed-1', 'sent-2'], 'match')
+        self.assertEqual(result.sent, ['sent-1', 'sent-2'])
+        self.assertEqual(result.gone, ['gone-1'])
+        self.assertEqual(result.failed, ['failed-1'])
+        self.assertFalse(result.all_sent())
+
+    def test_single_connection_is_posted_inline(self):
+        self.assertEqual(WebSocketNotifier(self.client).post(['sent-1'], 'match').sent, ['sent-1'])
+        self.assertEqual(self.threads, [threading.current_thread().name])
+
+    def test_notifiers_share_their_threads(self):
+        self.assertIs(WebSocketNotifier(self.client).executor, WebSocketNotifier(mock.MagicMock()).executor)
+        notifier = WebSocketNotifier(self.client, max_workers=2)
+        for _ in range(5):
+            notifier.post([f'sent-{i}' for i in range(10)], 'match')
+        self.assertLessEqual(len(set(self.threads)), 2)
+
+if __name__ == '__main__':
+    unittest.main()